@@ -2,6 +2,8 @@
 ASGI config for agent_med project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Run it with ``uvicorn core.asgi:application`` to serve the async views under
+``api/async/`` without tying up a thread per in-flight LLM call.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
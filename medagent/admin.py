@@ -9,7 +9,7 @@ from django.contrib import admin
 from simple_history.admin import SimpleHistoryAdmin
 from medagent.models import (
     PatientProfile, PatientSummary, OTPVerification,
-    AccessHistory, ChatSession, ChatMessage, SessionSummary
+    AccessHistory, ChatSession, ChatMessage, SessionSummary, SMSDelivery
 )
 
 admin.site.register(PatientProfile)
@@ -19,3 +19,5 @@ admin.site.register(AccessHistory)
 admin.site.register(ChatSession)
 admin.site.register(ChatMessage, SimpleHistoryAdmin)
 admin.site.register(SessionSummary)
+
+admin.site.register(SMSDelivery)
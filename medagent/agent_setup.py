@@ -13,6 +13,7 @@ from medagent.tools import (
     SummarizeSessionTool,
     ImageAnalysisTool,
     ProfanityCheckTool,
+    MedicalKnowledgeTool,
 )
 
 from medagent.talkbot_llm import TalkBotLLM  # Custom LLM wrapper
@@ -23,10 +24,11 @@ TOOLS = [
     SummarizeSessionTool(),
     ImageAnalysisTool(),
     ProfanityCheckTool(),
+    MedicalKnowledgeTool(),
 ]
 
-# Instantiate LLM (customized for TalkBot API)
-llm = TalkBotLLM(model="o3-mini")
+# Instantiate LLM (customized for TalkBot API); the model is chosen per call by the router
+llm = TalkBotLLM()
 
 # Initialize agent with zero-shot ReAct
 agent = initialize_agent(
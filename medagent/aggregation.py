@@ -0,0 +1,151 @@
+"""
+Incremental PatientSummary aggregation.
+
+Each new SessionSummary is folded into its patient's running
+``PatientSummary.json_data`` on the background ``summary_queue``. Only that
+one session summary is read, so keeping the patient summary current costs
+O(new sessions) rather than re-reading the whole history.
+
+Merging is deterministic:
+
+* ``session_count`` and ``last_session_at`` are counters;
+* ``chief_complaints`` maps each complaint to how often and when it was last
+  reported;
+* other list fields of ``json_summary`` are unioned in order, dict fields are
+  merged key by key, and scalars keep the value from the newest session, so
+  out-of-order folds give the same result;
+* ``notes`` collects each session's ``text_summary``. Once it is longer than
+  ``settings.PATIENT_SUMMARY_CONDENSE_CHARS`` it is condensed by the summary
+  model, outside the transaction and at batch priority.
+
+``SessionSummary.folded_at`` records which sessions are already in the
+patient summary. It is claimed with a conditional UPDATE in the same
+transaction as the merge, so a session is folded exactly once even if the
+task is retried or the backfill command runs concurrently.
+"""
+
+import json
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.exceptions import APIException
+
+from medagent.background import BackgroundQueue
+from medagent.llm_scheduler import BATCH, llm_work
+from medagent.model_router import estimate_tokens, router
+from medagent.models import PatientSummary, SessionSummary
+
+logger = logging.getLogger(__name__)
+
+summary_queue = BackgroundQueue("summary", workers=1)
+
+# کلیدهایی که جداگانه ادغام می‌شوند یا نباید در خلاصه‌ی بیمار بیایند
+_SPECIAL_KEYS = {"text_summary", "chief_complaint", "token_count"}
+
+CONDENSE_PROMPT = (
+    "Condense these dated consultation notes about one patient into a shorter "
+    "clinical history. Keep diagnoses, medications, allergies, dates and open "
+    "problems. Reply as JSON with text_summary and token_count."
+)
+
+
+def merge_session(data: dict, session_summary) -> dict:
+    """Return ``data`` with one SessionSummary merged in."""
+    data = dict(data)
+    when = session_summary.generated_at.isoformat()
+    newest = when >= data.get("last_session_at", "")
+    data["session_count"] = data.get("session_count", 0) + 1
+    data["last_session_at"] = max(when, data.get("last_session_at", ""))
+
+    fields = session_summary.json_summary if isinstance(session_summary.json_summary, dict) else {}
+    complaint = (fields.get("chief_complaint") or "").strip()
+    if complaint:
+        complaints = dict(data.get("chief_complaints", {}))
+        seen = complaints.get(complaint, {"count": 0, "last_seen": ""})
+        complaints[complaint] = {"count": seen["count"] + 1, "last_seen": max(when, seen["last_seen"])}
+        data["chief_complaints"] = complaints
+
+    for key, value in fields.items():
+        if key in _SPECIAL_KEYS:
+            continue
+        current = data.get(key)
+        if isinstance(value, list) and isinstance(current, list):
+            data[key] = current + [item for item in value if item not in current]
+        elif isinstance(value, dict) and isinstance(current, dict):
+            data[key] = {**current, **value} if newest else {**value, **current}
+        elif current is None or newest:
+            data[key] = value
+
+    text = (session_summary.text_summary or "").strip()
+    if text:
+        entry = f"[{session_summary.generated_at.date().isoformat()}] {text}"
+        data["notes"] = f"{data['notes']}\n{entry}" if data.get("notes") else entry
+    return data
+
+
+def fold_session_summary(session_summary_id: int) -> bool:
+    """Merge one SessionSummary into its patient's summary; False if it was already folded."""
+    with transaction.atomic():
+        claimed = SessionSummary.objects.filter(id=session_summary_id, folded_at__isnull=True).update(
+            folded_at=timezone.now(),
+        )
+        if not claimed:
+            return False
+        session_summary = SessionSummary.objects.select_related("session").get(id=session_summary_id)
+        patient_summary, _ = PatientSummary.objects.select_for_update().get_or_create(
+            patient_id=session_summary.session.patient_id,
+        )
+        patient_summary.json_data = merge_session(patient_summary.json_data, session_summary)
+        patient_summary.save(update_fields=["json_data", "updated_at"])
+    if len(patient_summary.json_data.get("notes", "")) > settings.PATIENT_SUMMARY_CONDENSE_CHARS:
+        condense_notes(patient_summary.patient_id, session_summary.session.owner_id)
+    return True
+
+
+def condense_notes(patient_id: int, user_id=None) -> bool:
+    """Re-condense the patient's free-text notes with the summary model."""
+    from medagent.talkbot_client import tb_chat
+
+    notes = PatientSummary.objects.filter(patient_id=patient_id).values_list("json_data", flat=True).first()
+    notes = (notes or {}).get("notes", "")
+    messages = [{"role": "system", "content": CONDENSE_PROMPT}, {"role": "user", "content": notes}]
+    try:
+        with llm_work(BATCH, user_id):
+            result = tb_chat(messages, model=router.choose("summary", estimate_tokens(messages)))
+    except APIException:
+        # صف LLM پر است؛ در fold بعدی دوباره تلاش می‌شود
+        logger.warning("Skipped condensing notes for patient %s: LLM overloaded", patient_id)
+        return False
+    try:
+        reply = json.loads(result)
+    except ValueError:
+        return False
+    condensed = (reply.get("text_summary") or "").strip() if isinstance(reply, dict) else ""
+    # پاسخ خطای talkbot_client شمارش توکن صفر دارد و نباید جای یادداشت‌ها را بگیرد
+    if not condensed or not reply.get("token_count"):
+        return False
+
+    with transaction.atomic():
+        patient_summary = PatientSummary.objects.select_for_update().get(patient_id=patient_id)
+        current = patient_summary.json_data.get("notes", "")
+        if not current.startswith(notes):
+            return False
+        # یادداشت‌هایی که در حین فراخوانی مدل اضافه شده‌اند حفظ می‌شوند
+        patient_summary.json_data = {**patient_summary.json_data, "notes": condensed + current[len(notes):]}
+        patient_summary.save(update_fields=["json_data", "updated_at"])
+    return True
+
+
+def fold_pending(batch_size: int = 500) -> int:
+    """Fold every SessionSummary not yet in its patient summary, oldest first."""
+    folded = 0
+    while True:
+        ids = list(
+            SessionSummary.objects.filter(folded_at__isnull=True)
+            .order_by("generated_at", "id").values_list("id", flat=True)[:batch_size]
+        )
+        if not ids:
+            return folded
+        folded += sum(fold_session_summary(summary_id) for summary_id in ids)
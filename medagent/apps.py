@@ -2,10 +2,15 @@
 App configuration for the medagent Django application.
 
 This ensures that signal handlers are connected when the application
-starts. The ready() method imports signal modules to register them.
+starts. The ready() method imports signal modules to register them and
+refuses to start a non-DEBUG deployment on the per-process cache: the
+idempotency store, the token revocation denylist and the OTP rate and
+attempt counters only work across workers on a shared cache.
 """
 
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 
 class MedAgentConfig(AppConfig):
     name = 'medagent'
@@ -13,3 +18,13 @@ class MedAgentConfig(AppConfig):
     def ready(self):
         # Import signal handlers
         import medagent.signals  # noqa: F401
+        check_shared_cache()
+
+
+def check_shared_cache():
+    backend = settings.CACHES["default"]["BACKEND"]
+    if not settings.DEBUG and backend.endswith(".LocMemCache"):
+        raise ImproperlyConfigured(
+            "The default cache is per-process LocMemCache; set REDIS_URL so idempotency keys, "
+            "token revocation and OTP limits are shared between workers."
+        )
@@ -0,0 +1,203 @@
+"""
+Cold-storage archival of ended chat sessions.
+
+``archive_sessions`` moves sessions that ended more than
+``settings.ARCHIVE_AFTER_DAYS`` ago out of the hot tables. Their messages,
+historical message rows and session summary are written as one JSON line,
+compressed as its own zstd frame, and appended to the current segment file
+in ``settings.ARCHIVE_DIR``:
+
+* ``segment-NNNNNN.jsonl.zst`` – concatenated frames; the whole file also
+  decompresses as plain JSONL with ``zstd -d``;
+* ``segment-NNNNNN.idx`` – one ``{"session", "offset", "length"}`` line per
+  frame, so a segment can be audited or re-indexed without the database.
+
+Segments are append-only and rotate at ``settings.ARCHIVE_SEGMENT_BYTES``.
+Only one archiver appends at a time (``flock`` on ``.lock``). The frame is
+fsynced before the hot rows are deleted. The ChatSession row stays as a stub
+that records where its frame lives (``archive_segment``, ``archive_offset``,
+``archive_length``), so ownership checks and foreign keys keep working.
+
+Reads that need the transcript or summary call ``rehydrate(session)``,
+which reads the one frame and bulk-inserts the rows back with their original
+ids. A rehydrated session is archived again only after another
+``ARCHIVE_AFTER_DAYS`` without being rehydrated; its old frame is left in
+place.
+"""
+
+import datetime
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+from pathlib import Path
+
+import zstandard
+from django.conf import settings
+from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, router, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from medagent.models import ChatMessage, ChatSession, SessionSummary
+
+HistoricalChatMessage = ChatMessage.history.model
+
+
+def _directory() -> Path:
+    directory = Path(settings.ARCHIVE_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+
+@contextmanager
+def _segment_lock():
+    with open(_directory() / ".lock", "a") as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def _current_segment() -> str:
+    segments = sorted(_directory().glob("segment-*.jsonl.zst"))
+    if segments and segments[-1].stat().st_size < settings.ARCHIVE_SEGMENT_BYTES:
+        return segments[-1].name
+    number = int(segments[-1].name[8:14]) + 1 if segments else 1
+    return f"segment-{number:06d}.jsonl.zst"
+
+
+class _ArchiveEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        # DjangoJSONEncoder میکروثانیه‌ها را حذف می‌کند و cursorهای صفحه‌بندی به آن‌ها وابسته‌اند
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def _serialize(session_id, messages, history, summaries) -> bytes:
+    record = {
+        "session": session_id,
+        "messages": serializers.serialize("python", messages),
+        "history": serializers.serialize("python", history),
+        "summary": serializers.serialize("python", summaries),
+    }
+    return (json.dumps(record, cls=_ArchiveEncoder, ensure_ascii=False) + "\n").encode()
+
+
+def _group(queryset, ids):
+    grouped = {session_id: [] for session_id in ids}
+    for row in queryset.filter(session_id__in=ids).order_by("pk"):
+        grouped[row.session_id].append(row)
+    return grouped
+
+
+def _append(frames):
+    """Append ``[(session_id, bytes)]``; returns ``{session_id: (segment, offset, length)}``."""
+    compressor = zstandard.ZstdCompressor(level=settings.ARCHIVE_COMPRESSION_LEVEL, write_checksum=True)
+    locations = {}
+    with _segment_lock():
+        segment = _current_segment()
+        path = _directory() / segment
+        with open(path, "ab") as data, open(path.with_name(segment.replace(".jsonl.zst", ".idx")), "a") as index:
+            offset = data.tell()
+            for session_id, raw in frames:
+                frame = compressor.compress(raw)
+                data.write(frame)
+                index.write(json.dumps({"session": session_id, "offset": offset, "length": len(frame)}) + "\n")
+                locations[session_id] = (segment, offset, len(frame))
+                offset += len(frame)
+            data.flush()
+            os.fsync(data.fileno())
+            index.flush()
+            os.fsync(index.fileno())
+    return locations
+
+
+def archivable(now=None, days=None):
+    days = settings.ARCHIVE_AFTER_DAYS if days is None else days
+    cutoff = (now or timezone.now()) - datetime.timedelta(days=days)
+    return ChatSession.objects.filter(
+        Q(rehydrated_at__isnull=True) | Q(rehydrated_at__lt=cutoff),
+        ended_at__lt=cutoff, archived_at__isnull=True,
+    )
+
+
+def archive_sessions(now=None, batch_size=None, days=None) -> int:
+    """Archive every eligible session, ``batch_size`` sessions per segment write and transaction."""
+    batch_size = batch_size or settings.ARCHIVE_BATCH_SIZE
+    archived, last_id = 0, 0
+    while True:
+        ids = list(archivable(now, days).filter(id__gt=last_id).order_by("id").values_list("id", flat=True)[:batch_size])
+        if not ids:
+            return archived
+        last_id = ids[-1]
+        messages = _group(ChatMessage.objects, ids)
+        history = _group(HistoricalChatMessage.objects, ids)
+        summaries = _group(SessionSummary.objects, ids)
+        locations = _append(
+            [(sid, _serialize(sid, messages[sid], history[sid], summaries[sid])) for sid in ids]
+        )
+        archived_at = timezone.now()
+        with transaction.atomic():
+            claimed = [
+                session_id
+                for session_id, (segment, offset, length) in locations.items()
+                if ChatSession.objects.filter(id=session_id, archived_at__isnull=True).update(
+                    archived_at=archived_at, archive_segment=segment, archive_offset=offset, archive_length=length,
+                )
+            ]
+            # حذف مستقیم؛ QuerySet.delete برای هر پیام یک ردیف تاریخچه‌ی «-» می‌ساخت
+            for model in (ChatMessage, HistoricalChatMessage, SessionSummary):
+                queryset = model.objects.filter(session_id__in=claimed)
+                queryset._raw_delete(queryset.db)
+        archived += len(claimed)
+
+
+def read_frame(session) -> dict:
+    path = Path(settings.ARCHIVE_DIR) / session.archive_segment
+    with open(path, "rb") as handle:
+        handle.seek(session.archive_offset)
+        frame = handle.read(session.archive_length)
+    return json.loads(zstandard.ZstdDecompressor().decompress(frame))
+
+
+def rehydrate(session) -> bool:
+    """Bring an archived session's rows back into the hot tables; False if it was not archived."""
+    if session.archived_at is None:
+        return False
+    record = read_frame(session)
+    with transaction.atomic():
+        # دو درخواست هم‌زمان: فقط یکی ردیف‌ها را بازمی‌گرداند
+        claimed = ChatSession.objects.filter(id=session.id, archived_at__isnull=False).update(
+            archived_at=None, rehydrated_at=timezone.now(),
+        )
+        if claimed:
+            for key in ("summary", "messages", "history"):
+                _restore([item.object for item in serializers.deserialize("python", record[key])])
+    session.archived_at = None
+    return bool(claimed)
+
+
+def _restore(objects):
+    """
+    Insert rows exactly as archived. A raw insert keeps auto_now_add
+    timestamps (bulk_create would reset them) and sends no post_save signals,
+    so messages are not re-moderated and summaries are not folded again.
+    """
+    if not objects:
+        return
+    model = type(objects[0])
+    fields = model._meta.concrete_fields
+    for field in fields:
+        if getattr(field, "auto_now", False):
+            # فریم‌های قدیمی‌تر از این ستون مقداری برای آن ندارند
+            for obj in objects:
+                if getattr(obj, field.attname) is None:
+                    field.pre_save(obj, add=True)
+    using = router.db_for_write(model)
+    size = connections[using].ops.bulk_batch_size(fields, objects) or len(objects)
+    for start in range(0, len(objects), size):
+        model._base_manager._insert(objects[start:start + size], fields=fields, raw=True, using=using)
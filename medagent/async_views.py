@@ -0,0 +1,201 @@
+"""
+ASGI-native versions of the MedAgent write endpoints.
+
+DRF's APIView only runs synchronous handlers, so under uvicorn every slow
+LLM call in PostMessage or EndSession holds a threadpool slot. These views
+are plain async Django views that reuse the DRF serializers for validation,
+the async ORM for queries and the async TalkBot path (``atb_chat``,
+``aprofanity``, ``agent.arun``) for outbound calls. Responses mirror the
+sync endpoints, including DRF-style error bodies.
+
+Deploy with ``uvicorn core.asgi:application``; the routes live under
+``api/async/``. The per-session event stream (medagent.events) is served
+from here as well, since it holds a connection open per subscriber.
+"""
+
+import json
+import random
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, JsonResponse, QueryDict, StreamingHttpResponse
+from django.http.multipartparser import MultiPartParserError
+from django.shortcuts import aget_object_or_404
+from django.utils import timezone
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions
+from rest_framework.authentication import SessionAuthentication
+
+from medagent.archive import rehydrate
+from medagent.authentication import StatelessJWTAuthentication
+from medagent.events import event_stream, publish_session_event
+from medagent.idempotency import has_idempotency_key, idempotent
+from medagent.llm_scheduler import INTERACTIVE, SUMMARY, llm_work
+from medagent.models import AccessHistory, ChatSession, PatientProfile
+from medagent.otp import get_otp_backend
+from medagent.permissions import HasActiveSubscription, claims_subscription_active
+from medagent.moderation import amoderated_reply
+from medagent.persistence import save_exchange, save_owner_message
+from medagent.serializers import (
+    ChatMessageSerializer, EndSessionSerializer, MessageContentSerializer,
+    OTPRequestSerializer, OTPVerifySerializer,
+)
+from medagent.sms import dispatch_sms
+from medagent.tools import SummarizeSessionTool
+from medagent.views import can_read_session
+from sub.models import Subscription
+
+
+def _json(data, status=200):
+    return JsonResponse(data, status=status, json_dumps_params={"ensure_ascii": False})
+
+
+def _request_data(request):
+    # فقط خطای خواندن بدنه 400 است؛ ValueError در ادامه‌ی handler خطای سرور می‌ماند
+    try:
+        if request.content_type == "application/json":
+            return json.loads(request.body or b"{}")
+        if request.method == "POST":
+            return request.POST
+        return QueryDict(request.body)
+    except (ValueError, MultiPartParserError):
+        raise exceptions.ParseError("Malformed request.")
+
+
+class AsyncAPIView(View):
+    """Authentication, subscription check and DRF-style errors for async handlers."""
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # مانند APIView: CSRF فقط برای درخواست‌هایی که با کوکی نشست احراز شده‌اند بررسی می‌شود
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            # با هدر Bearer کاربر از claimهای توکن ساخته می‌شود و نشست خوانده نمی‌شود
+            authenticated = await sync_to_async(StatelessJWTAuthentication().authenticate)(request)
+            if authenticated is not None:
+                request.user, request.auth = authenticated
+            else:
+                request.user = await request.auser()
+                if request.user.is_authenticated:
+                    SessionAuthentication().enforce_csrf(request)
+            if not request.user.is_authenticated:
+                raise exceptions.NotAuthenticated()
+            active = claims_subscription_active(request.user)
+            if active is None:
+                active = await Subscription.objects.filter(
+                    user_id=request.user.id, end_date__gte=timezone.now()
+                ).aexists()
+            if not active:
+                raise exceptions.PermissionDenied(HasActiveSubscription.message)
+            return await super().dispatch(request, *args, **kwargs)
+        except Http404:
+            return _json({"detail": "Not found."}, status=404)
+        except exceptions.APIException as exc:
+            data = exc.detail if isinstance(exc.detail, (list, dict)) else {"detail": exc.detail}
+            # مانند DRF بدون هدر WWW-Authenticate کد 403 برمی‌گردد
+            status = 403 if isinstance(exc, exceptions.NotAuthenticated) else exc.status_code
+            response = _json(data, status=status)
+            if getattr(exc, "wait", None):
+                response["Retry-After"] = str(int(exc.wait))
+            return response
+
+
+class AsyncRequestOTP(AsyncAPIView):
+    async def post(self, request):
+        ser = OTPRequestSerializer(data=_request_data(request))
+        ser.is_valid(raise_exception=True)
+        nc = ser.validated_data["national_code"]
+
+        patient = await aget_object_or_404(PatientProfile, national_code=nc)
+        raw = f"{random.randint(0, 999999):06d}"
+        await sync_to_async(get_otp_backend().issue)(patient, raw, doctor_id=request.user.id)
+        await sync_to_async(dispatch_sms)(patient.phone_number, f"کد دسترسی شما: {raw}")
+        return _json({"msg": "OTP sent"})
+
+
+class AsyncVerifyOTP(AsyncAPIView):
+    async def post(self, request):
+        ser = OTPVerifySerializer(data=_request_data(request))
+        ser.is_valid(raise_exception=True)
+        nc, code = ser.validated_data.values()
+
+        patient = await aget_object_or_404(PatientProfile, national_code=nc)
+        if not await sync_to_async(get_otp_backend().verify)(patient, code, doctor_id=request.user.id):
+            return _json({"error": "OTP نامعتبر یا منقضی"}, status=400)
+
+        await AccessHistory.objects.acreate(doctor_id=request.user.id, patient=patient)
+        return _json({"msg": "Access granted", "patient_id": patient.id})
+
+
+class AsyncPostMessage(AsyncAPIView):
+    @idempotent
+    async def post(self, request, session_id):
+        session = await aget_object_or_404(ChatSession, id=session_id, ended_at__isnull=True)
+        if session.owner_id != request.user.id:
+            return _json({"error": "not owner"}, status=403)
+
+        ser = MessageContentSerializer(data=_request_data(request))
+        ser.is_valid(raise_exception=True)
+        content = ser.validated_data["content"]
+
+        from medagent.agent_setup import agent
+
+        try:
+            with llm_work(INTERACTIVE, request.user.id):
+                content, reply = await amoderated_reply(content, agent.arun)
+        except Exception:
+            if not has_idempotency_key(request):
+                await sync_to_async(save_owner_message)(session, content)
+            raise
+        _, assistant = await sync_to_async(save_exchange)(session, content, reply)
+        await sync_to_async(publish_session_event)(
+            session.id, "assistant_message", message=ChatMessageSerializer(assistant).data
+        )
+        return _json({"assistant_reply": reply})
+
+
+class AsyncEndSession(AsyncAPIView):
+    @idempotent
+    async def patch(self, request):
+        ser = EndSessionSerializer(data=_request_data(request))
+        ser.is_valid(raise_exception=True)
+        sess = await aget_object_or_404(ChatSession, id=ser.validated_data["session_id"], owner_id=request.user.id)
+        # خلاصه باید پیام‌های بایگانی‌شده را هم ببیند
+        await sync_to_async(rehydrate)(sess)
+
+        sess.ended_at = timezone.now()
+        await sess.asave(update_fields=["ended_at"])
+
+        with llm_work(SUMMARY, request.user.id):
+            await SummarizeSessionTool().asummarize(sess.id, sess)
+        await sync_to_async(publish_session_event)(sess.id, "session_closed")
+        return _json({"msg": "session closed & summarized"})
+
+
+class SessionEvents(AsyncAPIView):
+    """Server-sent event stream of assistant replies, summaries and closure for one session."""
+
+    async def get(self, request, session_id):
+        session = await aget_object_or_404(ChatSession, id=session_id)
+        if not await sync_to_async(can_read_session)(request.user, session):
+            return _json({"error": "access denied"}, status=403)
+
+        try:
+            last_event_id = int(request.headers["Last-Event-ID"])
+        except (KeyError, ValueError):
+            last_event_id = None
+
+        async def is_closed():
+            # پس از ثبت مشترک خوانده می‌شود تا session_closed در این فاصله گم نشود
+            return await ChatSession.objects.filter(id=session.id, ended_at__isnull=False).aexists()
+
+        response = StreamingHttpResponse(
+            event_stream(session.id, is_closed=is_closed, last_event_id=last_event_id),
+            content_type="text/event-stream",
+        )
+        response["Cache-Control"] = "no-cache"
+        # جلوگیری از بافر شدن پاسخ در nginx
+        response["X-Accel-Buffering"] = "no"
+        return response
@@ -0,0 +1,171 @@
+"""
+JWT authentication for the MedAgent API.
+
+Access tokens carry the claims the hot path needs to authorize a request:
+
+* ``user_id`` – the user's primary key
+* ``doc``     – membership of the ``doctor`` group (used by CreateSession)
+* ``sub_exp`` – the subscription end date as a UNIX timestamp, or null
+* ``is_staff`` – ``User.is_staff`` (read by ``TokenUser.is_staff``, so
+  ``IsAdminUser`` works on stateless views)
+
+``StatelessJWTAuthentication`` builds a ``ClaimsUser`` from these claims
+without loading the session or the user row, and ``HasActiveSubscription``
+compares ``sub_exp`` with the clock. Claims are a snapshot taken when the
+token pair is issued. After buying a subscription, the client refreshes its
+pair to pick up the new expiry.
+
+Refresh tokens are single use. Each issued ``jti`` is an
+``IssuedRefreshToken`` row that rotation consumes with a conditional UPDATE,
+so every worker agrees on which tokens were used even without a shared
+cache. Replaying a refresh token whose row is known to be consumed revokes
+every token of that user; an unknown ``jti`` is only rejected. Access tokens
+are revoked through a cache denylist of ``jti`` values and a per-user cutoff
+time.
+"""
+
+import datetime
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework.authentication import BasicAuthentication, SessionAuthentication
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from medagent.models import IssuedRefreshToken
+
+DOCTOR_CLAIM = "doc"
+SUBSCRIPTION_CLAIM = "sub_exp"
+STAFF_CLAIM = "is_staff"
+
+
+def _denied_key(jti):
+    return f"medagent:jwt:denied:{jti}"
+
+
+def _cutoff_key(user_id):
+    return f"medagent:jwt:cutoff:{user_id}"
+
+
+def _remaining(token) -> int:
+    return max(int(token["exp"] - time.time()), 1)
+
+
+class ClaimsUser(TokenUser):
+    """User built from access-token claims; has no database row behind it."""
+
+    @property
+    def id(self) -> int:
+        return int(self.token[api_settings.USER_ID_CLAIM])
+
+    @property
+    def is_doctor(self) -> bool:
+        return bool(self.token.get(DOCTOR_CLAIM, False))
+
+    @property
+    def subscription_expires(self):
+        return self.token.get(SUBSCRIPTION_CLAIM)
+
+
+def user_is_doctor(user) -> bool:
+    if isinstance(user, ClaimsUser):
+        return user.is_doctor
+    return user.groups.filter(name__iexact="doctor").exists()
+
+
+def issue_tokens(user) -> RefreshToken:
+    """Create a refresh token (and, through it, an access token) for ``user``."""
+    from sub.models import Subscription
+
+    refresh = RefreshToken.for_user(user)
+    refresh[DOCTOR_CLAIM] = user.groups.filter(name__iexact="doctor").exists()
+    end_date = Subscription.objects.filter(user_id=user.pk).values_list("end_date", flat=True).first()
+    refresh[SUBSCRIPTION_CLAIM] = int(end_date.timestamp()) if end_date else None
+    refresh[STAFF_CLAIM] = user.is_staff
+    IssuedRefreshToken.objects.create(
+        jti=refresh[api_settings.JTI_CLAIM],
+        user_id=user.pk,
+        expires_at=datetime.datetime.fromtimestamp(refresh["exp"], tz=datetime.timezone.utc),
+    )
+    return refresh
+
+
+def rotate_refresh(raw_token: str) -> RefreshToken:
+    """Consume a refresh token and issue a new pair with up-to-date claims."""
+    try:
+        old = RefreshToken(raw_token)
+    except TokenError as e:
+        raise InvalidToken(e.args[0])
+
+    user_id = old[api_settings.USER_ID_CLAIM]
+    if is_revoked(old):
+        raise InvalidToken("Token has been revoked.")
+    issued = IssuedRefreshToken.objects.filter(jti=old[api_settings.JTI_CLAIM])
+    if not issued.filter(used_at__isnull=True).update(used_at=timezone.now()):
+        if issued.filter(used_at__isnull=False).exists():
+            # توکنی که قبلاً مصرف شده دوباره آمده؛ احتمالاً به سرقت رفته است
+            revoke_user_tokens(user_id)
+            raise InvalidToken("Refresh token has already been used.")
+        # باطل‌شده یا ناشناخته؛ نشانه‌ای از استفاده‌ی دوباره نیست
+        raise InvalidToken("Refresh token is not recognized.")
+
+    user = get_user_model().objects.filter(pk=user_id, is_active=True).first()
+    if user is None:
+        raise InvalidToken("User not found.")
+    return issue_tokens(user)
+
+
+def revoke_token(token) -> None:
+    """Revoke one token until it would have expired anyway."""
+    jti = token[api_settings.JTI_CLAIM]
+    cache.set(_denied_key(jti), True, timeout=_remaining(token))
+    if isinstance(token, RefreshToken):
+        IssuedRefreshToken.objects.filter(jti=jti).delete()
+
+
+def revoke_user_tokens(user_id) -> None:
+    """Revoke every token issued to ``user_id`` so far."""
+    IssuedRefreshToken.objects.filter(user_id=user_id, used_at__isnull=True).delete()
+    cache.set(
+        _cutoff_key(user_id),
+        int(time.time()),
+        timeout=int(api_settings.REFRESH_TOKEN_LIFETIME.total_seconds()),
+    )
+
+
+def is_revoked(token) -> bool:
+    denied = _denied_key(token[api_settings.JTI_CLAIM])
+    cutoff = _cutoff_key(token[api_settings.USER_ID_CLAIM])
+    found = cache.get_many([denied, cutoff])
+    if denied in found:
+        return True
+    # iat ثانیه‌ی صحیح است؛ توکن‌های صادرشده در همان ثانیه‌ی ابطال هم باطل‌اند
+    return cutoff in found and token["iat"] <= found[cutoff]
+
+
+class RevocableJWTAuthentication(JWTAuthentication):
+    """simplejwt authentication that also honours cache-backed revocation."""
+
+    def get_validated_token(self, raw_token):
+        token = super().get_validated_token(raw_token)
+        if is_revoked(token):
+            raise InvalidToken("Token has been revoked.")
+        return token
+
+
+class StatelessJWTAuthentication(RevocableJWTAuthentication):
+    """Authenticates from claims alone; ``request.user`` is a ClaimsUser."""
+
+    def get_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken("Token contained no recognizable user identification")
+        return ClaimsUser(validated_token)
+
+
+# برای viewهای مسیر پرتکرار؛ نشست و Basic همچنان برای کلاینت‌های قدیمی پذیرفته می‌شوند
+STATELESS_AUTHENTICATION_CLASSES = [SessionAuthentication, BasicAuthentication, StatelessJWTAuthentication]
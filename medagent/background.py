@@ -0,0 +1,74 @@
+"""
+In-process background work queues.
+
+Request handlers hand slow side effects (SMS delivery, summary aggregation)
+to a ``BackgroundQueue`` and return immediately. Each queue owns a few daemon
+worker threads that are started lazily, so they are created after a
+pre-forking server such as gunicorn has forked its workers.
+
+With ``settings.BACKGROUND_TASKS_EAGER`` set, tasks run inline in the calling
+thread, which keeps tests deterministic.
+"""
+
+import logging
+import os
+import queue
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundQueue:
+    def __init__(self, name: str, workers: int = 1):
+        self.name = name
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+
+    def submit(self, fn, *args, **kwargs) -> None:
+        """Run ``fn(*args, **kwargs)`` on a worker once the current transaction commits."""
+        if getattr(settings, "BACKGROUND_TASKS_EAGER", False):
+            fn(*args, **kwargs)
+            return
+        transaction.on_commit(lambda: self._put(fn, args, kwargs))
+
+    def join(self) -> None:
+        """Block until every queued task has finished."""
+        if self._queue is not None:
+            self._queue.join()
+
+    def qsize(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def _put(self, fn, args, kwargs):
+        self._ensure_started()
+        self._queue.put((fn, args, kwargs))
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # پس از fork صف و نخ‌های والد در فرایند فرزند وجود ندارند
+            self._queue = queue.Queue()
+            for index in range(self.workers):
+                threading.Thread(
+                    target=self._work, name=f"{self.name}-{index}", daemon=True
+                ).start()
+            self._pid = os.getpid()
+
+    def _work(self):
+        while True:
+            fn, args, kwargs = self._queue.get()
+            try:
+                fn(*args, **kwargs)
+            except Exception:
+                logger.exception("Background task %r failed on queue %s", fn, self.name)
+            finally:
+                close_old_connections()
+                self._queue.task_done()
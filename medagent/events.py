@@ -0,0 +1,223 @@
+"""
+Per-session event channel.
+
+Clients subscribe to ``GET /api/session/<id>/events/`` (server-sent events)
+instead of polling for assistant replies and summaries. Three event types
+are pushed:
+
+* ``assistant_message`` – a reply was stored by PostMessage
+* ``summary_ready``     – a SessionSummary was created
+* ``session_closed``    – EndSession finished; the stream ends after it
+
+Events are delivered through an in-process broker. When
+``settings.EVENTS_REDIS_URL`` is set, publishers go through Redis pub/sub
+and every worker process relays messages to its own subscribers, so a
+reply produced by one worker reaches streams held open by another. The
+relay reconnects with exponential back-off when Redis drops, and
+``subscribe`` restarts it if it has stopped anyway.
+
+Every event carries a time-ordered ``id`` that is sent as the SSE ``id:``
+field. Each process keeps the last few events of recently active sessions,
+so a client reconnecting with ``Last-Event-ID`` gets what it missed.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = "medagent:events:"
+
+
+class Subscription:
+    __slots__ = ("session_id", "loop", "queue")
+
+    def __init__(self, session_id, loop, maxsize):
+        self.session_id = session_id
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+
+class EventBroker:
+    # ثانیه؛ فاصله‌ی اتصال دوباره به Redis در هر شکست دو برابر می‌شود
+    reconnect_delay = 0.5
+    max_reconnect_delay = 30
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+        self._redis = None
+        self._listeners = {}
+        self._recent = OrderedDict()
+        self._last_id = 0
+
+    def subscribe(self, session_id) -> Subscription:
+        """Register a subscriber on the running event loop."""
+        loop = asyncio.get_running_loop()
+        sub = Subscription(session_id, loop, settings.EVENTS_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers[session_id].add(sub)
+        if self._redis_url():
+            relay = self._listeners.get(loop)
+            if relay is None or relay.done():
+                self._listeners[loop] = loop.create_task(self._relay_from_redis())
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            subs = self._subscribers.get(sub.session_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.session_id]
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(subs) for subs in self._subscribers.values())
+
+    def publish(self, session_id, event: dict) -> None:
+        """Deliver ``event`` to every subscriber of ``session_id``; safe from any thread."""
+        if "id" not in event:
+            event = {**event, "id": self._next_id()}
+        if self._redis_url():
+            try:
+                self._redis_client().publish(f"{CHANNEL_PREFIX}{session_id}", json.dumps(event))
+                return
+            except Exception:
+                logger.exception("Redis publish failed; delivering to local subscribers only")
+        self.publish_local(session_id, event)
+
+    def publish_local(self, session_id, event: dict) -> None:
+        with self._lock:
+            self._remember(session_id, event)
+            subs = list(self._subscribers.get(session_id, ()))
+        for sub in subs:
+            sub.loop.call_soon_threadsafe(self._offer, sub.queue, event)
+
+    def replay(self, session_id, last_event_id) -> list:
+        """Events of ``session_id`` newer than ``last_event_id`` still held in memory."""
+        with self._lock:
+            recent = list(self._recent.get(session_id, ()))
+        return [event for event in recent if event.get("id", 0) > last_event_id]
+
+    def _next_id(self) -> int:
+        # بر پایه‌ی زمان تا بین workerها هم ترتیب تقریبی حفظ شود؛ در هر پردازه اکیداً صعودی
+        with self._lock:
+            self._last_id = max(time.time_ns() // 1000, self._last_id + 1)
+            return self._last_id
+
+    def _remember(self, session_id, event):
+        recent = self._recent.get(session_id)
+        if recent is None:
+            recent = self._recent[session_id] = deque(maxlen=settings.EVENTS_REPLAY_SIZE)
+        else:
+            self._recent.move_to_end(session_id)
+        recent.append(event)
+        while len(self._recent) > settings.EVENTS_REPLAY_SESSIONS:
+            self._recent.popitem(last=False)
+
+    @staticmethod
+    def _offer(queue, event):
+        # مشترک کند نباید حافظه را پر کند؛ قدیمی‌ترین رویداد کنار گذاشته می‌شود
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(event)
+
+    def _redis_url(self):
+        return getattr(settings, "EVENTS_REDIS_URL", None)
+
+    def _redis_client(self):
+        if self._redis is None:
+            import redis
+
+            self._redis = redis.Redis.from_url(self._redis_url())
+        return self._redis
+
+    async def _relay_from_redis(self):
+        import redis.asyncio as aioredis
+
+        delay = self.reconnect_delay
+        while True:
+            client = aioredis.from_url(self._redis_url())
+            try:
+                pubsub = client.pubsub()
+                await pubsub.psubscribe(f"{CHANNEL_PREFIX}*")
+                delay = self.reconnect_delay
+                async for message in pubsub.listen():
+                    if message["type"] == "pmessage":
+                        self._relay_message(message)
+            except Exception:
+                logger.exception("Redis event relay failed; reconnecting in %.1fs", delay)
+            finally:
+                await client.aclose()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    def _relay_message(self, message):
+        try:
+            channel = message["channel"].decode()
+            session_id = int(channel[len(CHANNEL_PREFIX):])
+            event = json.loads(message["data"])
+        except ValueError:
+            # پیام خراب نباید اتصال را قطع کند
+            logger.warning("Ignoring malformed event on %r", message.get("channel"))
+            return
+        self.publish_local(session_id, event)
+
+
+broker = EventBroker()
+
+
+def publish_session_event(session_id, event_type: str, **data) -> None:
+    """Publish once the current transaction commits, so subscribers can read the rows."""
+    event = {"type": event_type, "session_id": int(session_id), **data}
+    transaction.on_commit(lambda: broker.publish(int(session_id), event))
+
+
+def format_sse(event: dict) -> str:
+    frame = f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False, default=str)}\n\n"
+    if "id" in event:
+        return f"id: {event['id']}\n{frame}"
+    return frame
+
+
+async def event_stream(session_id, is_closed=None, last_event_id=None):
+    """Async iterator of SSE frames for one session, ending after session_closed.
+
+    The subscription is registered before ``is_closed`` is awaited and before
+    missed events are replayed, so nothing published in between is lost.
+    """
+    yield f"retry: {settings.EVENTS_RETRY_MS}\n\n"
+    sub = broker.subscribe(session_id)
+    try:
+        seen = 0
+        if last_event_id is not None:
+            for event in broker.replay(session_id, last_event_id):
+                seen = event["id"]
+                yield format_sse(event)
+                if event["type"] == "session_closed":
+                    return
+        if is_closed is not None and await is_closed():
+            yield format_sse({"type": "session_closed", "session_id": session_id})
+            return
+        while True:
+            try:
+                event = await asyncio.wait_for(sub.queue.get(), timeout=settings.EVENTS_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            # رویدادی که در replay فرستاده شده دوباره فرستاده نمی‌شود
+            if event.get("id", 0) and event["id"] <= seen:
+                continue
+            yield format_sse(event)
+            if event["type"] == "session_closed":
+                return
+    finally:
+        broker.unsubscribe(sub)
@@ -0,0 +1,190 @@
+"""
+Streaming transcript export for compliance requests.
+
+``export_chunks`` yields a patient's sessions, messages and session
+summaries (or every patient's, with ``patient_id=None``) as NDJSON or CSV,
+optionally gzip- or zstd-compressed on the fly. Memory stays constant in
+the number of messages:
+
+* sessions (with their summary through ``select_related``) and messages are
+  two ``QuerySet.iterator(chunk_size=EXPORT_CHUNK_SIZE)`` scans ordered by
+  session, merged as they stream;
+* archived sessions are read from their cold-storage frame one at a time,
+  without being rehydrated into the hot tables;
+* output is handed on in blocks of about 64 KiB.
+
+Under ASGI, ``aexport_chunks`` wraps the same generator as an async
+iterator that produces each block in the request's sync thread, since
+Django would otherwise collect a sync iterator into a list before sending.
+
+Every record carries a ``type`` of ``session``, ``summary`` or ``message``.
+CSV output uses one column set for all three types, with type-specific data
+in the ``data`` column as JSON.
+"""
+
+import csv
+import io
+import json
+import zlib
+
+import zstandard
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from medagent.archive import read_frame
+from medagent.models import ChatMessage, ChatSession
+
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+COMPRESSIONS = {"gzip": ".gz", "zstd": ".zst"}
+CSV_COLUMNS = ["type", "session_id", "patient_id", "timestamp", "role", "content", "data"]
+
+_BLOCK_BYTES = 64 * 1024
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def _session_record(session):
+    return {
+        "type": "session", "session_id": session.id, "patient_id": session.patient_id,
+        "timestamp": _iso(session.started_at),
+        "data": {"owner_id": session.owner_id, "purpose": session.purpose, "ended_at": _iso(session.ended_at)},
+    }
+
+
+def _summary_record(session, text_summary, json_summary, tokens_used, generated_at):
+    return {
+        "type": "summary", "session_id": session.id, "patient_id": session.patient_id,
+        "timestamp": generated_at, "content": text_summary,
+        "data": {"json_summary": json_summary, "tokens_used": tokens_used},
+    }
+
+
+def _message_record(session, message_id, role, content, created_at):
+    return {
+        "type": "message", "session_id": session.id, "patient_id": session.patient_id,
+        "timestamp": created_at, "role": role, "content": content, "data": {"message_id": message_id},
+    }
+
+
+def _archived_records(session):
+    record = read_frame(session)
+    for item in record["summary"]:
+        fields = item["fields"]
+        yield _summary_record(session, fields["text_summary"], fields["json_summary"],
+                              fields["tokens_used"], fields["generated_at"])
+    for item in record["messages"]:
+        fields = item["fields"]
+        yield _message_record(session, item["pk"], fields["role"], fields["content"], fields["created_at"])
+
+
+def iter_records(patient_id=None):
+    """Yield export records in session order, then message order within each session."""
+    chunk_size = settings.EXPORT_CHUNK_SIZE
+    sessions = ChatSession.objects.select_related("sessionsummary").order_by("id")
+    messages = ChatMessage.objects.order_by("session_id", "created_at", "id")
+    if patient_id is not None:
+        sessions = sessions.filter(patient_id=patient_id)
+        # IN به‌جای JOIN: ایندکس (session_id, created_at, id) ترتیب را می‌دهد و مرتب‌سازی موقت لازم نیست
+        messages = messages.filter(session_id__in=ChatSession.objects.filter(patient_id=patient_id).values("id"))
+    messages = messages.values_list("session_id", "id", "role", "content", "created_at").iterator(chunk_size=chunk_size)
+    pending = next(messages, None)
+
+    for session in sessions.iterator(chunk_size=chunk_size):
+        yield _session_record(session)
+        if session.archived_at is not None:
+            yield from _archived_records(session)
+            continue
+        summary = getattr(session, "sessionsummary", None)
+        if summary is not None:
+            yield _summary_record(session, summary.text_summary, summary.json_summary,
+                                  summary.tokens_used, _iso(summary.generated_at))
+        # پیام‌ها به همان ترتیب session_id مرتب شده‌اند؛ ادغام بدون نگه‌داشتن کل جلسه در حافظه
+        while pending is not None and pending[0] < session.id:
+            pending = next(messages, None)
+        while pending is not None and pending[0] == session.id:
+            _, message_id, role, content, created_at = pending
+            yield _message_record(session, message_id, role, content, _iso(created_at))
+            pending = next(messages, None)
+
+
+def _ndjson(records):
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def _csv(records):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for record in records:
+        writer.writerow([
+            record["type"], record["session_id"], record["patient_id"], record.get("timestamp") or "",
+            record.get("role", ""), record.get("content") or "", json.dumps(record["data"], ensure_ascii=False),
+        ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def _compressor(compression):
+    if compression == "gzip":
+        stream = zlib.compressobj(6, zlib.DEFLATED, 31)
+        return stream.compress, stream.flush
+    if compression == "zstd":
+        stream = zstandard.ZstdCompressor(level=3).compressobj()
+        return stream.compress, stream.flush
+    return (lambda data: data), (lambda: b"")
+
+
+def export_chunks(patient_id=None, fmt="ndjson", compression=None, stats=None):
+    """
+    Yield the export as byte blocks. ``stats``, if given, is a dict that
+    receives the number of records written under ``"rows"``.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}")
+    if compression and compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression {compression!r}")
+    encode = _ndjson if fmt == "ndjson" else _csv
+    compress, flush = _compressor(compression)
+    stats = stats if stats is not None else {}
+    stats["rows"] = 0
+
+    def counted():
+        for record in iter_records(patient_id):
+            stats["rows"] += 1
+            yield record
+
+    block, size = [], 0
+    for text in encode(counted()):
+        data = compress(text.encode())
+        if data:
+            block.append(data)
+            size += len(data)
+        if size >= _BLOCK_BYTES:
+            yield b"".join(block)
+            block, size = [], 0
+    block.append(flush())
+    tail = b"".join(block)
+    if tail:
+        yield tail
+
+
+async def aexport_chunks(*args, **kwargs):
+    """Async iterator over ``export_chunks(*args, **kwargs)``."""
+    chunks = export_chunks(*args, **kwargs)
+    done = object()
+    # همه‌ی گام‌ها در یک نخ اجرا می‌شوند تا cursor باز پایگاه داده همان اتصال را داشته باشد
+    step = sync_to_async(next)
+    try:
+        while (block := await step(chunks, done)) is not done:
+            yield block
+    finally:
+        await sync_to_async(chunks.close)()
+
+
+def export_filename(patient_id, fmt, compression) -> str:
+    name = f"transcripts-{patient_id if patient_id is not None else 'all'}.{fmt}"
+    return name + COMPRESSIONS.get(compression, "")
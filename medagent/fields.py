@@ -0,0 +1,167 @@
+"""
+Model fields that store large text and JSON zstd-compressed.
+
+``CompressedTextField`` and ``CompressedJSONField`` behave like TextField and
+JSONField for Python code, ModelForms, the admin and DRF serializers, but
+their column is binary (BLOB / bytea). A value is compressed on save when it
+is at least ``settings.COMPRESSION_MIN_BYTES`` long and the result is
+smaller; anything else is stored as plain UTF-8. Reading tells the two apart
+by the zstd frame magic number, which can never start valid UTF-8 text, so
+rows written before compression was enabled still load.
+
+Short chat messages compress poorly on their own. A field declared with
+``dictionary="chat"`` compresses with the trained dictionary
+``<settings.ZSTD_DICTIONARY_DIR>/chat.zdict`` when it exists; the
+``train_zstd_dictionary`` command builds it from stored messages. Every
+``*.zdict`` file in the directory is loaded for decompression and matched by
+the dictionary id in the frame header, so keep old dictionaries around after
+retraining. A frame whose dictionary is not loaded yet (trained by another
+process) triggers one reload of the directory before the read fails.
+
+The database only sees bytes, so SQL lookups on these fields (other than
+``isnull``) and JSON key transforms do not work.
+"""
+
+import json
+import threading
+from pathlib import Path
+
+import zstandard
+from django.conf import settings
+from django.db import models
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+_local = threading.local()
+_dictionaries = None
+_generation = 0
+_dictionaries_lock = threading.Lock()
+
+
+def load_dictionaries():
+    """Return ``(by_name, by_id)`` for the dictionaries in ZSTD_DICTIONARY_DIR (loaded once)."""
+    global _dictionaries
+    if _dictionaries is None:
+        with _dictionaries_lock:
+            if _dictionaries is None:
+                by_name, by_id = {}, {}
+                directory = Path(settings.ZSTD_DICTIONARY_DIR)
+                for path in sorted(directory.glob("*.zdict")) if directory.is_dir() else []:
+                    dictionary = zstandard.ZstdCompressionDict(path.read_bytes())
+                    by_id[dictionary.dict_id()] = dictionary
+                    by_name[path.stem] = dictionary
+                _dictionaries = (by_name, by_id)
+    return _dictionaries
+
+
+def reset_dictionaries():
+    """Forget loaded dictionaries (after training a new one)."""
+    global _dictionaries, _generation
+    with _dictionaries_lock:
+        _dictionaries = None
+        _generation += 1
+
+
+def _compressor(dictionary_name):
+    # ZstdCompressor / ZstdDecompressor نباید هم‌زمان بین نخ‌ها مشترک باشند
+    key = ("c", _generation, dictionary_name, settings.COMPRESSION_LEVEL)
+    compressor = _local.__dict__.get(key)
+    if compressor is None:
+        dictionary = load_dictionaries()[0].get(dictionary_name) if dictionary_name else None
+        compressor = zstandard.ZstdCompressor(
+            level=settings.COMPRESSION_LEVEL, dict_data=dictionary, write_checksum=False,
+        )
+        _local.__dict__[key] = compressor
+    return compressor
+
+
+def _dictionary_by_id(dict_id):
+    dictionary = load_dictionaries()[1].get(dict_id)
+    if dictionary is None:
+        # ممکن است پروسس دیگری پس از بارگذاری دیکشنری تازه‌ای آموزش داده باشد
+        reset_dictionaries()
+        dictionary = load_dictionaries()[1].get(dict_id)
+        if dictionary is None:
+            raise ValueError(f"No zstd dictionary with id {dict_id} in {settings.ZSTD_DICTIONARY_DIR}")
+    return dictionary
+
+
+def _decompressor(dict_id):
+    decompressor = _local.__dict__.get(("d", _generation, dict_id))
+    if decompressor is None:
+        dictionary = _dictionary_by_id(dict_id) if dict_id else None
+        decompressor = zstandard.ZstdDecompressor(dict_data=dictionary)
+        # نسل پس از بارگذاری دوباره خوانده می‌شود
+        _local.__dict__[("d", _generation, dict_id)] = decompressor
+    return decompressor
+
+
+def compress(raw: bytes, dictionary_name=None) -> bytes:
+    if len(raw) < settings.COMPRESSION_MIN_BYTES:
+        return raw
+    packed = _compressor(dictionary_name).compress(raw)
+    return packed if len(packed) < len(raw) else raw
+
+
+def decompress(stored) -> bytes:
+    stored = bytes(stored)
+    if not stored.startswith(ZSTD_MAGIC):
+        return stored
+    dict_id = zstandard.get_frame_parameters(stored).dict_id
+    return _decompressor(dict_id).decompress(stored)
+
+
+class CompressedTextField(models.TextField):
+    def __init__(self, *args, dictionary=None, **kwargs):
+        self.dictionary = dictionary
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.dictionary:
+            kwargs["dictionary"] = self.dictionary
+        return name, path, args, kwargs
+
+    def get_internal_type(self):
+        return "BinaryField"
+
+    def from_db_value(self, value, expression, connection):
+        if value is None or isinstance(value, str):
+            return value
+        return decompress(value).decode()
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if not prepared:
+            value = self.get_prep_value(value)
+        if value is None:
+            return None
+        return compress(value.encode(), self.dictionary)
+
+
+class CompressedJSONField(models.JSONField):
+    def __init__(self, *args, dictionary=None, **kwargs):
+        self.dictionary = dictionary
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.dictionary:
+            kwargs["dictionary"] = self.dictionary
+        return name, path, args, kwargs
+
+    def get_internal_type(self):
+        return "BinaryField"
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        if not isinstance(value, str):
+            value = decompress(value)
+        return json.loads(value, cls=self.decoder)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if not prepared:
+            value = self.get_prep_value(value)
+        # متن فارسی بدون escape یونیکد تقریباً یک‌سوم حجم می‌گیرد
+        raw = json.dumps(value, cls=self.encoder, ensure_ascii=False).encode()
+        return compress(raw, self.dictionary)
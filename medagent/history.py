@@ -0,0 +1,117 @@
+"""
+Delta history storage for large JSON fields.
+
+``HistoricalRecords`` copies every tracked field into each history row, so a
+PatientSummary that grows a little after every session stores its whole
+``json_data`` again each time. ``DeltaHistoricalRecords`` keeps one JSON
+field out of the copied fields and stores it on the history row as either:
+
+* ``<field>_checkpoint`` – the full document (compressed), written for the
+  first row of an object and then every ``settings.HISTORY_CHECKPOINT_EVERY``
+  versions;
+* ``<field>_patch`` – an RFC 6902 JSON Patch (via ``jsonpatch``) from the
+  version in the row ``<field>_base`` points at.
+
+Patches point at their base row explicitly rather than at "the previous
+row", so two concurrent saves that diffed against the same version still
+reconstruct correctly.
+
+A history row's ``instance`` (used by ``SimpleHistoryAdmin``,
+``history.as_of()`` and reverts) rebuilds the field from the nearest
+checkpoint, applying at most ``HISTORY_CHECKPOINT_EVERY - 1`` patches;
+``record.delta_document()`` returns just the document.
+"""
+
+import copy
+
+import jsonpatch
+from django.conf import settings
+from django.db import models
+from simple_history.models import HistoricalRecords
+from simple_history.signals import pre_create_historical_record
+
+from medagent.fields import CompressedJSONField
+
+
+class DeltaHistoricalRecords(HistoricalRecords):
+    def __init__(self, *args, delta_field: str, **kwargs):
+        kwargs["excluded_fields"] = [*kwargs.get("excluded_fields", []), delta_field]
+        super().__init__(*args, **kwargs)
+        self.delta_field = delta_field
+
+    def _names(self):
+        field = self.delta_field
+        return f"{field}_checkpoint", f"{field}_patch", f"{field}_base"
+
+    def get_extra_fields(self, model, fields):
+        extra = super().get_extra_fields(model, fields)
+        records = self
+        checkpoint_name, patch_name, base_name = self._names()
+        base_get_instance = extra["instance"].fget
+
+        def delta_document(record):
+            return records.document(record)[0]
+
+        def get_instance(record):
+            result = base_get_instance(record)
+            setattr(result, records.delta_field, delta_document(record))
+            return result
+
+        extra.update({
+            checkpoint_name: CompressedJSONField(null=True, blank=True),
+            patch_name: models.JSONField(null=True, blank=True),
+            base_name: models.BigIntegerField(null=True, blank=True),
+            "delta_document": delta_document,
+            "instance": property(get_instance),
+        })
+        return extra
+
+    def create_history_model(self, model, inherited):
+        history_model = super().create_history_model(model, inherited)
+        pre_create_historical_record.connect(
+            self._store_delta, sender=history_model, weak=False,
+            dispatch_uid=f"delta-history-{history_model._meta.label}",
+        )
+        return history_model
+
+    def document(self, record):
+        """Return ``(document, patches_applied)`` for a history row."""
+        checkpoint_name, patch_name, base_name = self._names()
+        pk_name = record.instance_type._meta.pk.attname
+        window = (
+            type(record)._default_manager
+            .filter(**{pk_name: getattr(record, pk_name), "history_id__lte": record.history_id})
+            .order_by("-history_id")
+            .values("history_id", checkpoint_name, patch_name, base_name)
+        )
+        rows = {row["history_id"]: row for row in window[:settings.HISTORY_CHECKPOINT_EVERY]}
+        chain, history_id = [], record.history_id
+        while True:
+            row = rows.get(history_id)
+            if row is None:
+                # زنجیره از پنجره‌ی خوانده‌شده بیرون رفته (ذخیره‌های هم‌زمان)
+                row = type(record)._default_manager.values(
+                    "history_id", checkpoint_name, patch_name, base_name,
+                ).get(history_id=history_id)
+            if row[checkpoint_name] is not None or row[base_name] is None:
+                # values() هر بار JSON را از نو decode می‌کند، پس اعمال درجا روی آن امن است
+                document = row[checkpoint_name] if row[checkpoint_name] is not None else {}
+                break
+            chain.append(row[patch_name])
+            history_id = row[base_name]
+        for patch in reversed(chain):
+            document = jsonpatch.apply_patch(document, patch, in_place=True)
+        return document, len(chain)
+
+    def _store_delta(self, sender, instance, history_instance, **kwargs):
+        checkpoint_name, patch_name, base_name = self._names()
+        current = getattr(instance, self.delta_field)
+        pk_name = instance._meta.pk.attname
+        latest = sender._default_manager.filter(**{pk_name: instance.pk}).order_by("-history_id").first()
+        if latest is not None:
+            previous, depth = self.document(latest)
+            if depth + 1 < settings.HISTORY_CHECKPOINT_EVERY:
+                setattr(history_instance, patch_name, jsonpatch.make_patch(previous, current).patch)
+                setattr(history_instance, base_name, latest.history_id)
+                return
+        setattr(history_instance, checkpoint_name, copy.deepcopy(current))
@@ -0,0 +1,231 @@
+"""
+Idempotency-Key support for retried writes.
+
+Mobile clients retry PostMessage and EndSession on flaky networks. Each
+retry used to run the agent again and store another pair of messages.
+Handlers decorated with ``idempotent`` honour an ``Idempotency-Key`` header:
+
+* the first request with a key claims it in the cache (``cache.add``),
+  runs, and stores its response for ``settings.IDEMPOTENCY_TTL`` seconds;
+* a retry with the same key gets the stored response back, marked with
+  ``Idempotent-Replayed: true``, without running the handler;
+* a concurrent duplicate waits for the in-flight request, up to
+  ``settings.IDEMPOTENCY_WAIT`` seconds (then 409);
+* reusing a key for a different request body or endpoint is rejected with
+  422.
+
+Keys are scoped to the authenticated user. Server errors (5xx) and
+exceptions are not stored, so they release the key and a retry runs again;
+handlers use ``has_idempotency_key`` to skip partial writes that such a
+retry would repeat. The claim is refreshed while the handler runs, so a
+slow agent call does not let a duplicate in, and a claim left by a crashed
+worker expires after ``settings.IDEMPOTENCY_LOCK_TTL`` seconds.
+
+Duplicates are only detected across worker processes when the cache is
+shared (Redis via REDIS_URL); medagent.apps refuses to start a non-DEBUG
+deployment on the local-memory cache.
+"""
+
+import asyncio
+import contextlib
+import functools
+import hashlib
+import inspect
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+from rest_framework.response import Response
+
+HEADER = "HTTP_IDEMPOTENCY_KEY"
+_PENDING = "pending"
+
+
+def has_idempotency_key(request) -> bool:
+    """True when a failed run of this request will be retried with the same key."""
+    return bool(request.META.get(HEADER))
+
+
+def _cache_key(request, key):
+    digest = hashlib.sha256(key.encode()).hexdigest()
+    return f"medagent:idempotency:{request.user.id}:{digest}"
+
+
+def _fingerprint(request) -> str:
+    if hasattr(request, "data"):
+        payload = json.dumps(request.data, sort_keys=True, default=str).encode()
+    else:
+        payload = request.body
+    return hashlib.sha256(f"{request.method} {request.path}\n".encode() + payload).hexdigest()
+
+
+def _record(response, fingerprint):
+    if isinstance(response, Response):
+        return {"fp": fingerprint, "status": response.status_code, "data": response.data}
+    return {
+        "fp": fingerprint,
+        "status": response.status_code,
+        "content": response.content,
+        "content_type": response["Content-Type"],
+    }
+
+
+def _replay(record):
+    if "data" in record:
+        response = Response(record["data"], status=record["status"])
+    else:
+        response = HttpResponse(record["content"], status=record["status"], content_type=record["content_type"])
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def _error(is_async, message, status):
+    if is_async:
+        return JsonResponse({"error": message}, status=status)
+    return Response({"error": message}, status=status)
+
+
+def _claim(cache_key, fingerprint):
+    """Try to claim the key; returns ``(claimed, existing_entry)``."""
+    if cache.add(cache_key, {"fp": fingerprint, "state": _PENDING}, timeout=settings.IDEMPOTENCY_LOCK_TTL):
+        return True, None
+    return False, cache.get(cache_key)
+
+
+async def _aclaim(cache_key, fingerprint):
+    if await cache.aadd(cache_key, {"fp": fingerprint, "state": _PENDING}, timeout=settings.IDEMPOTENCY_LOCK_TTL):
+        return True, None
+    return False, await cache.aget(cache_key)
+
+
+def _settle(cache_key, fingerprint, response):
+    if response.status_code >= 500:
+        cache.delete(cache_key)
+    else:
+        cache.set(cache_key, _record(response, fingerprint), timeout=settings.IDEMPOTENCY_TTL)
+
+
+async def _asettle(cache_key, fingerprint, response):
+    if response.status_code >= 500:
+        await cache.adelete(cache_key)
+    else:
+        await cache.aset(cache_key, _record(response, fingerprint), timeout=settings.IDEMPOTENCY_TTL)
+
+
+@contextlib.contextmanager
+def _hold(cache_key):
+    """Keep the pending claim alive while the handler runs."""
+    stop = threading.Event()
+
+    def refresh():
+        while not stop.wait(settings.IDEMPOTENCY_LOCK_TTL / 3):
+            cache.touch(cache_key, settings.IDEMPOTENCY_LOCK_TTL)
+
+    thread = threading.Thread(target=refresh, name="idempotency-refresh", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        # پیش از ذخیره‌ی نتیجه متوقف می‌شود تا touch عمر نتیجه را کوتاه نکند
+        stop.set()
+        thread.join()
+
+
+@contextlib.asynccontextmanager
+async def _ahold(cache_key):
+    stop = asyncio.Event()
+
+    async def refresh():
+        while True:
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=settings.IDEMPOTENCY_LOCK_TTL / 3)
+                return
+            except asyncio.TimeoutError:
+                await cache.atouch(cache_key, settings.IDEMPOTENCY_LOCK_TTL)
+
+    task = asyncio.ensure_future(refresh())
+    try:
+        yield
+    finally:
+        stop.set()
+        await task
+
+
+def _resolve(entry, fingerprint, is_async):
+    """Response for a duplicate, or None to keep waiting and claim again."""
+    if entry is None:
+        # کلید بین add و get منقضی یا آزاد شد
+        return None
+    if entry["fp"] != fingerprint:
+        return _error(is_async, "Idempotency-Key was used for a different request", 422)
+    if entry.get("state") == _PENDING:
+        return None
+    return _replay(entry)
+
+
+def idempotent(handler):
+    """Decorate a sync or async view handler ``(self, request, *args, **kwargs)``."""
+    if inspect.iscoroutinefunction(handler):
+        @functools.wraps(handler)
+        async def async_wrapper(self, request, *args, **kwargs):
+            key = request.META.get(HEADER)
+            if not key:
+                return await handler(self, request, *args, **kwargs)
+            cache_key, fingerprint = _cache_key(request, key), _fingerprint(request)
+            deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT
+            delay = 0.05
+            while True:
+                claimed, entry = await _aclaim(cache_key, fingerprint)
+                if claimed:
+                    break
+                response = _resolve(entry, fingerprint, is_async=True)
+                if response is not None:
+                    return response
+                if time.monotonic() >= deadline:
+                    return _error(True, "A request with this Idempotency-Key is still in progress", 409)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.5)
+            try:
+                async with _ahold(cache_key):
+                    response = await handler(self, request, *args, **kwargs)
+            except BaseException:
+                await cache.adelete(cache_key)
+                raise
+            await _asettle(cache_key, fingerprint, response)
+            return response
+
+        return async_wrapper
+
+    @functools.wraps(handler)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.META.get(HEADER)
+        if not key:
+            return handler(self, request, *args, **kwargs)
+        cache_key, fingerprint = _cache_key(request, key), _fingerprint(request)
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT
+        delay = 0.05
+        while True:
+            claimed, entry = _claim(cache_key, fingerprint)
+            if claimed:
+                break
+            response = _resolve(entry, fingerprint, is_async=False)
+            if response is not None:
+                return response
+            if time.monotonic() >= deadline:
+                return _error(False, "A request with this Idempotency-Key is still in progress", 409)
+            # درخواست هم‌زمان با همین کلید در حال اجراست؛ منتظر نتیجه‌ی آن می‌مانیم
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+        try:
+            with _hold(cache_key):
+                response = handler(self, request, *args, **kwargs)
+        except BaseException:
+            cache.delete(cache_key)
+            raise
+        _settle(cache_key, fingerprint, response)
+        return response
+
+    return wrapper
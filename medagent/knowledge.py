@@ -0,0 +1,252 @@
+"""
+Retrieval over the local medical knowledge base.
+
+``build_index`` splits every ``*.md`` / ``*.txt`` file under
+``settings.MEDICAL_KB_PATH`` into passages and writes a BM25 index to
+``settings.MEDICAL_KB_INDEX_DIR``. The index is plain NumPy arrays saved as
+``.npy`` files that ``np.load(mmap_mode="r")`` maps read-only, so every
+worker process shares the same page-cache pages instead of holding its own
+copy:
+
+* ``postings_offsets`` / ``postings_docs`` / ``postings_tf`` – per-term
+  posting lists in CSR layout (term id → slice);
+* ``doc_lengths`` – passage lengths in terms, for BM25 length
+  normalization;
+* ``text.bin`` with ``text_offsets`` – the UTF-8 passages, sliced on demand;
+* ``vocabulary.json`` and ``sources.json`` – term ids and passage origins.
+
+Text goes through ``medagent.search.normalize``, so Persian spelling variants
+match the same way as in transcript search.
+
+Rebuilds are incremental. Each source file's passages and term counts are
+cached under ``shards/<sha256>-<passage chars>.json``, and only files whose
+hash changed are split and tokenized again; unchanged files only take part
+in the merge into posting arrays. Each build is written to a new ``gen-N``
+directory and published by atomically replacing the ``CURRENT`` file.
+Processes notice the new generation on their next query; pages of the old
+one stay valid until they let go of it.
+"""
+
+import hashlib
+import json
+import math
+import os
+import re
+import shutil
+import threading
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+from medagent.search import terms
+
+SOURCE_PATTERNS = ("*.md", "*.txt")
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_PARAGRAPH = re.compile(r"\n\s*\n")
+_HEADING = re.compile(r"^(#+)\s*(.+)$")
+
+
+def split_passages(text: str, max_chars: int):
+    """
+    Yield ``(heading, passage)``. Paragraphs are packed up to ``max_chars``;
+    ``heading`` is the Markdown heading path, e.g. ``"متفورمین › عوارض"``.
+    """
+    path, buffer = [], []
+    for paragraph in _PARAGRAPH.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        match = _HEADING.match(paragraph.splitlines()[0])
+        if match:
+            if buffer:
+                yield " › ".join(title for _, title in path), "\n\n".join(buffer)
+                buffer = []
+            level = len(match.group(1))
+            path = [(depth, title) for depth, title in path if depth < level] + [(level, match.group(2).strip())]
+            paragraph = "\n".join(paragraph.splitlines()[1:]).strip()
+            if not paragraph:
+                continue
+        if buffer and sum(map(len, buffer)) + len(paragraph) > max_chars:
+            yield " › ".join(title for _, title in path), "\n\n".join(buffer)
+            buffer = []
+        buffer.append(paragraph)
+    if buffer:
+        yield " › ".join(title for _, title in path), "\n\n".join(buffer)
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _shard(path: Path, relative: str, max_chars: int) -> dict:
+    passages = []
+    for heading, passage in split_passages(path.read_text(encoding="utf-8"), max_chars):
+        # مسیر عنوان‌ها هم جست‌وجو می‌شود تا «عوارض متفورمین» به زیربخش درست برسد
+        passages.append({"heading": heading, "text": passage, "terms": Counter(terms(f"{heading}\n{passage}"))})
+    return {"source": relative, "passages": passages}
+
+
+def _sources(kb_path: Path):
+    return sorted({path for pattern in SOURCE_PATTERNS for path in kb_path.rglob(pattern) if path.is_file()})
+
+
+def _current(index_dir: Path):
+    try:
+        return (index_dir / "CURRENT").read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def build_index(kb_path=None, index_dir=None, force=False) -> dict:
+    """Rebuild the index if any source changed; returns build stats."""
+    kb_path = Path(kb_path or settings.MEDICAL_KB_PATH)
+    index_dir = Path(index_dir or settings.MEDICAL_KB_INDEX_DIR)
+    shard_dir = index_dir / "shards"
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    max_chars = settings.MEDICAL_KB_PASSAGE_CHARS
+
+    current = _current(index_dir)
+    manifest = {}
+    if current and not force:
+        manifest = json.loads((index_dir / current / "manifest.json").read_text())
+    hashes = {path.relative_to(kb_path).as_posix(): _sha256(path) for path in _sources(kb_path)}
+    stats = {"files": len(hashes), "tokenized": 0, "passages": 0, "rebuilt": False, "generation": current}
+    if current and not force and manifest.get("files") == hashes and manifest.get("passage_chars") == max_chars:
+        return stats
+
+    shards = []
+    for relative, digest in hashes.items():
+        shard_path = shard_dir / f"{digest}-{max_chars}.json"
+        if shard_path.exists() and not force:
+            shard = json.loads(shard_path.read_text(encoding="utf-8"))
+        else:
+            shard = _shard(kb_path / relative, relative, max_chars)
+            shard_path.write_text(json.dumps(shard, ensure_ascii=False), encoding="utf-8")
+            stats["tokenized"] += 1
+        shard["source"] = relative
+        shards.append(shard)
+
+    number = int(current.split("-")[1]) + 1 if current else 1
+    generation = f"gen-{number}"
+    _write_generation(index_dir / generation, shards, hashes, max_chars)
+    (index_dir / "CURRENT.tmp").write_text(generation)
+    os.replace(index_dir / "CURRENT.tmp", index_dir / "CURRENT")
+
+    keep = {generation, current}
+    for path in index_dir.glob("gen-*"):
+        if path.name not in keep:
+            shutil.rmtree(path, ignore_errors=True)
+    live = {f"{digest}-{max_chars}.json" for digest in hashes.values()}
+    for path in shard_dir.glob("*.json"):
+        if path.name not in live:
+            path.unlink()
+    stats.update(rebuilt=True, generation=generation, passages=sum(len(s["passages"]) for s in shards))
+    return stats
+
+
+def _write_generation(directory: Path, shards, hashes, max_chars):
+    directory.mkdir(parents=True, exist_ok=True)
+    vocabulary, sources, texts = {}, [], []
+    doc_ids, term_ids, tfs, lengths = [], [], [], []
+    for shard in shards:
+        for passage in shard["passages"]:
+            doc = len(sources)
+            sources.append([shard["source"], passage["heading"]])
+            texts.append(passage["text"].encode())
+            lengths.append(sum(passage["terms"].values()))
+            for term, count in passage["terms"].items():
+                doc_ids.append(doc)
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                tfs.append(count)
+
+    term_ids = np.asarray(term_ids, dtype=np.int32)
+    # مرتب‌سازی پایدار بر اساس شناسه‌ی واژه؛ اسناد هر واژه به ترتیب صعودی می‌مانند
+    order = np.argsort(term_ids, kind="stable")
+    offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(term_ids, minlength=len(vocabulary)), out=offsets[1:])
+    text_offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    np.cumsum([len(text) for text in texts], out=text_offsets[1:])
+
+    np.save(directory / "postings_offsets.npy", offsets)
+    np.save(directory / "postings_docs.npy", np.asarray(doc_ids, dtype=np.int32)[order])
+    np.save(directory / "postings_tf.npy", np.asarray(tfs, dtype=np.float32)[order])
+    np.save(directory / "doc_lengths.npy", np.asarray(lengths, dtype=np.float32))
+    np.save(directory / "text_offsets.npy", text_offsets)
+    (directory / "text.bin").write_bytes(b"".join(texts))
+    (directory / "vocabulary.json").write_text(json.dumps(vocabulary, ensure_ascii=False), encoding="utf-8")
+    (directory / "sources.json").write_text(json.dumps(sources, ensure_ascii=False), encoding="utf-8")
+    (directory / "manifest.json").write_text(json.dumps({"files": hashes, "passage_chars": max_chars}))
+
+
+class KnowledgeIndex:
+    """A read-only, memory-mapped index generation."""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        load = lambda name: np.load(directory / f"{name}.npy", mmap_mode="r")  # noqa: E731
+        self.offsets = load("postings_offsets")
+        self.docs = load("postings_docs")
+        self.tf = load("postings_tf")
+        self.lengths = load("doc_lengths")
+        self.text_offsets = load("text_offsets")
+        self.text = np.memmap(directory / "text.bin", dtype=np.uint8, mode="r") if self.text_offsets[-1] else b""
+        self.vocabulary = json.loads((directory / "vocabulary.json").read_text(encoding="utf-8"))
+        self.sources = json.loads((directory / "sources.json").read_text(encoding="utf-8"))
+        self.average_length = float(self.lengths.mean()) if len(self.lengths) else 0.0
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def passage(self, doc: int) -> str:
+        start, end = int(self.text_offsets[doc]), int(self.text_offsets[doc + 1])
+        return bytes(self.text[start:end]).decode()
+
+    def search(self, query: str, k: int) -> list[dict]:
+        term_ids = {self.vocabulary[term] for term in terms(query) if term in self.vocabulary}
+        if not term_ids or not len(self):
+            return []
+        scores = np.zeros(len(self), dtype=np.float32)
+        for term_id in term_ids:
+            start, end = int(self.offsets[term_id]), int(self.offsets[term_id + 1])
+            docs, tf = self.docs[start:end], self.tf[start:end]
+            idf = math.log(1 + (len(self) - (end - start) + 0.5) / ((end - start) + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[docs] / self.average_length)
+            scores[docs] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        k = min(k, int(np.count_nonzero(scores)))
+        if not k:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [
+            {"source": self.sources[doc][0], "heading": self.sources[doc][1],
+             "text": self.passage(int(doc)), "score": round(float(scores[doc]), 3)}
+            for doc in top
+        ]
+
+
+_loaded = None
+_lock = threading.Lock()
+
+
+def get_index():
+    """Return the current generation for this process, reopening it after a rebuild; None if never built."""
+    global _loaded
+    index_dir = Path(settings.MEDICAL_KB_INDEX_DIR)
+    generation = _current(index_dir)
+    if generation is None:
+        return None
+    loaded = _loaded
+    if loaded is None or loaded.directory != index_dir / generation:
+        with _lock:
+            if _loaded is None or _loaded.directory != index_dir / generation:
+                _loaded = KnowledgeIndex(index_dir / generation)
+            loaded = _loaded
+    return loaded
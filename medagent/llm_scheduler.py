@@ -0,0 +1,278 @@
+"""
+Scheduler for outbound TalkBot (LLM) calls.
+
+Every call in ``talkbot_client`` takes a slot from the process-wide
+``scheduler`` before it goes out. At most ``settings.LLM_MAX_CONCURRENCY``
+calls run at once; set it to the TalkBot quota divided by the number of
+worker processes. Callers that find no free slot are queued:
+
+* by priority class – interactive chat, then session summaries, then batch
+  work;
+* fairly within a class – users are served round-robin, so one doctor
+  closing many sessions cannot push everyone else's work back.
+
+The class and user come from the ``llm_work`` context (a contextvar set by
+the views). Code that sets no context, such as management commands, runs as
+anonymous batch work.
+
+Load is shed before queues grow without bound:
+
+* 429 when a user already has ``LLM_MAX_PENDING_PER_USER`` queued calls;
+* 503 when the expected wait, or the actual wait, exceeds the class budget
+  in ``LLM_QUEUE_BUDGET``.
+
+``scheduler.metrics()`` reports queue depth, admissions, shed calls and
+wait-time percentiles for each class.
+"""
+
+import asyncio
+import contextvars
+import math
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+
+from django.conf import settings
+from rest_framework import exceptions
+
+INTERACTIVE, SUMMARY, BATCH = 0, 1, 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", SUMMARY: "summary", BATCH: "batch"}
+
+_work = contextvars.ContextVar("llm_work", default=(BATCH, None))
+
+
+@contextmanager
+def llm_work(priority: int, user_id=None):
+    """Attribute LLM calls made inside the block to ``priority`` and ``user_id``."""
+    token = _work.set((priority, user_id))
+    try:
+        yield
+    finally:
+        _work.reset(token)
+
+
+class LLMOverloaded(exceptions.APIException):
+    status_code = 503
+    default_detail = "The assistant is busy; please try again shortly."
+    default_code = "llm_overloaded"
+
+    def __init__(self, wait=None):
+        super().__init__()
+        self.wait = wait
+
+
+class _Waiter:
+    __slots__ = ("priority", "user", "enqueued_at", "granted", "event", "loop", "future")
+
+    def __init__(self, priority, user, loop=None):
+        self.priority = priority
+        self.user = user
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self.loop = loop
+        if loop is None:
+            self.event, self.future = threading.Event(), None
+        else:
+            self.event, self.future = None, loop.create_future()
+
+    def wake(self) -> bool:
+        if self.event is not None:
+            self.event.set()
+            return True
+        try:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+        except RuntimeError:
+            # event loop فراخواننده بسته شده است
+            return False
+        return True
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class _ClassStats:
+    __slots__ = ("admitted", "shed", "waits", "wait_max")
+
+    def __init__(self):
+        self.admitted = 0
+        self.shed = 0
+        self.waits = deque(maxlen=1024)
+        self.wait_max = 0.0
+
+    def record_wait(self, seconds):
+        self.admitted += 1
+        self.waits.append(seconds)
+        self.wait_max = max(self.wait_max, seconds)
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class LLMScheduler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active = 0
+        # برای هر کلاس: کاربر ← صف درخواست‌ها؛ ترتیب کلیدها نوبت round-robin است
+        self._queues = {priority: OrderedDict() for priority in PRIORITY_NAMES}
+        self._pending_by_user = Counter()
+        self._service_time = 1.0
+        self._stats = {priority: _ClassStats() for priority in PRIORITY_NAMES}
+
+    @contextmanager
+    def slot(self):
+        """Hold a TalkBot slot for the duration of the block (blocking)."""
+        priority, user = _work.get()
+        budget = self._budget(priority)
+        with self._lock:
+            waiter = self._admit(priority, user, budget)
+        if waiter is not None and not waiter.event.wait(budget):
+            with self._lock:
+                if not self._withdraw(waiter):
+                    self._stats[priority].shed += 1
+                    raise LLMOverloaded(wait=math.ceil(budget))
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - started)
+
+    @asynccontextmanager
+    async def aslot(self):
+        """Async counterpart of ``slot``; waiting does not block the event loop."""
+        priority, user = _work.get()
+        budget = self._budget(priority)
+        with self._lock:
+            waiter = self._admit(priority, user, budget, loop=asyncio.get_running_loop())
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), budget)
+            except asyncio.TimeoutError:
+                with self._lock:
+                    if not self._withdraw(waiter):
+                        self._stats[priority].shed += 1
+                        raise LLMOverloaded(wait=math.ceil(budget))
+            except asyncio.CancelledError:
+                with self._lock:
+                    granted = self._withdraw(waiter)
+                if granted:
+                    self._release(0.0)
+                raise
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - started)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            classes = {}
+            for priority, name in PRIORITY_NAMES.items():
+                stats = self._stats[priority]
+                waits = list(stats.waits)
+                classes[name] = {
+                    "queued": sum(len(q) for q in self._queues[priority].values()),
+                    "admitted": stats.admitted,
+                    "shed": stats.shed,
+                    "wait_p50": _percentile(waits, 0.50),
+                    "wait_p95": _percentile(waits, 0.95),
+                    "wait_max": stats.wait_max,
+                }
+            return {
+                "active": self._active,
+                "concurrency": settings.LLM_MAX_CONCURRENCY,
+                "service_time": self._service_time,
+                "classes": classes,
+            }
+
+    # ---------- درون قفل ---------- #
+
+    def _budget(self, priority):
+        return float(settings.LLM_QUEUE_BUDGET[PRIORITY_NAMES[priority]])
+
+    def _admit(self, priority, user, budget, loop=None):
+        """Take a free slot (returns None) or queue a waiter; raises when shedding."""
+        stats = self._stats[priority]
+        capacity = settings.LLM_MAX_CONCURRENCY
+        if self._active < capacity:
+            self._active += 1
+            stats.record_wait(0.0)
+            return None
+
+        if user is not None and self._pending_by_user[user] >= settings.LLM_MAX_PENDING_PER_USER:
+            stats.shed += 1
+            raise exceptions.Throttled(wait=math.ceil(self._service_time))
+
+        # فقط صف‌های هم‌اولویت و بالاتر پیش از این درخواست سرویس می‌گیرند
+        ahead = sum(
+            len(q) for p in PRIORITY_NAMES if p <= priority for q in self._queues[p].values()
+        )
+        expected = (ahead + 1) * self._service_time / capacity
+        if expected > budget:
+            stats.shed += 1
+            raise LLMOverloaded(wait=math.ceil(expected))
+
+        waiter = _Waiter(priority, user, loop)
+        self._queues[priority].setdefault(user, deque()).append(waiter)
+        self._pending_by_user[user] += 1
+        return waiter
+
+    def _withdraw(self, waiter) -> bool:
+        """Remove a waiter that gave up; returns True if it had already been granted."""
+        if waiter.granted:
+            return True
+        queue = self._queues[waiter.priority]
+        pending = queue[waiter.user]
+        pending.remove(waiter)
+        if not pending:
+            del queue[waiter.user]
+        self._forget(waiter.user)
+        return False
+
+    def _forget(self, user):
+        self._pending_by_user[user] -= 1
+        if not self._pending_by_user[user]:
+            del self._pending_by_user[user]
+
+    def _release(self, held_for):
+        with self._lock:
+            self._active -= 1
+            if held_for:
+                self._service_time = 0.8 * self._service_time + 0.2 * held_for
+            self._dispatch()
+
+    def _dispatch(self):
+        capacity = settings.LLM_MAX_CONCURRENCY
+        while self._active < capacity:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            if not waiter.wake():
+                continue
+            waiter.granted = True
+            self._active += 1
+            self._stats[waiter.priority].record_wait(time.monotonic() - waiter.enqueued_at)
+
+    def _next_waiter(self):
+        for priority in PRIORITY_NAMES:
+            queue = self._queues[priority]
+            if not queue:
+                continue
+            user, pending = next(iter(queue.items()))
+            waiter = pending.popleft()
+            if pending:
+                queue.move_to_end(user)
+            else:
+                del queue[user]
+            self._forget(user)
+            return waiter
+        return None
+
+
+scheduler = LLMScheduler()
@@ -0,0 +1,69 @@
+"""
+Shared helpers for the ``bench_*`` management commands.
+
+Benchmarks seed their own rows inside a transaction that is rolled back at
+the end, so they can be pointed at a development database without leaving
+data behind.
+"""
+
+import datetime
+import math
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.db import transaction
+from django.middleware.csrf import CSRF_ALLOWED_CHARS
+from django.test import Client
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from sub.models import Subscription, SubscriptionPlan
+
+
+class _Rollback(Exception):
+    pass
+
+
+@contextmanager
+def rolled_back():
+    """Run the block in a transaction and discard everything it wrote."""
+    try:
+        with transaction.atomic():
+            yield
+            raise _Rollback
+    except _Rollback:
+        pass
+
+
+def subscribed_user(username: str, is_doctor: bool = False):
+    """Create a user with an active subscription (and doctor group if asked)."""
+    user = get_user_model().objects.create_user(username=username, password="bench")
+    if is_doctor:
+        group, _ = Group.objects.get_or_create(name="doctor")
+        user.groups.add(group)
+    plan = SubscriptionPlan.objects.create(name=f"bench-{username}", days=31, price=0)
+    Subscription.objects.create(user=user, plan=plan, end_date=timezone.now() + datetime.timedelta(days=31))
+    return user
+
+
+def session_cookies(user):
+    """Return (cookies, csrf_token) that authenticate ``user`` against a running server."""
+    client = Client()
+    client.force_login(user)
+    csrf = get_random_string(32, CSRF_ALLOWED_CHARS)
+    cookies = {
+        settings.SESSION_COOKIE_NAME: client.cookies[settings.SESSION_COOKIE_NAME].value,
+        settings.CSRF_COOKIE_NAME: csrf,
+    }
+    return cookies, csrf
+
+
+def percentile(values, pct: float) -> float:
+    """Nearest-rank percentile of ``values`` (0 < pct <= 100)."""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
@@ -0,0 +1,17 @@
+"""Move old ended sessions to cold-storage segment files (see medagent.archive)."""
+
+from django.core.management.base import BaseCommand
+
+from medagent.archive import archive_sessions
+
+
+class Command(BaseCommand):
+    help = "Archive sessions that ended more than ARCHIVE_AFTER_DAYS ago and delete their hot rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=None, help="Override ARCHIVE_AFTER_DAYS.")
+        parser.add_argument("--batch-size", type=int, default=None)
+
+    def handle(self, *args, **options):
+        archived = archive_sessions(batch_size=options["batch_size"], days=options["days"])
+        self.stdout.write(f"Archived {archived} sessions.")
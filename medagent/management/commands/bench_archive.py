@@ -0,0 +1,74 @@
+"""
+Measure cold-storage archival: hot-table shrinkage, archive throughput and
+rehydration latency.
+
+Seeds ``--sessions`` ended sessions with ``--messages`` messages each,
+archives them into a temporary directory, then rehydrates a sample through
+the transcript endpoint. Everything runs in a rolled-back transaction.
+"""
+
+import datetime
+import tempfile
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from medagent.archive import HistoricalChatMessage, archive_sessions
+from medagent.management.commands._benchutils import percentile, rolled_back, subscribed_user
+from medagent.models import ChatMessage, ChatSession, PatientProfile, SessionSummary
+from medagent.persistence import save_exchange
+
+
+class Command(BaseCommand):
+    help = "Benchmark session archival to zstd segments and lazy rehydration."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sessions", type=int, default=1000)
+        parser.add_argument("--messages", type=int, default=20)
+        parser.add_argument("--reads", type=int, default=100)
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory, override_settings(ARCHIVE_DIR=directory), rolled_back():
+            user = subscribed_user("bench-archive")
+            profile = PatientProfile.objects.create(user=user, national_code="0000000003", phone_number="09000000000")
+            ids = []
+            for i in range(options["sessions"]):
+                session = ChatSession.objects.create(owner=user, patient=profile)
+                for j in range(options["messages"] // 2):
+                    save_exchange(session, f"سلام دکتر، از {j} روز پیش سردرد دارم و خوابم کم شده است.",
+                                  f"برای سردرد {j} روزه استراحت و مصرف آب کافی توصیه می‌شود. " * 3)
+                SessionSummary.objects.create(session=session, text_summary="سردرد مزمن " * 10,
+                                              json_summary={"chief_complaint": "سردرد"}, tokens_used=100)
+                ids.append(session.id)
+            ChatSession.objects.filter(id__in=ids).update(ended_at=timezone.now() - datetime.timedelta(days=365))
+            before = self.hot_rows()
+
+            t0 = time.perf_counter()
+            archived = archive_sessions()
+            elapsed = time.perf_counter() - t0
+            after = self.hot_rows()
+            segment_bytes = sum(path.stat().st_size for path in Path(directory).glob("segment-*.jsonl.zst"))
+
+            client = APIClient()
+            client.force_authenticate(user=user)
+            cold, warm = [], []
+            for session_id in ids[:options["reads"]]:
+                for samples in (cold, warm):
+                    t0 = time.perf_counter()
+                    assert client.get(f"/api/session/{session_id}/messages/?limit=200").status_code == 200
+                    samples.append((time.perf_counter() - t0) * 1000)
+
+        self.stdout.write(f"archived {archived} sessions in {elapsed:.2f}s ({archived / elapsed:.0f} sessions/s)")
+        self.stdout.write(f"hot rows (messages, history, summaries): {before} -> {after}")
+        self.stdout.write(f"segment size {segment_bytes / 1024:.0f} KiB ({segment_bytes / archived:.0f} B/session)")
+        self.stdout.write(f"transcript read   archived p50 {percentile(cold, 50):.1f} ms  p99 {percentile(cold, 99):.1f} ms")
+        self.stdout.write(f"                  hot      p50 {percentile(warm, 50):.1f} ms  p99 {percentile(warm, 99):.1f} ms")
+
+    @staticmethod
+    def hot_rows():
+        return (ChatMessage.objects.count(), HistoricalChatMessage.objects.count(), SessionSummary.objects.count())
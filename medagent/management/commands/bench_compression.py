@@ -0,0 +1,111 @@
+"""
+Measure what the compressed fields save and cost per row.
+
+Generates synthetic Persian chat messages, session summaries and a growing
+patient summary, then reports for each column kind the raw and stored size
+and the encode/decode time per value through the field's own
+``get_db_prep_value`` / ``from_db_value``. Chat messages are measured with
+and without a dictionary trained on a separate sample of messages. No rows
+are written.
+"""
+
+import json
+import random
+import tempfile
+import time
+from pathlib import Path
+
+import zstandard
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+
+from medagent.fields import reset_dictionaries
+from medagent.models import ChatMessage, PatientSummary, SessionSummary
+
+SYMPTOMS = ["سردرد", "تب", "سرفه", "درد معده", "بی‌خوابی", "حالت تهوع", "درد قفسه سینه", "سرگیجه", "خارش پوست"]
+DRUGS = ["استامینوفن", "ایبوپروفن", "آموکسی‌سیلین", "امپرازول", "سرترالین", "متفورمین"]
+OPENERS = ["سلام دکتر،", "ببخشید،", "سلام وقت بخیر.", "دکتر جان،", ""]
+QUESTIONS = ["چه کار کنم؟", "باید نگران باشم؟", "می‌توانم {drug} بخورم؟", "آزمایش لازم است؟", "تا کی طول می‌کشد؟"]
+
+
+def chat_message(rng):
+    text = (
+        f"{rng.choice(OPENERS)} از {rng.randint(1, 14)} روز پیش {rng.choice(SYMPTOMS)} دارم"
+        f"{' و ' + rng.choice(SYMPTOMS) + ' هم دارم' if rng.random() < 0.5 else ''}. "
+        + rng.choice(QUESTIONS).format(drug=rng.choice(DRUGS))
+    )
+    if rng.random() < 0.3:
+        text += f" قبلاً {rng.choice(DRUGS)} مصرف کرده‌ام ولی بهتر نشدم."
+    return text.strip()
+
+
+def assistant_reply(rng):
+    return " ".join(
+        f"با توجه به {rng.choice(SYMPTOMS)}، مصرف {rng.choice(DRUGS)} طبق دستور پزشک و استراحت کافی توصیه می‌شود."
+        for _ in range(rng.randint(2, 6))
+    ) + " در صورت تشدید علائم به پزشک مراجعه کنید."
+
+
+def session_summary(rng):
+    return {
+        "text_summary": assistant_reply(rng),
+        "chief_complaint": rng.choice(SYMPTOMS),
+        "medications": rng.sample(DRUGS, 2),
+        "token_count": rng.randint(200, 900),
+    }
+
+
+class Command(BaseCommand):
+    help = "Benchmark size reduction and encode/decode cost of the zstd-compressed fields."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(7)
+        rows = options["rows"]
+        content = ChatMessage._meta.get_field("content")
+        json_summary = SessionSummary._meta.get_field("json_summary")
+        json_data = PatientSummary._meta.get_field("json_data")
+        user_messages = [chat_message(rng) for _ in range(rows)]
+        replies = [assistant_reply(rng) for _ in range(rows)]
+        summaries = [session_summary(rng) for _ in range(rows)]
+        notes, patients = "", []
+        for i in range(200):
+            notes += f"\n[1403-{i % 12 + 1:02d}-01] " + assistant_reply(rng)
+            patients.append({"notes": notes, "session_count": i + 1})
+
+        with tempfile.TemporaryDirectory() as directory, override_settings(ZSTD_DICTIONARY_DIR=directory):
+            reset_dictionaries()
+            results = [
+                ("chat message (no dict)", content, user_messages),
+                ("assistant reply", content, replies),
+                ("session json_summary", json_summary, summaries),
+                ("patient json_data", json_data, patients),
+            ]
+            self.report(results[:1])
+            training = [chat_message(rng).encode() for _ in range(10_000)]
+            Path(directory, "chat.zdict").write_bytes(zstandard.train_dictionary(16 * 1024, training).as_bytes())
+            reset_dictionaries()
+            results[0] = ("chat message (dict)", content, user_messages)
+            self.report(results, header=False)
+        reset_dictionaries()
+
+    def report(self, results, header=True):
+        if header:
+            self.stdout.write(f"{'column':<24}{'raw B/row':>11}{'stored B/row':>14}{'ratio':>8}{'enc us':>9}{'dec us':>9}")
+        for name, field, values in results:
+            t0 = time.perf_counter()
+            stored = [field.get_db_prep_value(value, connection) for value in values]
+            encode = (time.perf_counter() - t0) / len(values) * 1e6
+            t0 = time.perf_counter()
+            for value in stored:
+                field.from_db_value(value, None, connection)
+            decode = (time.perf_counter() - t0) / len(values) * 1e6
+            # مبنای JSON همان متن با escape یونیکد است که JSONField پیش‌تر ذخیره می‌کرد
+            raw = sum(len(value.encode()) if isinstance(value, str) else len(json.dumps(value)) for value in values)
+            size = sum(len(value) for value in stored)
+            self.stdout.write(
+                f"{name:<24}{raw / len(values):>11.0f}{size / len(values):>14.0f}{raw / size:>8.2f}{encode:>9.1f}{decode:>9.1f}"
+            )
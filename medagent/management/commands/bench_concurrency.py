@@ -0,0 +1,86 @@
+"""
+Measure concurrent PostMessage capacity of a running server.
+
+Typical comparison with one worker each and a slow stub LLM:
+
+    python manage.py stub_talkbot --latency 2
+    TALKBOT_API_BASE=http://127.0.0.1:9100 gunicorn core.wsgi -w 1 --threads 8
+    python manage.py bench_concurrency --base-url http://127.0.0.1:8000 --mode sync
+
+    TALKBOT_API_BASE=http://127.0.0.1:9100 uvicorn core.asgi:application --workers 1
+    python manage.py bench_concurrency --base-url http://127.0.0.1:8000 --mode async
+
+The command seeds a subscribed user and a chat session in the server's
+database, authenticates with a session cookie, fires each concurrency level
+at once and removes the seeded rows afterwards.
+"""
+
+import asyncio
+import time
+
+import httpx
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.utils.crypto import get_random_string
+
+from medagent.management.commands._benchutils import percentile, session_cookies, subscribed_user
+from medagent.models import ChatSession, PatientProfile
+from sub.models import SubscriptionPlan
+
+PATHS = {
+    "sync": "/api/session/{}/message/",
+    "async": "/api/async/session/{}/message/",
+}
+
+
+class Command(BaseCommand):
+    help = "Load-test PostMessage (sync or async route) on a running server."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+        parser.add_argument("--mode", choices=sorted(PATHS), default="sync")
+        parser.add_argument("--levels", default="1,8,32,64,128",
+                            help="Comma-separated numbers of simultaneous requests.")
+        parser.add_argument("--timeout", type=float, default=120)
+
+    def handle(self, *args, **options):
+        user = subscribed_user(f"bench-{get_random_string(8)}")
+        try:
+            profile = PatientProfile.objects.create(
+                user=user, national_code=get_random_string(10, "0123456789"), phone_number="09000000000"
+            )
+            session = ChatSession.objects.create(owner=user, patient=profile)
+            cookies, csrf = session_cookies(user)
+            url = options["base_url"].rstrip("/") + PATHS[options["mode"]].format(session.id)
+
+            self.stdout.write(f"{options['mode']} {url}")
+            self.stdout.write(f"{'concurrency':>12}{'ok':>6}{'errors':>8}{'req/s':>9}{'p50 s':>9}{'p99 s':>9}")
+            for level in map(int, options["levels"].split(",")):
+                ok, errors, elapsed, latencies = asyncio.run(
+                    self._burst(url, session.id, cookies, csrf, level, options["timeout"])
+                )
+                self.stdout.write(
+                    f"{level:>12}{ok:>6}{errors:>8}{ok / elapsed:>9.2f}"
+                    f"{percentile(latencies, 50):>9.2f}{percentile(latencies, 99):>9.2f}"
+                )
+        finally:
+            plan_id = user.subscription.plan_id
+            get_user_model().objects.filter(id=user.id).delete()
+            SubscriptionPlan.objects.filter(id=plan_id).delete()
+
+    async def _burst(self, url, session_id, cookies, csrf, level, timeout):
+        limits = httpx.Limits(max_connections=level, max_keepalive_connections=level)
+        async with httpx.AsyncClient(cookies=cookies, timeout=timeout, limits=limits) as http:
+            async def one():
+                t0 = time.perf_counter()
+                try:
+                    r = await http.post(url, json={"session": session_id, "content": "سلام"}, headers={"X-CSRFToken": csrf})
+                    return r.status_code == 200, time.perf_counter() - t0
+                except httpx.HTTPError:
+                    return False, time.perf_counter() - t0
+
+            start = time.perf_counter()
+            results = await asyncio.gather(*(one() for _ in range(level)))
+            elapsed = time.perf_counter() - start
+        ok = [latency for success, latency in results if success]
+        return len(ok), level - len(ok), elapsed, ok
@@ -0,0 +1,109 @@
+"""
+Benchmark the session event channel.
+
+In-process (default): opens ``--connections`` event_stream iterators on one
+session, reports traced Python memory per subscriber and how long a single
+publish takes to reach all of them.
+
+Against a server (``--base-url`` and ``--server-pid``): holds that many SSE
+connections open on a running ASGI worker and reports the worker's RSS
+growth per connection.
+"""
+
+import asyncio
+import time
+import tracemalloc
+
+import httpx
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.utils.crypto import get_random_string
+
+from medagent.events import broker, event_stream
+from medagent.management.commands._benchutils import session_cookies, subscribed_user
+from medagent.models import ChatSession, PatientProfile
+from sub.models import SubscriptionPlan
+
+
+def _rss_kb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+class Command(BaseCommand):
+    help = "Benchmark SSE connection count, memory per connection and fan-out latency."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--connections", type=int, default=5000)
+        parser.add_argument("--base-url", help="Run against a live server instead of in-process.")
+        parser.add_argument("--server-pid", type=int, help="PID of the server worker (for RSS).")
+
+    def handle(self, *args, **options):
+        if options["base_url"]:
+            self._against_server(options)
+        else:
+            asyncio.run(self._in_process(options["connections"]))
+
+    async def _in_process(self, count):
+        session_id = 10**9
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        streams = [event_stream(session_id) for _ in range(count)]
+        for stream in streams:
+            await stream.__anext__()
+        waiters = [asyncio.ensure_future(stream.__anext__()) for stream in streams]
+        await asyncio.sleep(0)
+        after = tracemalloc.take_snapshot()
+        per_conn = sum(stat.size_diff for stat in after.compare_to(before, "filename")) / count
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        broker.publish_local(session_id, {"type": "session_closed", "session_id": session_id})
+        await asyncio.gather(*waiters)
+        fan_out = (time.perf_counter() - start) * 1000
+        for stream in streams:
+            await stream.aclose()
+
+        self.stdout.write(f"subscribers          {count}")
+        self.stdout.write(f"memory/subscriber    {per_conn / 1024:.2f} KiB (traced Python allocations)")
+        self.stdout.write(f"fan-out to all       {fan_out:.1f} ms")
+        self.stdout.write(f"left subscribed      {broker.subscriber_count()}")
+
+    def _against_server(self, options):
+        user = subscribed_user(f"bench-{get_random_string(8)}")
+        try:
+            profile = PatientProfile.objects.create(
+                user=user, national_code=get_random_string(10, "0123456789"), phone_number="09000000000"
+            )
+            session = ChatSession.objects.create(owner=user, patient=profile)
+            cookies, _ = session_cookies(user)
+            url = f"{options['base_url'].rstrip('/')}/api/session/{session.id}/events/"
+            asyncio.run(self._hold(url, cookies, options["connections"], options["server_pid"]))
+        finally:
+            plan_id = user.subscription.plan_id
+            get_user_model().objects.filter(id=user.id).delete()
+            SubscriptionPlan.objects.filter(id=plan_id).delete()
+
+    async def _hold(self, url, cookies, count, pid):
+        limits = httpx.Limits(max_connections=count)
+        async with httpx.AsyncClient(cookies=cookies, timeout=None, limits=limits) as http:
+            rss_before = _rss_kb(pid) if pid else 0
+            opened = []
+
+            async def open_one():
+                ctx = http.stream("GET", url)
+                response = await ctx.__aenter__()
+                await response.aiter_text().__anext__()
+                opened.append(ctx)
+
+            results = await asyncio.gather(*(open_one() for _ in range(count)), return_exceptions=True)
+            failed = sum(isinstance(r, Exception) for r in results)
+            rss_after = _rss_kb(pid) if pid else 0
+            self.stdout.write(f"open connections     {len(opened)} ({failed} failed)")
+            if pid and opened:
+                self.stdout.write(f"server RSS growth    {(rss_after - rss_before) / len(opened):.1f} KiB/connection")
+            for ctx in opened:
+                await ctx.__aexit__(None, None, None)
@@ -0,0 +1,73 @@
+"""
+Measure knowledge-base index build time and retrieval latency.
+
+Generates ``--files`` Markdown files of ``--sections`` sections each from a
+synthetic Persian vocabulary in a temporary directory. Then times a full
+build, a no-op rebuild, a rebuild after one file changes, and ``--queries``
+searches of 1–4 terms against the memory-mapped index.
+"""
+
+import itertools
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from medagent.knowledge import build_index, get_index
+from medagent.management.commands._benchutils import percentile
+
+LETTERS = "ابپتثجچحخدذرزژسشصضطظعغفقکگلمنوهی"
+
+
+class Command(BaseCommand):
+    help = "Benchmark medical knowledge-base indexing (full and incremental) and query latency."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--files", type=int, default=500)
+        parser.add_argument("--sections", type=int, default=40)
+        parser.add_argument("--queries", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(11)
+        vocabulary = ["".join(rng.choices(LETTERS, k=rng.randint(3, 8))) for _ in range(50000)]
+        cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+
+        def section(n):
+            return f"## بخش {n}\n\n" + " ".join(rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(60, 160)))
+
+        with tempfile.TemporaryDirectory() as directory:
+            kb, index_dir = Path(directory) / "kb", Path(directory) / "index"
+            kb.mkdir()
+            for i in range(options["files"]):
+                body = "\n\n".join(section(n) for n in range(options["sections"]))
+                (kb / f"topic-{i:05d}.md").write_text(f"# موضوع {i}\n\n{body}\n", encoding="utf-8")
+            size = sum(path.stat().st_size for path in kb.iterdir())
+
+            with override_settings(MEDICAL_KB_PATH=str(kb), MEDICAL_KB_INDEX_DIR=str(index_dir)):
+                timings = {}
+                for label, change in (("full build", None), ("no-op rebuild", None), ("one file changed", 0)):
+                    if change is not None:
+                        with open(kb / f"topic-{change:05d}.md", "a", encoding="utf-8") as handle:
+                            handle.write("\n\n" + section(999) + "\n")
+                    t0 = time.perf_counter()
+                    stats = build_index()
+                    timings[label] = (time.perf_counter() - t0, stats)
+
+                index = get_index()
+                index_bytes = sum(path.stat().st_size for path in (index_dir / stats["generation"]).iterdir())
+                samples = []
+                for _ in range(options["queries"]):
+                    query = " ".join(rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(1, 4)))
+                    t0 = time.perf_counter()
+                    index.search(query, 3)
+                    samples.append((time.perf_counter() - t0) * 1000)
+
+        self.stdout.write(f"{options['files']} files, {size / 2**20:.1f} MiB, {len(index)} passages, "
+                          f"{len(index.vocabulary)} terms, index {index_bytes / 2**20:.1f} MiB")
+        for label, (elapsed, stats) in timings.items():
+            self.stdout.write(f"{label:17s} {elapsed:7.2f}s  ({stats['tokenized']} files tokenized)")
+        self.stdout.write(f"query p50 {percentile(samples, 50):.2f} ms  p95 {percentile(samples, 95):.2f} ms  "
+                          f"p99 {percentile(samples, 99):.2f} ms")
@@ -0,0 +1,97 @@
+"""
+Benchmark OTP verification latency against a large OTP history.
+
+Seeds ``--history`` OTPVerification rows for one patient and times:
+
+* legacy  – the old lookup, forced onto the patient_id FK index so the
+            newest row is found by sorting the patient's whole history
+* db      – DatabaseOTPBackend.verify using the (patient, -created_at) index
+* cache   – CacheOTPBackend.verify (a single cache lookup)
+"""
+
+import datetime
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from medagent.management.commands._benchutils import percentile, rolled_back
+from medagent.models import OTPVerification, PatientProfile
+from medagent.otp import CacheOTPBackend, DatabaseOTPBackend, hash_code
+
+
+class Command(BaseCommand):
+    help = "Benchmark OTP verify latency with a large OTP history."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--history", type=int, default=100_000)
+        parser.add_argument("--runs", type=int, default=500)
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("The legacy baseline uses SQLite's INDEXED BY; run against SQLite.")
+
+        with rolled_back():
+            user = get_user_model().objects.create_user(username="bench-otp")
+            patient = PatientProfile.objects.create(user=user, national_code="0000000002", phone_number="09000000000")
+            start = timezone.now() - datetime.timedelta(days=365)
+            OTPVerification.objects.bulk_create(
+                (
+                    OTPVerification(
+                        patient=patient,
+                        code_hash=hash_code(f"{i:06d}"),
+                        expires_at=start,
+                    )
+                    for i in range(options["history"])
+                ),
+                batch_size=5000,
+            )
+            # auto_now_add همه را هم‌زمان می‌کند؛ تاریخچه‌ی واقعی را شبیه‌سازی می‌کنیم
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "UPDATE medagent_otpverification SET created_at = datetime(%s, '+' || id || ' seconds') WHERE patient_id = %s",
+                    [start.strftime("%Y-%m-%d %H:%M:%S"), patient.id],
+                )
+
+            db_backend, cache_backend = DatabaseOTPBackend(), CacheOTPBackend()
+            db_backend._store(patient, hash_code("123456"), 10)
+            cache_backend._store(patient, hash_code("123456"), 10)
+            fk_index = self._fk_index_name()
+
+            def legacy():
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f'SELECT id, code_hash, expires_at FROM medagent_otpverification INDEXED BY "{fk_index}" '
+                        "WHERE patient_id = %s ORDER BY created_at DESC LIMIT 1",
+                        [patient.id],
+                    )
+                    cursor.fetchone()
+
+            results = [
+                ("legacy", self._time(legacy, options["runs"])),
+                ("db", self._time(lambda: db_backend._check(patient, hash_code("123456")), options["runs"])),
+                ("cache", self._time(lambda: cache_backend._check(patient, hash_code("123456")), options["runs"])),
+            ]
+
+        self.stdout.write(f"history={options['history']} rows, runs={options['runs']}")
+        self.stdout.write(f"{'mode':<8}{'p50 ms':>10}{'p99 ms':>10}")
+        for mode, samples in results:
+            self.stdout.write(f"{mode:<8}{percentile(samples, 50):>10.3f}{percentile(samples, 99):>10.3f}")
+
+    def _time(self, fn, runs):
+        samples = []
+        for _ in range(runs):
+            t0 = time.perf_counter()
+            fn()
+            samples.append((time.perf_counter() - t0) * 1000)
+        return samples
+
+    def _fk_index_name(self):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, OTPVerification._meta.db_table)
+        for name, info in constraints.items():
+            if info["index"] and info["columns"] == ["patient_id"]:
+                return name
+        raise CommandError("patient_id index not found")
@@ -0,0 +1,123 @@
+"""
+Measure full-text search latency over a large message corpus.
+
+Seeds ``--documents`` search documents spread over ``--patients`` patients
+(one owner each), with Zipf-distributed words from a synthetic Persian
+vocabulary and a rare phrase in 0.1% of them. Then times ``search`` for an
+owner and for a doctor with access to ``--doctor-patients`` patients, on
+the FTS5 backend (access check in the MATCH expression, then as an SQL
+filter) and on the LIKE-scan database backend. Before timing it reports
+what the index costs on disk: the normalized ``SearchDocument.body`` copy,
+the same text zstd-compressed as the source columns store it, and the FTS5
+index itself. Everything runs in a rolled-back transaction.
+"""
+
+import datetime
+import itertools
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connections, router
+from django.db.models import Sum
+from django.db.models.functions import Length
+from django.test import override_settings
+from django.utils import timezone
+
+from medagent.management.commands._benchutils import percentile, rolled_back
+from medagent.models import AccessHistory, ChatSession, PatientProfile, SearchDocument
+from medagent.fields import compress
+from medagent.search import FTS5SearchBackend, normalize, search
+
+LETTERS = "ابپتثجچحخدذرزژسشصضطظعغفقکگلمنوهی"
+COMMON = ["درد", "سر", "دارو", "روز", "بیمار", "دکتر", "فشار", "خون", "تب", "سرفه"]
+PHRASE = "درد قفسه سینه"
+
+
+class Command(BaseCommand):
+    help = "Benchmark ranked, access-controlled full-text search (FTS5 vs LIKE scan)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--documents", type=int, default=1_000_000)
+        parser.add_argument("--patients", type=int, default=2000)
+        parser.add_argument("--doctor-patients", type=int, default=50)
+        parser.add_argument("--queries", type=int, default=50)
+        parser.add_argument("--scan-queries", type=int, default=3)
+
+    def handle(self, *args, **options):
+        rng = random.Random(7)
+        vocabulary = COMMON + ["".join(rng.choices(LETTERS, k=rng.randint(3, 7))) for _ in range(20000)]
+        cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+        with rolled_back():
+            User = get_user_model()
+            users = User.objects.bulk_create([User(username=f"bench-search-{i}") for i in range(options["patients"] + 1)])
+            doctor, owners = users[0], users[1:]
+            profiles = PatientProfile.objects.bulk_create([
+                PatientProfile(user=user, national_code=f"{i:010d}", phone_number="09000000000")
+                for i, user in enumerate(owners)
+            ])
+            sessions = ChatSession.objects.bulk_create([ChatSession(owner=p.user, patient=p) for p in profiles])
+            AccessHistory.objects.bulk_create([
+                AccessHistory(doctor=doctor, patient=p) for p in profiles[:options["doctor_patients"]]
+            ])
+
+            t0 = time.perf_counter()
+            now, batch = timezone.now(), []
+            for i in range(options["documents"]):
+                session = sessions[i % len(sessions)]
+                words = rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(8, 30))
+                if rng.random() < 0.001:
+                    words.insert(rng.randrange(len(words)), PHRASE)
+                batch.append(SearchDocument(
+                    kind=SearchDocument.MESSAGE, object_id=i, session=session, patient_id=session.patient_id,
+                    owner_id=session.owner_id, role="owner", created_at=now - datetime.timedelta(seconds=i),
+                    body=normalize(" ".join(words)), scope=f"p{session.patient_id} o{session.owner_id}",
+                ))
+                if len(batch) == 10000:
+                    SearchDocument.objects.bulk_create(batch)
+                    batch = []
+            SearchDocument.objects.bulk_create(batch)
+            self.stdout.write(f"indexed {options['documents']} documents in {time.perf_counter() - t0:.1f}s")
+            self.report_storage(options["documents"])
+
+            owner = owners[0]
+            cases = [("owner", owner.id, "سرفه"), ("owner", owner.id, PHRASE),
+                     ("doctor", doctor.id, "سرفه"), ("doctor", doctor.id, PHRASE),
+                     ("doctor", doctor.id, vocabulary[5000])]
+            for backend, scopes, count in (("FTS5SearchBackend", 200, options["queries"]),
+                                           ("FTS5SearchBackend", 0, options["queries"]),
+                                           ("DatabaseSearchBackend", 0, options["scan_queries"])):
+                label = f"{backend}{' (SQL ACL)' if backend.startswith('FTS5') and not scopes else ''}"
+                with override_settings(SEARCH_BACKEND=f"medagent.search.{backend}", SEARCH_MAX_SCOPE_TOKENS=scopes):
+                    for who, user_id, query in cases:
+                        samples, hits = [], 0
+                        for _ in range(count):
+                            t0 = time.perf_counter()
+                            hits = len(search(user_id, query, 20))
+                            samples.append((time.perf_counter() - t0) * 1000)
+                        self.stdout.write(
+                            f"{label:32s} {who:6s} {query[:14]:14s} hits {hits:2d}  "
+                            f"p50 {percentile(samples, 50):8.1f} ms  p95 {percentile(samples, 95):8.1f} ms"
+                        )
+
+    def report_storage(self, documents):
+        # Length شمار نویسه است؛ متن فارسی در UTF-8 حدود دو بایت برای هر نویسه می‌گیرد
+        chars = SearchDocument.objects.aggregate(total=Sum(Length("body")))["total"] or 0
+        sample = list(SearchDocument.objects.values_list("body", flat=True)[:10000])
+        raw = sum(len(body.encode()) for body in sample)
+        packed = sum(len(compress(body.encode())) for body in sample)
+        body_bytes = chars * raw / max(sum(len(body) for body in sample), 1)
+        lines = [
+            f"body copy        {body_bytes / 2**20:8.1f} MiB  {body_bytes / documents:6.0f} B/doc",
+            f"zstd (as stored) {body_bytes * packed / max(raw, 1) / 2**20:8.1f} MiB  "
+            f"{body_bytes * packed / max(raw, 1) / documents:6.0f} B/doc",
+        ]
+        connection = connections[router.db_for_write(SearchDocument)]
+        if connection.vendor == "sqlite":
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT SUM(LENGTH(block)) FROM {FTS5SearchBackend.table}_data")
+                index_bytes = cursor.fetchone()[0] or 0
+            lines.append(f"FTS5 index       {index_bytes / 2**20:8.1f} MiB  {index_bytes / documents:6.0f} B/doc")
+        for line in lines:
+            self.stdout.write(line)
@@ -0,0 +1,52 @@
+"""
+Compare request-path latency of inline SMS sends with queued dispatch.
+
+Uses FakeSMSProvider with a simulated provider round trip so no real SMS is
+sent. ``inline`` is what RequestOTP used to pay per request; ``queued`` is
+the cost of dispatch_sms (one INSERT plus an enqueue).
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from medagent import sms
+from medagent.management.commands._benchutils import percentile
+from medagent.models import SMSDelivery
+
+
+class Command(BaseCommand):
+    help = "Benchmark inline vs queued SMS sending with a fake provider."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=50)
+        parser.add_argument("--latency", type=float, default=0.3,
+                            help="Simulated provider round trip in seconds.")
+
+    def handle(self, *args, **options):
+        with override_settings(SMS_PROVIDER="medagent.sms.FakeSMSProvider",
+                               SMS_FAKE_LATENCY=options["latency"],
+                               BACKGROUND_TASKS_EAGER=False):
+            sms._providers.pop("medagent.sms.FakeSMSProvider", None)
+            inline = self._time(lambda: sms.send_sms("09000000000", "bench"), options["messages"])
+            ids = []
+            queued = self._time(lambda: ids.append(sms.dispatch_sms("09000000000", "bench").id), options["messages"])
+            t0 = time.perf_counter()
+            sms.sms_queue.join()
+            drained = time.perf_counter() - t0
+            sent = SMSDelivery.objects.filter(id__in=ids, status=SMSDelivery.SENT).count()
+            SMSDelivery.objects.filter(id__in=ids).delete()
+
+        self.stdout.write(f"{'mode':<8}{'p50 ms':>10}{'p99 ms':>10}")
+        for mode, samples in (("inline", inline), ("queued", queued)):
+            self.stdout.write(f"{mode:<8}{percentile(samples, 50):>10.2f}{percentile(samples, 99):>10.2f}")
+        self.stdout.write(f"queue drained {sent}/{len(ids)} messages {drained:.2f}s after the last enqueue")
+
+    def _time(self, fn, runs):
+        samples = []
+        for _ in range(runs):
+            t0 = time.perf_counter()
+            fn()
+            samples.append((time.perf_counter() - t0) * 1000)
+        return samples
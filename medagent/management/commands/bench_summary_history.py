@@ -0,0 +1,65 @@
+"""
+Measure PatientSummary history storage and reconstruction with JSON Patch deltas.
+
+Simulates a chronic patient whose summary gains one session entry per
+version and reports:
+
+* bytes of JSON kept in history rows, against what full snapshots of every
+  version would have taken;
+* save latency (including the delta computation);
+* latency of rebuilding a random version through ``record.instance``.
+"""
+
+import json
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from medagent.management.commands._benchutils import percentile, rolled_back, subscribed_user
+from medagent.models import PatientProfile, PatientSummary
+
+
+class Command(BaseCommand):
+    help = "Benchmark delta-based PatientSummary history: storage size and reconstruction latency."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--versions", type=int, default=300)
+        parser.add_argument("--reads", type=int, default=200)
+
+    def handle(self, *args, **options):
+        with rolled_back():
+            user = subscribed_user("bench-history")
+            profile = PatientProfile.objects.create(user=user, national_code="0000000002", phone_number="09000000000")
+            summary = PatientSummary.objects.create(patient=profile, json_data={"sessions": []})
+            full_bytes = len(json.dumps(summary.json_data))
+            saves = []
+            for i in range(options["versions"]):
+                data = dict(summary.json_data)
+                data["sessions"] = data["sessions"] + [{
+                    "date": f"1403-01-{i % 30 + 1:02d}",
+                    "chief_complaint": "سردرد مزمن و بی‌خوابی",
+                    "notes": "بیمار از ادامه‌ی درمان رضایت دارد. " * 4,
+                }]
+                data["last_visit"] = i
+                summary.json_data = data
+                t0 = time.perf_counter()
+                summary.save()
+                saves.append((time.perf_counter() - t0) * 1000)
+                full_bytes += len(json.dumps(data))
+
+            rows = summary.history.values_list("json_data_checkpoint", "json_data_patch")
+            delta_bytes = sum(len(json.dumps(checkpoint if checkpoint is not None else patch)) for checkpoint, patch in rows)
+            records = list(summary.history.all())
+            reads = []
+            for record in random.sample(records, min(options["reads"], len(records))):
+                t0 = time.perf_counter()
+                record.instance
+                reads.append((time.perf_counter() - t0) * 1000)
+
+        self.stdout.write(f"versions={len(records)} checkpoint every {settings.HISTORY_CHECKPOINT_EVERY}")
+        self.stdout.write(f"full snapshots  {full_bytes / 1024:>10.1f} KiB")
+        self.stdout.write(f"patch history   {delta_bytes / 1024:>10.1f} KiB ({full_bytes / delta_bytes:.1f}x smaller)")
+        self.stdout.write(f"save       p50 {percentile(saves, 50):.2f} ms  p99 {percentile(saves, 99):.2f} ms")
+        self.stdout.write(f"rebuild    p50 {percentile(reads, 50):.2f} ms  p99 {percentile(reads, 99):.2f} ms")
@@ -0,0 +1,64 @@
+"""
+Measure what conditional GET and payload caching save per summary poll.
+
+Runs three kinds of dashboard polls against GetPatientSummary and reports
+response bytes and process CPU time per poll:
+
+* cold   – cache invalidated before every request (the old behavior)
+* cached – payload served from the summary cache
+* 304    – client sends the previous ETag in If-None-Match
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIClient
+
+from medagent.management.commands._benchutils import rolled_back, subscribed_user
+from medagent.models import PatientProfile, PatientSummary
+from medagent.summary_cache import invalidate_summary
+
+
+class Command(BaseCommand):
+    help = "Benchmark bytes and CPU per poll for patient summary conditional GETs."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--polls", type=int, default=200)
+        parser.add_argument("--entries", type=int, default=200,
+                            help="Number of keys in the seeded json_data blob.")
+
+    def handle(self, *args, **options):
+        polls = options["polls"]
+        with rolled_back():
+            user = subscribed_user("bench-poller")
+            profile = PatientProfile.objects.create(user=user, national_code="0000000001", phone_number="09000000000")
+            PatientSummary.objects.create(
+                patient=profile,
+                json_data={f"finding_{i}": "یافته‌ی بالینی نمونه " * 3 for i in range(options["entries"])},
+            )
+            client = APIClient()
+            client.force_authenticate(user=user)
+            url = f"/api/patient/{profile.id}/summary/"
+            etag = client.get(url)["ETag"]
+
+            def run(headers=None, cold=False):
+                size = 0
+                start = time.process_time()
+                for _ in range(polls):
+                    if cold:
+                        invalidate_summary("patient", profile.id)
+                    size += len(client.get(url, **(headers or {})).content)
+                return size / polls, (time.process_time() - start) * 1000 / polls
+
+            rows = [
+                ("cold", *run(cold=True)),
+                ("cached", *run()),
+                ("304", *run({"HTTP_IF_NONE_MATCH": etag})),
+            ]
+
+        base_bytes, base_cpu = rows[0][1], rows[0][2]
+        self.stdout.write(f"{'mode':<8}{'bytes/poll':>12}{'cpu ms/poll':>14}{'bytes saved':>14}{'cpu saved':>12}")
+        for mode, size, cpu in rows:
+            self.stdout.write(
+                f"{mode:<8}{size:>12.0f}{cpu:>14.3f}{base_bytes - size:>14.0f}{base_cpu - cpu:>12.3f}"
+            )
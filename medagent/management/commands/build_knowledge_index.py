@@ -0,0 +1,26 @@
+"""Build or incrementally refresh the medical knowledge-base index (see medagent.knowledge)."""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from medagent.knowledge import build_index
+
+
+class Command(BaseCommand):
+    help = "Index MEDICAL_KB_PATH into memory-mappable BM25 arrays; only changed files are re-tokenized."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true", help="Ignore cached shards and rebuild everything.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        stats = build_index(force=options["force"])
+        elapsed = time.perf_counter() - started
+        if not stats["rebuilt"]:
+            self.stdout.write(f"{stats['files']} files unchanged; {stats['generation']} is current ({elapsed:.2f}s).")
+            return
+        self.stdout.write(
+            f"Built {stats['generation']}: {stats['passages']} passages from {stats['files']} files "
+            f"({stats['tokenized']} re-tokenized) in {elapsed:.2f}s."
+        )
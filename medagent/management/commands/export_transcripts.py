@@ -0,0 +1,40 @@
+"""
+Export transcripts as NDJSON or CSV (see medagent.export).
+
+Writes to ``--output`` or stdout and reports rows, bytes and throughput on
+stderr, so it can be piped straight into another tool.
+"""
+
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from medagent.export import COMPRESSIONS, FORMATS, export_chunks
+
+
+class Command(BaseCommand):
+    help = "Stream a patient's (or every) sessions, summaries and messages as NDJSON or CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--patient", type=int, default=None, help="PatientProfile id; all patients if omitted.")
+        parser.add_argument("--fmt", choices=sorted(FORMATS), default="ndjson")
+        parser.add_argument("--compression", choices=sorted(COMPRESSIONS), default=None)
+        parser.add_argument("--output", default="-", help="File path, or - for stdout.")
+
+    def handle(self, *args, **options):
+        stats, written = {}, 0
+        output = sys.stdout.buffer if options["output"] == "-" else open(options["output"], "wb")
+        started = time.perf_counter()
+        try:
+            for block in export_chunks(options["patient"], options["fmt"], options["compression"], stats):
+                output.write(block)
+                written += len(block)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+        elapsed = time.perf_counter() - started
+        self.stderr.write(
+            f"Exported {stats['rows']} rows, {written / 1024:.0f} KiB in {elapsed:.2f}s "
+            f"({stats['rows'] / elapsed if elapsed else 0:.0f} rows/s)"
+        )
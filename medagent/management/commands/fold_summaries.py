@@ -0,0 +1,16 @@
+"""Fold SessionSummary rows that are not yet in their PatientSummary (see medagent.aggregation)."""
+
+from django.core.management.base import BaseCommand
+
+from medagent.aggregation import fold_pending
+
+
+class Command(BaseCommand):
+    help = "Merge unfolded session summaries into patient summaries, oldest first."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        folded = fold_pending(batch_size=options["batch_size"])
+        self.stdout.write(f"Folded {folded} session summaries.")
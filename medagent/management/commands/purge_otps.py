@@ -0,0 +1,16 @@
+"""Delete expired OTPVerification rows (used with DatabaseOTPBackend)."""
+
+from django.core.management.base import BaseCommand
+
+from medagent.models import OTPVerification
+
+
+class Command(BaseCommand):
+    help = "Delete expired OTP rows in batches using the expires_at index."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        deleted = OTPVerification.purge_expired(batch_size=options["batch_size"])
+        self.stdout.write(f"Deleted {deleted} expired OTP rows.")
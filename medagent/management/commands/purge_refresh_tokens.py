@@ -0,0 +1,16 @@
+"""Delete expired IssuedRefreshToken rows."""
+
+from django.core.management.base import BaseCommand
+
+from medagent.models import IssuedRefreshToken
+
+
+class Command(BaseCommand):
+    help = "Delete expired refresh-token rows in batches using the expires_at index."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        deleted = IssuedRefreshToken.purge_expired(batch_size=options["batch_size"])
+        self.stdout.write(f"Deleted {deleted} expired refresh tokens.")
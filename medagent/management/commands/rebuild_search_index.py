@@ -0,0 +1,19 @@
+"""Create the search index if needed and (re)index every hot message and summary (see medagent.search)."""
+
+from django.core.management.base import BaseCommand
+from django.db import router
+
+from medagent.models import SearchDocument
+from medagent.search import get_search_backend, rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Backfill search documents for existing chat messages and session summaries."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        get_search_backend().install(router.db_for_write(SearchDocument))
+        indexed = rebuild_index(batch_size=options["batch_size"])
+        self.stdout.write(f"Indexed {indexed} messages and summaries.")
@@ -0,0 +1,21 @@
+"""Re-send SMSDelivery rows left queued by a restarted process."""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from medagent.sms import requeue_stale_deliveries, sms_queue
+
+
+class Command(BaseCommand):
+    help = "Re-queue SMS deliveries stuck in 'queued' and fail those too old to send."
+
+    def add_arguments(self, parser):
+        # بیش از مجموع تلاش‌ها و backoff یک ارسال عادی، تا ردیف‌های در حال ارسال دوباره فرستاده نشوند
+        parser.add_argument("--min-age", type=int, default=120, help="Seconds a row must have been queued.")
+        parser.add_argument("--max-age", type=int, default=settings.OTP_TTL_MINUTES * 60,
+                            help="Rows queued longer than this are marked failed.")
+
+    def handle(self, *args, **options):
+        requeued, expired = requeue_stale_deliveries(options["min_age"], options["max_age"])
+        sms_queue.join()
+        self.stdout.write(f"Re-queued {requeued} SMS deliveries, failed {expired} expired ones.")
@@ -0,0 +1,54 @@
+"""
+Run a slow stand-in for the TalkBot API for load tests.
+
+Point the server under test at it with TALKBOT_API_BASE=http://host:port.
+Chat calls sleep ``--latency`` seconds and return a ReAct final answer so
+the agent finishes in one step; profanity calls sleep ``--profanity-latency``.
+"""
+
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Serve a stub TalkBot API with configurable latency."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=9100)
+        parser.add_argument("--latency", type=float, default=2.0)
+        parser.add_argument("--profanity-latency", type=float, default=0.2)
+
+    def handle(self, *args, **options):
+        latency, profanity_latency = options["latency"], options["profanity_latency"]
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.path.rstrip("/").endswith("/chat"):
+                    time.sleep(latency)
+                    body = "Final Answer: stub reply".encode()
+                    content_type = "text/plain; charset=utf-8"
+                else:
+                    time.sleep(profanity_latency)
+                    body = json.dumps({"contains_profanity": False}).encode()
+                    content_type = "application/json"
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((options["host"], options["port"]), Handler)
+        server.daemon_threads = True
+        self.stdout.write(f"Stub TalkBot on http://{options['host']}:{options['port']} (chat latency {latency}s)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
@@ -0,0 +1,42 @@
+"""
+Train the zstd dictionary used by ``CompressedTextField(dictionary="chat")``.
+
+Samples recent ChatMessage contents and writes ``chat.zdict`` to
+``settings.ZSTD_DICTIONARY_DIR``, plus ``chat.<dict_id>.zdict`` so rows
+compressed with this dictionary stay readable after the next retraining.
+Restart the workers afterwards so they pick up the new dictionary.
+"""
+
+from pathlib import Path
+
+import zstandard
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from medagent.fields import reset_dictionaries
+from medagent.models import ChatMessage
+
+
+class Command(BaseCommand):
+    help = "Train the chat message zstd dictionary from stored messages."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--samples", type=int, default=50_000)
+        parser.add_argument("--size", type=int, default=16 * 1024, help="Dictionary size in bytes.")
+
+    def handle(self, *args, **options):
+        samples = [
+            content.encode()
+            for content in ChatMessage.objects.order_by("-id").values_list("content", flat=True)[:options["samples"]]
+            if content
+        ]
+        if len(samples) < 100:
+            raise CommandError(f"Need at least 100 messages to train a dictionary, found {len(samples)}.")
+        dictionary = zstandard.train_dictionary(options["size"], samples)
+        directory = Path(settings.ZSTD_DICTIONARY_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        data = dictionary.as_bytes()
+        (directory / f"chat.{dictionary.dict_id()}.zdict").write_bytes(data)
+        (directory / "chat.zdict").write_bytes(data)
+        reset_dictionaries()
+        self.stdout.write(f"Trained dictionary {dictionary.dict_id()} ({len(data)} bytes) from {len(samples)} messages.")
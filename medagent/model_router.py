@@ -0,0 +1,125 @@
+"""
+Model routing for TalkBot calls.
+
+Callers ask ``router.choose(task, prompt_tokens)`` for a model instead of
+pinning one. Each task (``chat``, ``summary``, ``vision``) has an ordered
+list of candidate models in ``settings.LLM_ROUTES``. The router walks the
+list and returns the first candidate that:
+
+* fits the prompt – the estimated tokens are within the model's
+  ``max_prompt_tokens`` in ``settings.LLM_MODELS``;
+* is healthy – in the last ``LLM_ROUTER_WINDOW`` seconds its error rate is
+  at most ``LLM_ROUTER_MAX_ERROR_RATE`` and its mean latency is within the
+  model's ``latency_slo``.
+
+A degraded primary therefore fails over to the next model. Once its bad
+samples age out of the window, it is tried again. ``talkbot_client`` reports
+the latency and outcome of every call through ``router.observe``.
+``router.metrics()`` exports routing decisions and per-model outcomes.
+
+Moderation is not routed: the profanity endpoint takes no model.
+"""
+
+import threading
+import time
+from collections import Counter, defaultdict, deque
+
+from django.conf import settings
+
+TASKS = ("chat", "summary", "vision")
+
+
+def estimate_tokens(messages) -> int:
+    """Rough token count for a prompt string or a list of chat messages."""
+    if isinstance(messages, str):
+        messages = [{"content": messages}]
+    chars = sum(len(str(message.get("content", ""))) for message in messages)
+    # حدود ۳ نویسه برای هر توکن (متن فارسی کوتاه‌تر از انگلیسی توکن می‌شود) و سربار هر پیام
+    return chars // 3 + 4 * len(messages)
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class ModelRouter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=500))  # model -> (time, seconds, ok)
+        self._decisions = Counter()  # (task, model, reason) -> count
+
+    def choose(self, task: str, prompt_tokens: int = 0) -> str:
+        models = settings.LLM_MODELS
+        candidates = [
+            name for name in settings.LLM_ROUTES[task]
+            if prompt_tokens <= models[name]["max_prompt_tokens"]
+        ]
+        if not candidates:
+            # هیچ مدلی جا ندارد؛ بزرگ‌ترین پنجره بیشترین شانس را دارد
+            candidates = [max(settings.LLM_ROUTES[task], key=lambda name: models[name]["max_prompt_tokens"])]
+
+        with self._lock:
+            health = {name: self._health(name) for name in candidates}
+            for index, name in enumerate(candidates):
+                if health[name]["healthy"]:
+                    reason = "primary" if index == 0 else "failover"
+                    break
+            else:
+                name = min(candidates, key=lambda n: (health[n]["error_rate"], health[n]["latency_mean"]))
+                reason = "degraded"
+            self._decisions[(task, name, reason)] += 1
+        return name
+
+    def observe(self, model: str, seconds: float, ok: bool) -> None:
+        with self._lock:
+            self._samples[model].append((time.monotonic(), seconds, ok))
+
+    def metrics(self) -> dict:
+        with self._lock:
+            models = {}
+            for name in sorted(set(settings.LLM_MODELS) | set(self._samples)):
+                health = self._health(name)
+                models[name] = {
+                    "healthy": health["healthy"],
+                    "samples": health["samples"],
+                    "error_rate": health["error_rate"],
+                    "latency_mean": health["latency_mean"],
+                    "latency_p95": health["latency_p95"],
+                }
+            decisions = [
+                {"task": task, "model": model, "reason": reason, "count": count}
+                for (task, model, reason), count in sorted(self._decisions.items())
+            ]
+            return {"models": models, "decisions": decisions}
+
+    # ---------- درون قفل ---------- #
+
+    def _health(self, model):
+        cutoff = time.monotonic() - settings.LLM_ROUTER_WINDOW
+        samples = self._samples.get(model, ())
+        while samples and samples[0][0] < cutoff:
+            samples.popleft()
+
+        latencies = [seconds for _, seconds, ok in samples if ok]
+        errors = sum(1 for _, _, ok in samples if not ok)
+        error_rate = errors / len(samples) if samples else 0.0
+        latency_mean = sum(latencies) / len(latencies) if latencies else 0.0
+        healthy = True
+        if len(samples) >= settings.LLM_ROUTER_MIN_SAMPLES:
+            slo = settings.LLM_MODELS.get(model, {}).get("latency_slo")
+            healthy = error_rate <= settings.LLM_ROUTER_MAX_ERROR_RATE and (
+                slo is None or latency_mean <= slo
+            )
+        return {
+            "healthy": healthy,
+            "samples": len(samples),
+            "error_rate": error_rate,
+            "latency_mean": latency_mean,
+            "latency_p95": _percentile(latencies, 0.95),
+        }
+
+
+router = ModelRouter()
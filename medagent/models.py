@@ -3,17 +3,26 @@ Data models for the MedAgent application.
 
 These models capture the domain of a telemedicine chat system. They include
 profiles for patients, chat sessions and messages, one-time OTP verifications,
-access history logs, and session summaries. Historical records are tracked
-using django-simple-history where appropriate.
+access history logs, session summaries, SMS delivery tracking and issued
+refresh tokens. Historical records are tracked
+using django-simple-history where appropriate; PatientSummary history stores
+json_data as JSON Patch deltas (medagent.history). Large text and JSON
+columns are stored zstd-compressed (medagent.fields), and old ended sessions
+are moved to compressed segment files (medagent.archive). SearchDocument
+holds the normalized text that medagent.search indexes.
 """
 
 import hashlib
+import hmac
 import datetime
 from django.db import models
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from simple_history.models import HistoricalRecords
 
+from medagent.fields import CompressedJSONField, CompressedTextField
+from medagent.history import DeltaHistoricalRecords
+
 User = get_user_model()
 
 class PatientProfile(models.Model):
@@ -27,9 +36,10 @@ class PatientProfile(models.Model):
 
 class PatientSummary(models.Model):
     patient = models.OneToOneField(PatientProfile, on_delete=models.CASCADE)
-    json_data = models.JSONField(default=dict, blank=True)
+    json_data = CompressedJSONField(default=dict, blank=True)
     updated_at = models.DateTimeField(auto_now=True)
-    history = HistoricalRecords()
+    # تاریخچه‌ی json_data به‌صورت JSON Patch با نقطه‌های کامل دوره‌ای ذخیره می‌شود
+    history = DeltaHistoricalRecords(delta_field="json_data")
 
     def __str__(self):
         return f"Summary for {self.patient}"
@@ -39,6 +49,20 @@ class OTPVerification(models.Model):
     code_hash = models.CharField(max_length=64)
     created_at = models.DateTimeField(auto_now_add=True)
     expires_at = models.DateTimeField()
+    # زمان مصرف کد؛ کد مصرف‌شده دوباره پذیرفته نمی‌شود
+    used_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # آخرین کد هر بیمار بدون مرتب‌سازی کل تاریخچه
+            models.Index(fields=["patient", "-created_at"], name="otp_patient_created_idx"),
+            # پاک‌سازی دوره‌ای کدهای منقضی
+            models.Index(fields=["expires_at"], name="otp_expires_idx"),
+        ]
+
+    @staticmethod
+    def expiry(minutes: int = 10):
+        return timezone.now() + datetime.timedelta(minutes=minutes)
 
     @classmethod
     def create(cls, patient, raw_code: str, minutes: int = 10):
@@ -46,18 +70,35 @@ class OTPVerification(models.Model):
         return cls.objects.create(
             patient=patient,
             code_hash=hashlib.sha256(raw_code.encode()).hexdigest(),
-            expires_at=timezone.now() + datetime.timedelta(minutes=minutes),
+            expires_at=cls.expiry(minutes),
         )
 
+    @classmethod
+    def purge_expired(cls, batch_size: int = 1000) -> int:
+        """Delete expired rows in batches of ``batch_size``; return how many were removed."""
+        total = 0
+        now = timezone.now()
+        while True:
+            ids = list(cls.objects.filter(expires_at__lte=now).values_list("id", flat=True)[:batch_size])
+            if not ids:
+                return total
+            total += cls.objects.filter(id__in=ids).delete()[0]
+
     def valid(self, raw_code: str) -> bool:
         """
         Validate the provided raw code against the stored hash and expiration.
 
-        Returns True if the current time is before expires_at and the hashes match.
+        Returns True if the code is unused, the current time is before
+        expires_at and the hashes match.
         """
+        return self.valid_hash(hashlib.sha256(raw_code.encode()).hexdigest())
+
+    def valid_hash(self, code_hash: str) -> bool:
+        """Like valid(), for a code that has already been hashed."""
         return (
-            timezone.now() < self.expires_at and
-            hashlib.sha256(raw_code.encode()).hexdigest() == self.code_hash
+            self.used_at is None
+            and timezone.now() < self.expires_at
+            and hmac.compare_digest(code_hash, self.code_hash)
         )
 
 class AccessHistory(models.Model):
@@ -65,6 +106,12 @@ class AccessHistory(models.Model):
     patient = models.ForeignKey(PatientProfile, on_delete=models.CASCADE)
     accessed_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # بررسی دسترسی پزشک به بیمار (doctor_id, patient_id) و فهرست بیماران پزشک در جست‌وجو
+            models.Index(fields=["doctor", "patient"], name="access_doctor_patient_idx"),
+        ]
+
     def __str__(self):
         return f"{self.doctor} accessed {self.patient} at {self.accessed_at}"
 
@@ -74,6 +121,17 @@ class ChatSession(models.Model):
     purpose = models.CharField(max_length=120, blank=True)
     started_at = models.DateTimeField(auto_now_add=True)
     ended_at = models.DateTimeField(null=True, blank=True)
+    # محل جلسه‌ی بایگانی‌شده در فایل‌های segment (medagent.archive)
+    archived_at = models.DateTimeField(null=True, blank=True)
+    archive_segment = models.CharField(max_length=40, blank=True)
+    archive_offset = models.BigIntegerField(null=True, blank=True)
+    archive_length = models.PositiveIntegerField(null=True, blank=True)
+    rehydrated_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["ended_at"], name="chatsession_ended_idx"),
+        ]
 
     def __str__(self):
         return f"Session {self.id} ({self.owner} → {self.patient})"
@@ -81,19 +139,109 @@ class ChatSession(models.Model):
 class ChatMessage(models.Model):
     session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name='messages')
     role = models.CharField(max_length=10, choices=[('owner', 'owner'), ('assistant', 'assistant')])
-    content = models.TextField()
+    content = CompressedTextField(dictionary="chat")
     created_at = models.DateTimeField(auto_now_add=True)
     history = HistoricalRecords()
 
+    class Meta:
+        indexes = [
+            # پشتیبان صفحه‌بندی keyset روی (session_id, created_at, id)
+            models.Index(fields=["session", "created_at", "id"], name="chatmsg_session_created_idx"),
+        ]
+
     def __str__(self):
         return f"[{self.role}] {self.content[:30]}..."
 
 class SessionSummary(models.Model):
     session = models.OneToOneField(ChatSession, on_delete=models.CASCADE)
-    text_summary = models.TextField()
-    json_summary = models.JSONField(default=dict)
+    text_summary = CompressedTextField()
+    json_summary = CompressedJSONField(default=dict)
     tokens_used = models.PositiveIntegerField()
     generated_at = models.DateTimeField(auto_now_add=True)
+    # هر ذخیره (ویرایش در admin، خلاصه‌سازی دوباره) آن را جلو می‌برد؛ مبنای ETag
+    updated_at = models.DateTimeField(auto_now=True)
+    # زمان ادغام در PatientSummary توسط medagent.aggregation
+    folded_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return f"Summary for session {self.session_id}"
+
+class SMSDelivery(models.Model):
+    """Delivery status of an SMS queued through medagent.sms.dispatch_sms."""
+    QUEUED, SENDING, SENT, FAILED = "queued", "sending", "sent", "failed"
+
+    receptor = models.CharField(max_length=15)
+    template = models.CharField(max_length=50, blank=True)
+    # متن تا پایان ارسال نگه داشته می‌شود تا پس از راه‌اندازی دوباره قابل ارسال باشد؛
+    # در هر وضعیت پایانی (sent یا failed) پاک می‌شود
+    text = models.TextField(blank=True)
+    status = models.CharField(
+        max_length=10, default=QUEUED,
+        choices=[(QUEUED, QUEUED), (SENDING, SENDING), (SENT, SENT), (FAILED, FAILED)],
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    provider_message_id = models.CharField(max_length=64, blank=True)
+    last_error = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"SMS to {self.receptor} ({self.status})"
+
+
+class IssuedRefreshToken(models.Model):
+    """A refresh token issued by medagent.authentication; consumed once on rotation."""
+    jti = models.CharField(max_length=64, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="refresh_tokens")
+    expires_at = models.DateTimeField()
+    # زمان مصرف در چرخش؛ ارائه‌ی دوباره‌ی ردیف مصرف‌شده نشانه‌ی سرقت توکن است
+    used_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["expires_at"], name="refresh_expires_idx"),
+        ]
+
+    @classmethod
+    def purge_expired(cls, batch_size: int = 1000) -> int:
+        """Delete expired rows in batches of ``batch_size``; return how many were removed."""
+        total = 0
+        now = timezone.now()
+        while True:
+            ids = list(cls.objects.filter(expires_at__lte=now).values_list("id", flat=True)[:batch_size])
+            if not ids:
+                return total
+            total += cls.objects.filter(id__in=ids).delete()[0]
+
+    def __str__(self):
+        return f"Refresh token {self.jti} of user {self.user_id}"
+
+
+class SearchDocument(models.Model):
+    """
+    Normalized, searchable copy of a chat message or session summary.
+
+    Kept up to date by medagent.search; the SQLite backend mirrors ``body``
+    and ``scope`` into an FTS5 index with triggers. The row is kept when its
+    session is archived, so archived transcripts stay searchable.
+    """
+    MESSAGE, SUMMARY = "message", "summary"
+
+    kind = models.CharField(max_length=10, choices=[(MESSAGE, MESSAGE), (SUMMARY, SUMMARY)])
+    object_id = models.BigIntegerField()
+    session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name="+")
+    patient = models.ForeignKey(PatientProfile, on_delete=models.CASCADE, related_name="+")
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    role = models.CharField(max_length=10, blank=True)
+    created_at = models.DateTimeField()
+    body = models.TextField()
+    # توکن‌های «p<بیمار> o<مالک>» تا فیلتر دسترسی داخل خود کوئری FTS اعمال شود
+    scope = models.CharField(max_length=40)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["kind", "object_id"], name="searchdoc_kind_object_uniq"),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id}"
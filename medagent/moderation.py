@@ -0,0 +1,125 @@
+"""
+Moderation of owner messages before they reach the agent.
+
+Serially, PostMessage waits for the profanity check and only then starts the
+agent, so every reply pays the moderation round trip. With
+``settings.PIPELINED_MODERATION`` the agent starts speculatively on the raw
+text while the check runs. Its tool calls wait for the verdict (see
+``medagent.tools.GatedTool``), so only the LLM prompt sees the raw text
+before it is cleared. If the text is clean, the speculative reply is used.
+If it is flagged, the agent runs on the sanitized placeholder, exactly as
+in the serial path, and the speculative run is stopped: cancelled (async),
+or refused at its next tool call and awaited before returning (sync), so
+abandoned runs cannot pile up in the worker pool. When every pool thread is
+busy, the sync path does not queue behind them but falls back to the serial
+check.
+"""
+
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from medagent.persistence import SANITIZED_PLACEHOLDER
+from medagent.tools import ModerationGate, ProfanityCheckTool, moderation_gate
+
+_executor = None
+_executor_slots = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> tuple[ThreadPoolExecutor, threading.BoundedSemaphore]:
+    """Process-wide pool for speculative agent runs and its free slots, recreated after fork."""
+    global _executor, _executor_slots, _executor_pid
+    with _executor_lock:
+        if _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.PIPELINED_MODERATION_WORKERS,
+                thread_name_prefix="speculative-agent",
+            )
+            _executor_slots = threading.BoundedSemaphore(settings.PIPELINED_MODERATION_WORKERS)
+            _executor_pid = os.getpid()
+        return _executor, _executor_slots
+
+
+def _run_in_worker(run_agent, content):
+    try:
+        return run_agent(content)
+    finally:
+        close_old_connections()
+
+
+def moderated_reply(content: str, run_agent) -> tuple[str, str]:
+    """
+    Moderate ``content`` and get the agent's reply to it.
+
+    Returns ``(stored_content, reply)`` where ``stored_content`` is the text to
+    persist (the placeholder when flagged).
+    """
+    if not settings.PIPELINED_MODERATION:
+        return _serial_reply(content, run_agent)
+    executor, slots = _get_executor()
+    # pool پر است؛ صف شدن پشت اجراهای دیگر از مسیر ترتیبی کندتر است
+    if not slots.acquire(blocking=False):
+        return _serial_reply(content, run_agent)
+
+    gate = ModerationGate()
+    # context (مثلاً اولویت llm_work) همراه با gate به نخ اجرای حدسی منتقل می‌شود
+    token = moderation_gate.set(gate)
+    context = contextvars.copy_context()
+    moderation_gate.reset(token)
+    try:
+        speculative = executor.submit(context.run, _run_in_worker, run_agent, content)
+    except BaseException:
+        slots.release()
+        raise
+    speculative.add_done_callback(lambda future: slots.release())
+    flagged = True
+    try:
+        flagged = ProfanityCheckTool()._run(content) == "True"
+    finally:
+        gate.decide(flagged)
+        if flagged:
+            speculative.cancel()
+    if flagged:
+        try:
+            return SANITIZED_PLACEHOLDER, run_agent(SANITIZED_PLACEHOLDER)
+        finally:
+            # نخ در حال اجرا قابل توقف نیست؛ تا پایانش صبر می‌شود تا جای pool را نگه ندارد
+            wait([speculative])
+    return content, speculative.result()
+
+
+def _serial_reply(content, run_agent):
+    if ProfanityCheckTool()._run(content) == "True":
+        content = SANITIZED_PLACEHOLDER
+    return content, run_agent(content)
+
+
+async def amoderated_reply(content: str, arun_agent) -> tuple[str, str]:
+    """Async counterpart of moderated_reply; a flagged speculative run is cancelled."""
+    if not settings.PIPELINED_MODERATION:
+        if await ProfanityCheckTool()._arun(content) == "True":
+            content = SANITIZED_PLACEHOLDER
+        return content, await arun_agent(content)
+
+    gate = ModerationGate(asynchronous=True)
+    token = moderation_gate.set(gate)
+    speculative = asyncio.ensure_future(arun_agent(content))
+    moderation_gate.reset(token)
+    try:
+        flagged = await ProfanityCheckTool()._arun(content) == "True"
+    except BaseException:
+        gate.decide(True)
+        speculative.cancel()
+        raise
+    gate.decide(flagged)
+    if flagged:
+        speculative.cancel()
+        return SANITIZED_PLACEHOLDER, await arun_agent(SANITIZED_PLACEHOLDER)
+    return content, await speculative
@@ -0,0 +1,128 @@
+"""
+Pluggable storage for one-time access codes.
+
+RequestOTP and VerifyOTP talk to a backend selected by ``settings.OTP_BACKEND``:
+
+* ``CacheOTPBackend`` keeps only the current code per patient in the cache
+  (Redis in production). Keys expire on their own and verification is a
+  single key lookup.
+* ``DatabaseOTPBackend`` keeps the ``OTPVerification`` rows and marks them
+  used on a successful verification. Expired rows are removed by the
+  ``purge_otps`` management command. It is the default unless ``REDIS_URL``
+  is set, because a per-process cache would let each worker accept a code
+  the others have already consumed.
+
+Both backends share cache-based send rate limits (per patient and per
+doctor) and a cap on verification attempts per doctor and patient, so one
+doctor's failed guesses do not lock the patient out for everyone. Counters
+rely on the cache's atomic ``add``/``incr``.
+"""
+
+import hashlib
+import hmac
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework.exceptions import Throttled
+
+from medagent.models import OTPVerification
+
+
+def hash_code(raw_code: str) -> str:
+    return hashlib.sha256(raw_code.encode()).hexdigest()
+
+
+def _hit(key: str, window: int) -> int:
+    """Increment the counter at ``key`` (created with a ``window`` seconds TTL)."""
+    cache.add(key, 0, window)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # کلید بین add و incr منقضی شد
+        cache.add(key, 1, window)
+        return 1
+
+
+class BaseOTPBackend:
+    """Rate limiting and attempt counting shared by every backend."""
+
+    key_prefix = "medagent:otp"
+
+    def issue(self, patient, raw_code: str, doctor_id=None) -> None:
+        """Store ``raw_code`` as the patient's current code or raise Throttled."""
+        self._check_send_rate(f"patient:{patient.pk}", settings.OTP_PATIENT_RATE)
+        if doctor_id is not None:
+            self._check_send_rate(f"doctor:{doctor_id}", settings.OTP_DOCTOR_RATE)
+        cache.delete(self._attempts_key(patient.pk, doctor_id))
+        self._store(patient, hash_code(raw_code), settings.OTP_TTL_MINUTES)
+
+    def verify(self, patient, raw_code: str, doctor_id=None) -> bool:
+        attempts_key = self._attempts_key(patient.pk, doctor_id)
+        if _hit(attempts_key, settings.OTP_TTL_MINUTES * 60) > settings.OTP_MAX_ATTEMPTS:
+            return False
+        if not self._check(patient, hash_code(raw_code)):
+            return False
+        cache.delete(attempts_key)
+        # از دو تأیید همزمان با یک کد فقط یکی موفق می‌شود
+        return self._consume(patient)
+
+    def _check_send_rate(self, scope: str, rate) -> None:
+        limit, window = rate
+        if _hit(f"{self.key_prefix}:rate:{scope}", window) > limit:
+            raise Throttled(wait=window, detail="تعداد درخواست کد بیش از حد مجاز است.")
+
+    def _attempts_key(self, patient_id, doctor_id=None) -> str:
+        return f"{self.key_prefix}:attempts:{doctor_id}:{patient_id}"
+
+    def _store(self, patient, code_hash: str, minutes: int) -> None:
+        raise NotImplementedError
+
+    def _check(self, patient, code_hash: str) -> bool:
+        raise NotImplementedError
+
+    def _consume(self, patient) -> bool:
+        """Invalidate the patient's code; return False if another request already did."""
+        raise NotImplementedError
+
+
+class CacheOTPBackend(BaseOTPBackend):
+    """One cache key per patient holding the current code hash; TTL is the expiry."""
+
+    def _code_key(self, patient_id) -> str:
+        return f"{self.key_prefix}:code:{patient_id}"
+
+    def _store(self, patient, code_hash, minutes):
+        cache.set(self._code_key(patient.pk), code_hash, minutes * 60)
+
+    def _check(self, patient, code_hash):
+        stored = cache.get(self._code_key(patient.pk))
+        return stored is not None and hmac.compare_digest(stored, code_hash)
+
+    def _consume(self, patient):
+        # کد یک‌بار مصرف است
+        return bool(cache.delete(self._code_key(patient.pk)))
+
+
+class DatabaseOTPBackend(BaseOTPBackend):
+    """Keeps codes as OTPVerification rows; only the newest row per patient counts."""
+
+    def _store(self, patient, code_hash, minutes):
+        OTPVerification.objects.create(
+            patient=patient,
+            code_hash=code_hash,
+            expires_at=OTPVerification.expiry(minutes),
+        )
+
+    def _check(self, patient, code_hash):
+        otp = OTPVerification.objects.filter(patient=patient).order_by("-created_at").first()
+        return otp is not None and otp.valid_hash(code_hash)
+
+    def _consume(self, patient):
+        # به‌روزرسانی شرطی: فقط درخواستی که ردیف را مصرف کرد موفق است
+        return OTPVerification.objects.filter(patient=patient, used_at__isnull=True).update(used_at=timezone.now()) > 0
+
+
+def get_otp_backend() -> BaseOTPBackend:
+    return import_string(settings.OTP_BACKEND)()
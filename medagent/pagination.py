@@ -0,0 +1,66 @@
+"""
+Keyset (cursor) pagination for chat transcripts.
+
+Pages are addressed by the (created_at, id) of the last message a client has
+seen instead of an OFFSET, so each page is an index range scan on
+(session_id, created_at, id) and costs the same however deep into the
+transcript it is. The same cursor doubles as a "since" marker for polling
+new messages.
+"""
+
+import base64
+import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(created_at: datetime.datetime, pk: int) -> str:
+    raw = f"{created_at.isoformat()}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime.datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, pk = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.datetime.fromisoformat(created_at), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        raise ValidationError({"cursor": "cursor نامعتبر است."})
+
+
+def parse_page_size(value) -> int:
+    if value in (None, ""):
+        return DEFAULT_PAGE_SIZE
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        raise ValidationError({"limit": "limit باید عدد صحیح باشد."})
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def keyset_page(queryset, cursor: str | None, limit: int):
+    """
+    Return ``(items, next_cursor, has_more)`` for rows after ``cursor``.
+
+    ``queryset`` must be filtered to a single session. Rows are ordered by
+    (created_at, id); ``next_cursor`` points at the last returned row, or
+    echoes the given cursor when nothing new exists so clients can keep
+    polling with it.
+    """
+    qs = queryset.order_by("created_at", "id")
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        # شرط created_at__gte اجازه‌ی range scan روی ایندکس را می‌دهد
+        qs = qs.filter(created_at__gte=created_at).filter(
+            Q(created_at__gt=created_at) | Q(id__gt=pk)
+        )
+    items = list(qs[: limit + 1])
+    has_more = len(items) > limit
+    items = items[:limit]
+    if items:
+        cursor = encode_cursor(items[-1].created_at, items[-1].id)
+    return items, cursor, has_more
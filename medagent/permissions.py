@@ -3,19 +3,50 @@ Custom permission classes for MedAgent.
 
 HasActiveSubscription ensures that the requesting user has an active
 subscription in the sub app. If no subscription exists, or it is inactive,
-access is denied.
+access is denied. Users authenticated from JWT claims are checked against the
+token's subscription expiry instead of the database.
+
+CanReadMetrics lets staff users, or a scraper that sends
+``X-Metrics-Token: <settings.METRICS_TOKEN>``, read /metrics.
 """
 
+import hmac
+import time
+
+from django.conf import settings
+
 from rest_framework.permissions import BasePermission
 from sub.models import Subscription
 
+from medagent.authentication import ClaimsUser
+
+
+def claims_subscription_active(user):
+    """Subscription state from token claims, or None for database-backed users."""
+    if not isinstance(user, ClaimsUser):
+        return None
+    expires = user.subscription_expires
+    return expires is not None and time.time() <= expires
+
+
 class HasActiveSubscription(BasePermission):
     """Allow access only to users with an active subscription."""
 
     message = "You must have an active subscription."
 
     def has_permission(self, request, view):
+        active = claims_subscription_active(request.user)
+        if active is not None:
+            return active
         try:
             return request.user.subscription.is_active
         except Subscription.DoesNotExist:
             return False
+
+
+class CanReadMetrics(BasePermission):
+    def has_permission(self, request, view):
+        token = settings.METRICS_TOKEN
+        if token and hmac.compare_digest(request.headers.get("X-Metrics-Token", "").encode(), token.encode()):
+            return True
+        return bool(request.user and request.user.is_staff)
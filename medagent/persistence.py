@@ -0,0 +1,51 @@
+"""
+Message persistence for chat exchanges.
+
+A single PostMessage call stores the owner's message and the assistant's
+reply. Saving them one by one costs an INSERT plus a historical INSERT per
+message, each in its own autocommit transaction, and re-runs the profanity
+signal on content that the view has already checked. This module writes the
+whole exchange with one bulk INSERT for the messages and one for their
+history rows inside a single atomic block, together with their search
+documents (medagent.search).
+
+If the agent fails there is no reply to store. ``save_owner_message`` then
+keeps the owner's message on its own, as PostMessage did before it batched
+the writes.
+"""
+
+from django.db import transaction
+from simple_history.utils import bulk_create_with_history
+
+from medagent.models import ChatMessage
+from medagent.search import index_messages
+
+SANITIZED_PLACEHOLDER = "[پیام حاوی کلمات نامناسب بود]"
+
+
+def save_exchange(session, owner_content: str, assistant_content: str) -> list[ChatMessage]:
+    """
+    Persist an owner message and the assistant reply for ``session``.
+
+    ``owner_content`` must already be moderated: bulk_create does not send
+    post_save, so the sanitizing signal is skipped for these rows.
+    Returns the saved [owner, assistant] messages with primary keys set.
+    """
+    messages = [
+        ChatMessage(session=session, role="owner", content=owner_content),
+        ChatMessage(session=session, role="assistant", content=assistant_content),
+    ]
+    with transaction.atomic():
+        saved = bulk_create_with_history(messages, ChatMessage)
+        index_messages(saved)
+        return saved
+
+
+def save_owner_message(session, content: str) -> ChatMessage:
+    """
+    Persist only the owner's message, for an exchange whose agent run failed.
+
+    ``content`` may not have been moderated yet, so the row is saved normally
+    and the post_save signal sanitizes it.
+    """
+    return ChatMessage.objects.create(session=session, role="owner", content=content)
@@ -0,0 +1,290 @@
+"""
+Per-request performance profiling and Prometheus metrics.
+
+``ProfilingMiddleware`` measures every request and folds it into
+process-wide histograms, labelled by URL route (``request.resolver_match.route``)
+and method:
+
+* total time, up to the view's response (streamed bodies are not included);
+* number and time of database queries, from an execute wrapper that every
+  connection gets when it is created;
+* time in outbound TalkBot and Kavenegar calls, which ``talkbot_client`` and
+  ``sms`` wrap in ``outbound(service)``;
+* response rendering (DRF serialization to JSON), from
+  ``process_template_response`` to the post-render callback.
+
+A request costs a few counter updates under one lock, so the middleware can
+stay on in production. ``render_metrics()`` serves the histograms, the LLM
+scheduler and the model router in the Prometheus text format on
+``/metrics``. Each worker process reports its own numbers.
+
+Deep profiling is opt-in. A request is run under cProfile when it carries
+``X-Profile: <PROFILING_TOKEN>`` or is picked at ``PROFILING_SAMPLE_RATE``. The
+pstats dump goes to ``PROFILING_DIR`` (``python -m pstats`` or snakeviz
+read it). Only one request per process is profiled at a time.
+"""
+
+import bisect
+import contextvars
+import cProfile
+import hmac
+import random
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.utils import timezone
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+
+class _RequestProfile:
+    __slots__ = ("queries", "db_time", "outbound", "render_started", "render_time")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.outbound = {}
+        self.render_started = None
+        self.render_time = 0.0
+
+
+_current = contextvars.ContextVar("request_profile", default=None)
+
+
+def _record_query(execute, sql, params, many, context):
+    profile = _current.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.queries += 1
+        profile.db_time += time.perf_counter() - started
+
+
+@receiver(connection_created)
+def _attach_query_recorder(sender, connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+@contextmanager
+def outbound(service: str):
+    """Charge the time spent in the block to ``service`` for the current request."""
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.outbound[service] = profile.outbound.get(service, 0.0) + time.perf_counter() - started
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """Process-wide request histograms keyed by (metric, labels)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._requests = {}
+
+    def _histogram(self, name, labels, buckets):
+        key = (name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = _Histogram(buckets)
+        return histogram
+
+    def observe(self, route, method, status, duration, profile):
+        labels = (("route", route), ("method", method))
+        with self._lock:
+            key = (*labels, ("status", str(status)))
+            self._requests[key] = self._requests.get(key, 0) + 1
+            self._histogram("request_seconds", labels, SECONDS_BUCKETS).observe(duration)
+            self._histogram("db_queries", labels, QUERY_BUCKETS).observe(profile.queries)
+            self._histogram("db_seconds", labels, SECONDS_BUCKETS).observe(profile.db_time)
+            if profile.render_time:
+                self._histogram("render_seconds", labels, SECONDS_BUCKETS).observe(profile.render_time)
+            for service, seconds in profile.outbound.items():
+                self._histogram("outbound_seconds", (*labels, ("service", service)), SECONDS_BUCKETS).observe(seconds)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._requests.clear()
+
+    def snapshot(self):
+        with self._lock:
+            histograms = {
+                key: (h.buckets, list(h.counts), h.sum, h.count) for key, h in self._histograms.items()
+            }
+            return histograms, dict(self._requests)
+
+
+metrics = Metrics()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(pairs) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_metrics() -> str:
+    """All metrics of this process in the Prometheus text exposition format."""
+    from medagent.llm_scheduler import scheduler
+    from medagent.model_router import router
+
+    histograms, requests = metrics.snapshot()
+    lines = ["# TYPE medagent_requests_total counter"]
+    lines += [f"medagent_requests_total{_labels(key)} {count}" for key, count in sorted(requests.items())]
+    for name in ("request_seconds", "db_queries", "db_seconds", "render_seconds", "outbound_seconds"):
+        lines.append(f"# TYPE medagent_{name} histogram")
+        for (metric, labels), (buckets, counts, total, count) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, bucket_count in zip((*buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                lines.append(f"medagent_{name}_bucket{_labels((*labels, ('le', bound)))} {cumulative}")
+            lines.append(f"medagent_{name}_sum{_labels(labels)} {_format(total)}")
+            lines.append(f"medagent_{name}_count{_labels(labels)} {count}")
+
+    llm = scheduler.metrics()
+    lines += ["# TYPE medagent_llm_active gauge", f"medagent_llm_active {llm['active']}",
+              "# TYPE medagent_llm_concurrency gauge", f"medagent_llm_concurrency {llm['concurrency']}",
+              "# TYPE medagent_llm_service_seconds gauge", f"medagent_llm_service_seconds {_format(llm['service_time'])}"]
+    for field, kind in (("queued", "gauge"), ("admitted", "counter"), ("shed", "counter"),
+                        ("wait_p50", "gauge"), ("wait_p95", "gauge"), ("wait_max", "gauge")):
+        suffix = "_total" if kind == "counter" else "_seconds" if field.startswith("wait") else ""
+        lines.append(f"# TYPE medagent_llm_{field}{suffix} {kind}")
+        lines += [f"medagent_llm_{field}{suffix}{_labels([('class', name)])} {_format(stats[field])}"
+                  for name, stats in llm["classes"].items()]
+    models = router.metrics()["models"]
+    for field, metric in (("healthy", "model_healthy"), ("error_rate", "model_error_rate"),
+                          ("latency_p95", "model_latency_p95_seconds")):
+        lines.append(f"# TYPE medagent_llm_{metric} gauge")
+        lines += [f"medagent_llm_{metric}{_labels([('model', name)])} {_format(float(health[field] or 0))}"
+                  for name, health in models.items()]
+    return "\n".join(lines) + "\n"
+
+
+_profiling = threading.Lock()
+
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        # اتصال‌هایی که پیش از بارگذاری این ماژول ساخته شده‌اند؛ بقیه از connection_created می‌آیند
+        for connection in connections.all(initialized_only=True):
+            _attach_query_recorder(None, connection)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        profile, started = _RequestProfile(), time.perf_counter()
+        token = _current.set(profile)
+        profiler = self._profiler(request)
+        try:
+            if profiler is None:
+                response = self.get_response(request)
+            else:
+                try:
+                    response = profiler.runcall(self.get_response, request)
+                finally:
+                    self._dump(profiler, request)
+        finally:
+            _current.reset(token)
+        self._observe(request, response, time.perf_counter() - started, profile)
+        return response
+
+    async def __acall__(self, request):
+        # cProfile فقط نخ event loop را می‌بیند، پس پروفایل عمیق در حالت async اجرا نمی‌شود
+        profile, started = _RequestProfile(), time.perf_counter()
+        token = _current.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self._observe(request, response, time.perf_counter() - started, profile)
+        return response
+
+    def process_template_response(self, request, response):
+        profile = _current.get()
+        if profile is not None:
+            profile.render_started = time.perf_counter()
+            response.add_post_render_callback(lambda rendered: self._rendered(profile))
+        return response
+
+    @staticmethod
+    def _rendered(profile):
+        profile.render_time = time.perf_counter() - profile.render_started
+
+    @staticmethod
+    def _observe(request, response, duration, profile):
+        match = request.resolver_match
+        # فقط الگوی مسیر (نه URL واقعی) تا تعداد سری‌ها محدود بماند
+        route = match.route if match is not None else "<unmatched>"
+        metrics.observe(route, request.method, response.status_code, duration, profile)
+
+    @staticmethod
+    def _profiler(request):
+        token = settings.PROFILING_TOKEN
+        requested = bool(token) and hmac.compare_digest(request.headers.get("X-Profile", "").encode(), token.encode())
+        if not requested and random.random() >= settings.PROFILING_SAMPLE_RATE:
+            return None
+        if not _profiling.acquire(blocking=False):
+            return None
+        return cProfile.Profile()
+
+    @staticmethod
+    def _dump(profiler, request):
+        try:
+            directory = Path(settings.PROFILING_DIR)
+            directory.mkdir(parents=True, exist_ok=True)
+            match = request.resolver_match
+            name = (match.url_name or match.route) if match else "unmatched"
+            slug = "".join(c if c.isalnum() else "_" for c in name).strip("_")[:60]
+            profiler.dump_stats(directory / f"{timezone.now():%Y%m%dT%H%M%S%f}-{request.method}-{slug}.prof")
+        finally:
+            _profiling.release()
@@ -2,14 +2,21 @@
 URL patterns for the MedAgent app.
 
 Routes API endpoints to their corresponding views. These endpoints include
-OTP request and verification, chat session creation, messaging, ending
-sessions, and retrieving summaries.
+JWT issue/refresh/revocation, OTP request and verification, chat session
+creation, messaging, ending sessions, retrieving summaries and
+transcripts, full-text search, streaming transcript exports, bulk
+patient onboarding and the Prometheus /metrics endpoint. Async variants of
+the write endpoints are served under api/async/.
 """
 
 from django.urls import path
-from . import views
+from . import async_views, views
 
 urlpatterns = [
+    path("api/auth/token/", views.ObtainToken.as_view()),
+    path("api/auth/token/refresh/", views.RefreshTokenPair.as_view()),
+    path("api/auth/token/revoke/", views.RevokeToken.as_view()),
+
     path("api/otp/request/", views.RequestOTP.as_view()),
     path("api/otp/verify/", views.VerifyOTP.as_view()),
 
@@ -19,4 +26,16 @@ urlpatterns = [
 
     path("api/patient/<int:patient_id>/summary/", views.GetPatientSummary.as_view()),
     path("api/session/<int:session_id>/summary/", views.GetSessionSummary.as_view()),
+    path("api/session/<int:session_id>/messages/", views.SessionMessages.as_view()),
+    path("api/search/", views.SearchTranscripts.as_view()),
+    path("api/patient/<int:patient_id>/export/", views.ExportTranscripts.as_view()),
+    path("api/patient/onboard/", views.OnboardPatients.as_view()),
+    path("metrics", views.Metrics.as_view()),
+
+    # نسخه‌های ASGI (برای اجرا با uvicorn)
+    path("api/async/otp/request/", async_views.AsyncRequestOTP.as_view()),
+    path("api/async/otp/verify/", async_views.AsyncVerifyOTP.as_view()),
+    path("api/async/session/<int:session_id>/message/", async_views.AsyncPostMessage.as_view()),
+    path("api/async/session/end/", async_views.AsyncEndSession.as_view()),
+    path("api/session/<int:session_id>/events/", async_views.SessionEvents.as_view()),
 ]
@@ -0,0 +1,236 @@
+"""
+Full-text search over chat messages and session summaries.
+
+Message and summary text is stored compressed (medagent.fields), so the
+database cannot search it. Each message and summary instead gets a
+``SearchDocument`` row holding its text after ``normalize``:
+
+* Arabic yeh/kaf/teh marbuta/alef variants become their Persian forms;
+* diacritics (harakat, superscript alef) and tatweel are dropped;
+* ZWNJ becomes a space, so «می‌خواهم» and «می خواهم» match;
+* Persian/Arabic digits become ASCII and the text is case-folded.
+
+Queries go through the same function. Documents are written in the same
+transaction as their message (``save_exchange`` and the post_save / post_delete
+handlers), and ``rebuild_index`` backfills existing rows.
+
+``settings.SEARCH_BACKEND`` picks the backend:
+
+* ``FTS5SearchBackend`` mirrors SearchDocument into an SQLite FTS5 index
+  with triggers and ranks by bm25. The access check is part of the MATCH
+  expression (``scope`` holds ``p<patient> o<owner>`` tokens), so the index
+  intersects posting lists instead of filtering every hit in SQL; users with
+  more than ``SEARCH_MAX_SCOPE_TOKENS`` readable patients fall back to a
+  SQL filter. On other databases it behaves like the database backend.
+* ``DatabaseSearchBackend`` scans SearchDocument with LIKE and orders by
+  recency. It is a fallback, not meant for large tables.
+
+Results only include sessions the user owns or whose patient they have had
+OTP access to, the same rule as ``can_read_session``.
+
+Storage: ``body`` is an uncompressed copy of text the source columns keep
+zstd-compressed. FTS5 is an external-content index over it (it stores no
+second copy), but snippets, the LIKE backend, index rebuilds and archived
+sessions, whose messages leave the database, all read ``body``.
+``bench_search`` reports the cost. With 200k synthetic messages it measured
+190 B/doc for ``body`` and 77 B/doc for the FTS5 index, against 143 B/doc
+for the same text compressed. Real messages compress better, so expect the
+search tables to take roughly twice the space of the messages they cover.
+"""
+
+import re
+
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from medagent.models import AccessHistory, ChatMessage, SearchDocument, SessionSummary
+
+_TRANSLATE = str.maketrans({
+    "\u064a": "\u06cc", "\u0649": "\u06cc", "\u0643": "\u06a9", "\u0629": "\u0647", "\u06c0": "\u0647",
+    "\u0623": "\u0627", "\u0625": "\u0627", "\u0671": "\u0627", "\u0622": "\u0627",
+    "\u200c": " ", "\u200d": "", "\u0640": "",
+    **{chr(0x06F0 + d): str(d) for d in range(10)},
+    **{chr(0x0660 + d): str(d) for d in range(10)},
+})
+# اعراب، الف کوچک و علامت‌های قرآنی
+_DIACRITICS = re.compile("[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed]")
+_TERM = re.compile(r"\w+")
+
+SNIPPET_CHARS = 160
+
+
+def normalize(text: str) -> str:
+    return _DIACRITICS.sub("", (text or "").translate(_TRANSLATE)).casefold()
+
+
+def terms(query: str) -> list[str]:
+    return _TERM.findall(normalize(query))
+
+
+def _scope(session) -> str:
+    return f"p{session.patient_id} o{session.owner_id}"
+
+
+def _document(kind, pk, session, text, created_at, role=""):
+    return SearchDocument(
+        kind=kind, object_id=pk, session_id=session.id, patient_id=session.patient_id,
+        owner_id=session.owner_id, role=role, created_at=created_at, body=normalize(text), scope=_scope(session),
+    )
+
+
+def _upsert(documents):
+    if documents:
+        SearchDocument.objects.bulk_create(
+            documents, update_conflicts=True,
+            unique_fields=["kind", "object_id"], update_fields=["body", "role"],
+        )
+
+
+def index_messages(messages):
+    """Create or refresh the documents of saved ChatMessages."""
+    _upsert([
+        _document(SearchDocument.MESSAGE, m.pk, m.session, m.content, m.created_at, m.role) for m in messages
+    ])
+
+
+def index_summaries(summaries):
+    _upsert([
+        _document(SearchDocument.SUMMARY, s.pk, s.session, s.text_summary, s.generated_at) for s in summaries
+    ])
+
+
+def unindex(kind, object_id):
+    SearchDocument.objects.filter(kind=kind, object_id=object_id).delete()
+
+
+def rebuild_index(batch_size=2000) -> int:
+    """Index every hot message and summary; archived sessions keep their existing documents."""
+    indexed = 0
+    for queryset, index in (
+        (ChatMessage.objects.select_related("session"), index_messages),
+        (SessionSummary.objects.select_related("session"), index_summaries),
+    ):
+        batch = []
+        for row in queryset.order_by("pk").iterator(chunk_size=batch_size):
+            batch.append(row)
+            if len(batch) == batch_size:
+                index(batch)
+                indexed += len(batch)
+                batch = []
+        index(batch)
+        indexed += len(batch)
+    get_search_backend().optimize()
+    return indexed
+
+
+def _readable(queryset, user_id):
+    doctor_patients = AccessHistory.objects.filter(doctor_id=user_id).values("patient_id")
+    return queryset.filter(Q(owner_id=user_id) | Q(patient_id__in=doctor_patients))
+
+
+def _snippet(body, query_terms):
+    position = min((body.find(term) for term in query_terms if term in body), default=0)
+    start = max(0, position - SNIPPET_CHARS // 4)
+    text = body[start:start + SNIPPET_CHARS]
+    return ("…" if start else "") + text + ("…" if start + SNIPPET_CHARS < len(body) else "")
+
+
+def _result(document, snippet):
+    return {
+        "kind": document.kind, "object_id": document.object_id, "session_id": document.session_id,
+        "patient_id": document.patient_id, "role": document.role, "created_at": document.created_at,
+        "snippet": snippet,
+    }
+
+
+class DatabaseSearchBackend:
+    def install(self, using):
+        pass
+
+    def optimize(self):
+        pass
+
+    def search(self, user_id, query_terms, limit, offset=0) -> list[dict]:
+        queryset = _readable(SearchDocument.objects.all(), user_id)
+        for term in query_terms:
+            queryset = queryset.filter(body__contains=term)
+        documents = queryset.order_by("-created_at", "-id")[offset:offset + limit]
+        return [_result(document, _snippet(document.body, query_terms)) for document in documents]
+
+
+class FTS5SearchBackend(DatabaseSearchBackend):
+    table = "medagent_search_fts"
+
+    def _sql(self):
+        content = SearchDocument._meta.db_table
+        return [
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5("
+            f"body, scope, content='{content}', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+            f"CREATE TRIGGER IF NOT EXISTS {self.table}_ai AFTER INSERT ON {content} BEGIN "
+            f"INSERT INTO {self.table}(rowid, body, scope) VALUES (new.id, new.body, new.scope); END",
+            f"CREATE TRIGGER IF NOT EXISTS {self.table}_ad AFTER DELETE ON {content} BEGIN "
+            f"INSERT INTO {self.table}({self.table}, rowid, body, scope) VALUES ('delete', old.id, old.body, old.scope); END",
+            f"CREATE TRIGGER IF NOT EXISTS {self.table}_au AFTER UPDATE ON {content} BEGIN "
+            f"INSERT INTO {self.table}({self.table}, rowid, body, scope) VALUES ('delete', old.id, old.body, old.scope); "
+            f"INSERT INTO {self.table}(rowid, body, scope) VALUES (new.id, new.body, new.scope); END",
+        ]
+
+    def install(self, using):
+        connection = connections[using]
+        if connection.vendor != "sqlite":
+            return
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s", [self.table])
+            exists = cursor.fetchone()
+            for statement in self._sql():
+                cursor.execute(statement)
+            if not exists:
+                # جدول تازه روی اسناد موجود ساخته می‌شود
+                cursor.execute(f"INSERT INTO {self.table}({self.table}) VALUES ('rebuild')")
+
+    def optimize(self):
+        connection = connections[router.db_for_write(SearchDocument)]
+        if connection.vendor == "sqlite":
+            with connection.cursor() as cursor:
+                cursor.execute(f"INSERT INTO {self.table}({self.table}) VALUES ('optimize')")
+
+    def search(self, user_id, query_terms, limit, offset=0) -> list[dict]:
+        using = router.db_for_read(SearchDocument)
+        if connections[using].vendor != "sqlite":
+            return super().search(user_id, query_terms, limit, offset)
+        patients = list(
+            AccessHistory.objects.using(using).filter(doctor_id=user_id)
+            .values_list("patient_id", flat=True).distinct()[:settings.SEARCH_MAX_SCOPE_TOKENS + 1]
+        )
+        # هر عبارت جداگانه در گیومه قرار می‌گیرد تا نحو FTS5 از ورودی کاربر تزریق نشود
+        match = "body : (" + " ".join(f'"{term}"' for term in query_terms) + ")"
+        params, acl = [], ""
+        if len(patients) <= settings.SEARCH_MAX_SCOPE_TOKENS:
+            match += " AND scope : (" + " OR ".join([f"o{user_id}", *(f"p{p}" for p in patients)]) + ")"
+        else:
+            acl = f"AND (d.owner_id = %s OR d.patient_id IN (SELECT patient_id FROM {AccessHistory._meta.db_table} WHERE doctor_id = %s))"
+            params = [user_id, user_id]
+        sql = (
+            f"SELECT d.id, snippet({self.table}, 0, '', '', '…', 24) FROM {self.table} "
+            f"JOIN {SearchDocument._meta.db_table} d ON d.id = {self.table}.rowid "
+            f"WHERE {self.table} MATCH %s {acl} "
+            f"ORDER BY bm25({self.table}, 1.0, 0.0), d.id LIMIT %s OFFSET %s"
+        )
+        with connections[using].cursor() as cursor:
+            cursor.execute(sql, [match, *params, limit, offset])
+            rows = cursor.fetchall()
+        documents = SearchDocument.objects.using(using).in_bulk([row[0] for row in rows])
+        return [_result(documents[pk], snippet) for pk, snippet in rows if pk in documents]
+
+
+def get_search_backend():
+    return import_string(settings.SEARCH_BACKEND)()
+
+
+def search(user_id, query, limit, offset=0) -> list[dict]:
+    query_terms = terms(query)
+    if not query_terms:
+        return []
+    return get_search_backend().search(user_id, query_terms, limit, offset)
@@ -35,9 +35,23 @@ class ChatMessageSerializer(serializers.ModelSerializer):
         fields = ["id", "session", "role", "content", "created_at"]
         read_only_fields = ["role", "created_at"]
 
+class MessageContentSerializer(serializers.Serializer):
+    """Content-only message payload; validates without touching the database."""
+    content = serializers.CharField()
+
 class EndSessionSerializer(serializers.Serializer):
     session_id = serializers.IntegerField()
 
+class TokenObtainSerializer(serializers.Serializer):
+    username = serializers.CharField()
+    password = serializers.CharField(write_only=True)
+
+class TokenRefreshSerializer(serializers.Serializer):
+    refresh = serializers.CharField()
+
+class TokenRevokeSerializer(serializers.Serializer):
+    refresh = serializers.CharField(required=False)
+
 class PatientSummarySerializer(serializers.ModelSerializer):
     class Meta:
         model = PatientSummary
@@ -3,17 +3,69 @@ Signal handlers for the MedAgent app.
 
 These handlers sanitize messages upon saving if they originate from the owner
 and contain profanity. This centralizes profanity filtering so that even
-programmatic saves are checked.
+programmatic saves are checked. They also drop cached summary payloads when
+the underlying summary changes and announce new session summaries on the
+session's event channel, queue each new session summary to be folded
+into the patient's running summary, and keep the search documents of
+messages and summaries current (creating the search index after migrate).
 """
 
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_migrate, post_save
 from django.dispatch import receiver
-from medagent.models import ChatMessage
+from medagent.aggregation import fold_session_summary, summary_queue
+from medagent.events import publish_session_event
+from medagent.models import ChatMessage, PatientSummary, SearchDocument, SessionSummary
+from medagent.persistence import SANITIZED_PLACEHOLDER
+from medagent.search import get_search_backend, index_messages, index_summaries, unindex
+from medagent.summary_cache import invalidate_summary
 from medagent.tools import ProfanityCheckTool
 
 @receiver(post_save, sender=ChatMessage)
 def sanitize_on_save(sender, instance, created, **kwargs):
     if created and instance.role == "owner":
+        # پیامی که قبلاً پاک‌سازی شده نیازی به بررسی دوباره ندارد
+        if instance.content == SANITIZED_PLACEHOLDER:
+            return
         if ProfanityCheckTool()._run(instance.content) == "True":
-            instance.content = "[پیام حاوی کلمات نامناسب بود]"
+            instance.content = SANITIZED_PLACEHOLDER
             instance.save(update_fields=["content"])
+
+
+@receiver([post_save, post_delete], sender=PatientSummary)
+def invalidate_patient_summary(sender, instance, **kwargs):
+    invalidate_summary("patient", instance.patient_id)
+
+@receiver([post_save, post_delete], sender=SessionSummary)
+def invalidate_session_summary(sender, instance, **kwargs):
+    invalidate_summary("session", instance.session_id)
+
+@receiver(post_save, sender=SessionSummary)
+def announce_session_summary(sender, instance, created, **kwargs):
+    if created:
+        publish_session_event(instance.session_id, "summary_ready")
+
+@receiver(post_save, sender=SessionSummary)
+def fold_into_patient_summary(sender, instance, created, **kwargs):
+    if created:
+        summary_queue.submit(fold_session_summary, instance.id)
+
+@receiver(post_save, sender=ChatMessage)
+def index_message(sender, instance, **kwargs):
+    index_messages([instance])
+
+@receiver(post_save, sender=SessionSummary)
+def index_session_summary(sender, instance, **kwargs):
+    index_summaries([instance])
+
+@receiver(post_delete, sender=ChatMessage)
+def unindex_message(sender, instance, **kwargs):
+    unindex(SearchDocument.MESSAGE, instance.pk)
+
+@receiver(post_delete, sender=SessionSummary)
+def unindex_session_summary(sender, instance, **kwargs):
+    unindex(SearchDocument.SUMMARY, instance.pk)
+
+@receiver(post_migrate)
+def install_search_index(sender, using, **kwargs):
+    if sender.name == "medagent":
+        get_search_backend().install(using)
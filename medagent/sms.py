@@ -1,38 +1,233 @@
 """
-Lightweight wrapper around the Kavenegar API for sending SMS messages.
+SMS delivery through Kavenegar.
+
+Views call ``dispatch_sms``, which records an ``SMSDelivery`` row and hands
+the send to a background queue, so an OTP request no longer waits on
+Kavenegar's HTTP round trip. The worker retries transport failures
+(``HTTPException``) with exponential backoff and stores the final status;
+any other error fails the row instead of leaving it queued. Batch jobs use
+``dispatch_sms_bulk`` to record a whole chunk of messages with one INSERT.
+
+The message text stays on the row only until delivery finishes (sent or
+failed), so rows left ``queued`` by a restart can be re-sent with
+``requeue_stale_deliveries`` (the ``requeue_sms`` management command). A
+worker claims a row by moving it from ``queued`` to ``sending`` before
+calling the provider, so a re-queued row is never sent twice.
+
+The provider is chosen by ``settings.SMS_PROVIDER`` and created once per
+process: ``KavenegarProvider`` keeps one API client with a pooled HTTP
+session, and ``FakeSMSProvider`` records messages in memory for tests and
+benchmarks.
 
 In production, the KAVEHNEGAR_API_KEY should be stored in the environment.
-For tests this module can be patched so that no network call is made.
 """
+import datetime
+import json
 import os
-from kavenegar import APIException, HTTPException, KavenegarAPI
+import threading
+import time
 import logging
 
+import requests
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from kavenegar import APIException, HTTPException, KavenegarAPI
+
+from medagent.background import BackgroundQueue
+from medagent.profiling import outbound
+
 logger = logging.getLogger(__name__)
 
 KAVEHNEGAR_API_KEY = os.getenv("KAVEHNEGAR_API_KEY")  # Should be stored in .env
 
+sms_queue = BackgroundQueue("sms", workers=2)
+
+
+class _PooledKavenegarAPI(KavenegarAPI):
+    """KavenegarAPI that reuses keep-alive connections instead of a new one per call."""
+
+    def __init__(self, apikey):
+        super().__init__(apikey)
+        self.session = requests.Session()
+
+    def _request(self, action, method, params={}):
+        url = f"https://{self.host}/{self.version}/{self.apikey}/{action}/{method}.json"
+        try:
+            content = self.session.post(url, headers=self.headers, data=params, timeout=10).content
+        except requests.exceptions.RequestException as e:
+            raise HTTPException(e)
+        try:
+            response = json.loads(content.decode("utf-8"))
+        except ValueError as e:
+            raise HTTPException(e)
+        if response["return"]["status"] != 200:
+            raise APIException(f"APIException[{response['return']['status']}] {response['return']['message']}")
+        return response["entries"]
+
+
+class KavenegarProvider:
+    def __init__(self):
+        if not KAVEHNEGAR_API_KEY:
+            raise Exception("KAVEHNEGAR_API_KEY is not set.")
+        self.api = _PooledKavenegarAPI(KAVEHNEGAR_API_KEY)
+
+    def send(self, phone, text, template="otp_doctor"):
+        """Send one message; returns the provider's message id if it reports one."""
+        with outbound("kavenegar"):
+            entries = self.api.verify_lookup({
+                'receptor': phone,
+                'message': text,
+                'template': template,
+            })
+        if isinstance(entries, list) and entries:
+            return str(entries[0].get("messageid", ""))
+        return ""
+
+
+class FakeSMSProvider:
+    """
+    In-memory provider. ``latency`` simulates the network round trip and
+    ``fail_times`` makes the next N sends raise HTTPException.
+    """
+
+    def __init__(self, latency=None):
+        self.latency = getattr(settings, "SMS_FAKE_LATENCY", 0) if latency is None else latency
+        self.fail_times = 0
+        self.outbox = []
+        self._lock = threading.Lock()
+
+    def send(self, phone, text, template="otp_doctor"):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            if self.fail_times:
+                self.fail_times -= 1
+                raise HTTPException("fake transport failure")
+            self.outbox.append({"phone": phone, "text": text, "template": template})
+            return str(len(self.outbox))
+
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def get_provider():
+    """Return the process-wide instance of ``settings.SMS_PROVIDER``."""
+    path = settings.SMS_PROVIDER
+    with _providers_lock:
+        if path not in _providers:
+            _providers[path] = import_string(path)()
+        return _providers[path]
+
 
 def send_sms(phone, text, sender=None):
     """
-    Send an SMS via the Kavenegar API.
+    Send an SMS synchronously through the configured provider.
 
     :param phone: str, recipient phone number (e.g., 09121234567)
     :param text: str, message content
     :param sender: str, optional sender line
     :return: bool, True on success, False otherwise
     """
-    if not KAVEHNEGAR_API_KEY:
-        raise Exception("KAVEHNEGAR_API_KEY is not set.")
     try:
-          api = KavenegarAPI(KAVEHNEGAR_API_KEY)
-          params = {
-            'receptor': phone,
-            'message': text,
-            'template': 'otp_doctor'
-            }
-          api.verify_lookup(params)
+        get_provider().send(phone, text)
     except (APIException, HTTPException) as e:
-            logger.error(f"Failed to send SMS to {phone}: {e}")
-            return False
-    return True
\ No newline at end of file
+        logger.error(f"Failed to send SMS to {phone}: {e}")
+        return False
+    return True
+
+
+def dispatch_sms(phone, text, template="otp_doctor"):
+    """Queue an SMS for background delivery and return its SMSDelivery row."""
+    from medagent.models import SMSDelivery
+
+    # متن پیام (که ممکن است کد OTP باشد) پس از پایان ارسال از ردیف پاک می‌شود
+    delivery = SMSDelivery.objects.create(receptor=phone, template=template, text=text)
+    sms_queue.submit(deliver, delivery.id, phone, text, template)
+    return delivery
+
+
+def dispatch_sms_bulk(messages, template):
+    """
+    Queue many ``(phone, text)`` messages with one INSERT for their
+    SMSDelivery rows; returns the rows.
+    """
+    from medagent.models import SMSDelivery
+
+    messages = list(messages)
+    deliveries = SMSDelivery.objects.bulk_create(
+        [SMSDelivery(receptor=phone, template=template, text=text) for phone, text in messages]
+    )
+    for delivery, (phone, text) in zip(deliveries, messages):
+        sms_queue.submit(deliver, delivery.id, phone, text, template)
+    return deliveries
+
+
+def deliver(delivery_id, phone, text, template="otp_doctor"):
+    """Worker side of dispatch_sms: send with retries and record the outcome."""
+    from medagent.models import SMSDelivery
+
+    # ردیفی که worker دیگری برداشته یا تمام شده دوباره فرستاده نمی‌شود
+    claimed = SMSDelivery.objects.filter(id=delivery_id, status=SMSDelivery.QUEUED).update(
+        status=SMSDelivery.SENDING,
+    )
+    if not claimed:
+        return
+
+    max_attempts = settings.SMS_MAX_ATTEMPTS
+    status, message_id, error = SMSDelivery.FAILED, "", ""
+    for attempt in range(1, max_attempts + 1):
+        try:
+            message_id = get_provider().send(phone, text, template)
+            status, error = SMSDelivery.SENT, ""
+            break
+        except HTTPException as e:
+            error = str(e)
+            if attempt < max_attempts:
+                time.sleep(settings.SMS_RETRY_BACKOFF * 2 ** (attempt - 1))
+        except APIException as e:
+            # خطای منطقی سرویس (مثلاً شماره نامعتبر) با تکرار برطرف نمی‌شود
+            error = str(e)
+            break
+        except Exception as e:
+            # خطای پیش‌بینی‌نشده نباید ردیف را برای همیشه در وضعیت queued بگذارد
+            logger.exception(f"Unexpected error sending SMS to {phone}")
+            error = f"{type(e).__name__}: {e}"
+            break
+    if status == SMSDelivery.FAILED:
+        logger.error(f"Failed to send SMS to {phone} after {attempt} attempts: {error}")
+    SMSDelivery.objects.filter(id=delivery_id, status=SMSDelivery.SENDING).update(
+        status=status,
+        attempts=attempt,
+        provider_message_id=message_id or "",
+        last_error=error[:255],
+        text="",
+        finished_at=timezone.now(),
+    )
+
+
+def requeue_stale_deliveries(min_age, max_age):
+    """
+    Re-queue rows still ``queued`` after ``min_age`` seconds, e.g. because
+    the process holding them in memory restarted. Rows older than
+    ``max_age`` seconds, including ones stuck in ``sending`` by a worker
+    that died mid-send, are failed and their text blanked instead, since an
+    OTP in them has expired. Returns ``(requeued, expired)``.
+    """
+    from medagent.models import SMSDelivery
+
+    now = timezone.now()
+    stale = SMSDelivery.objects.filter(status=SMSDelivery.QUEUED)
+    unfinished = SMSDelivery.objects.filter(status__in=[SMSDelivery.QUEUED, SMSDelivery.SENDING])
+    expired = unfinished.filter(created_at__lt=now - datetime.timedelta(seconds=max_age)).update(
+        status=SMSDelivery.FAILED,
+        last_error="expired before delivery",
+        text="",
+        finished_at=now,
+    )
+    requeued = 0
+    for delivery in stale.filter(created_at__lt=now - datetime.timedelta(seconds=min_age)).iterator():
+        sms_queue.submit(deliver, delivery.id, delivery.receptor, delivery.text, delivery.template)
+        requeued += 1
+    return requeued, expired
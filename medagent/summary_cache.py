@@ -0,0 +1,58 @@
+"""
+Conditional GET and payload caching for summary endpoints.
+
+The doctor dashboard polls patient and session summaries that rarely change.
+Each summary row carries a modification timestamp (``updated_at``, which
+every save advances), so a poll can be answered
+from a cheap metadata query: an ETag/Last-Modified match returns 304 without
+touching the JSON blob, and a miss serves the serialized payload from the
+cache. Entries are keyed by summary and invalidated from post_save.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+
+def summary_cache_key(kind: str, pk) -> str:
+    """``kind`` is "patient" (keyed by patient_id) or "session" (by session_id)."""
+    return f"medagent:summary:{kind}:{pk}"
+
+
+def make_etag(kind: str, pk, modified_at) -> str:
+    return f'"{kind}-{pk}-{int(modified_at.timestamp() * 1_000_000)}"'
+
+
+def invalidate_summary(kind: str, pk) -> None:
+    cache.delete(summary_cache_key(kind, pk))
+
+
+def summary_response(request, kind: str, pk, modified_at, render):
+    """
+    Answer a summary GET for a row last modified at ``modified_at``.
+
+    Returns 304 when the client's validators still match. Otherwise the
+    payload comes from the cache, or from ``render()`` (which should load and
+    serialize the row) on a miss or stale entry.
+    """
+    cache_key = summary_cache_key(kind, pk)
+    etag = make_etag(kind, pk, modified_at)
+    last_modified = int(modified_at.timestamp())
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    cached = cache.get(cache_key)
+    if cached is not None and cached[0] == etag:
+        data = cached[1]
+    else:
+        data = render()
+        cache.set(cache_key, (etag, data), settings.SUMMARY_CACHE_TIMEOUT)
+
+    response = Response(data)
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    return response
@@ -1,19 +1,27 @@
 from __future__ import annotations
 
+import asyncio
 import base64
 import hashlib
 import json
 import mimetypes
 import logging
+import time
+import weakref
+from contextlib import contextmanager
 from pathlib import Path
 from typing import Any, Dict, List
 
+import httpx
 import requests
 from django.conf import settings
 
+from medagent.llm_scheduler import scheduler
+from medagent.model_router import estimate_tokens, router
+from medagent.profiling import outbound
+
 TALKBOT_BASE = settings.TALKBOT_API_BASE
 TALKBOT_TOKEN = settings.TALKBOT_API_KEY
-DEFAULT_MODEL = "gemini-pro-vision"
 
 
 def _headers() -> dict:
@@ -23,6 +31,31 @@ def _headers() -> dict:
     }
 
 
+# هر event loop کلاینت async خودش را دارد (اتصال‌ها به loop وابسته‌اند)
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+
+def _async_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = httpx.AsyncClient()
+    return client
+
+
+@contextmanager
+def _observed(model: str):
+    """زمان و نتیجه‌ی فراخوانی مدل را برای مسیریاب ثبت می‌کند."""
+    started = time.monotonic()
+    ok = False
+    try:
+        with outbound("talkbot"):
+            yield
+        ok = True
+    finally:
+        router.observe(model, time.monotonic() - started, ok)
+
+
 # ---------- ابزار کمکی Base64 ---------- #
 
 def encode_image_to_base64(path: str) -> str:
@@ -45,75 +78,121 @@ def sha256_file_hash(path: str) -> str:
 def vision_analyze(
     image_path: str,
     prompt: str = "Explain the medical findings in this image.",
-    model: str = DEFAULT_MODEL,
+    model: str | None = None,
 ) -> dict:
     """ارسال تصویر (Base64) + متن به /v1/chat/completions و دریافت پاسخ تحلیلی."""
-    try:
-        if not Path(image_path).exists():
-            raise FileNotFoundError(image_path)
-
-        payload = {
-            "model": model,
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image_url",
-                            "image_url": {"url": encode_image_to_base64(image_path)},
-                        },
-                        {"type": "text", "text": prompt},
-                    ],
-                }
-            ],
-            "temperature": 0.7,
-            "stream": False,
-        }
-
-        r = requests.post(
-            f"{TALKBOT_BASE}/v1/chat/completions",
-            headers=_headers(),
-            json=payload,
-            timeout=60,
-        )
-        r.raise_for_status()
-        return r.json()
-
-    except Exception as e:
-        logging.exception("vision_analyze error")
-        return {"error": "An error occurred during image analysis.", "label": "خطا", "finding": "نامشخص"}
+    model = model or router.choose("vision", estimate_tokens(prompt))
+    with scheduler.slot():
+        try:
+            if not Path(image_path).exists():
+                raise FileNotFoundError(image_path)
+
+            payload = {
+                "model": model,
+                "messages": [
+                    {
+                        "role": "user",
+                        "content": [
+                            {
+                                "type": "image_url",
+                                "image_url": {"url": encode_image_to_base64(image_path)},
+                            },
+                            {"type": "text", "text": prompt},
+                        ],
+                    }
+                ],
+                "temperature": 0.7,
+                "stream": False,
+            }
+
+            with _observed(model):
+                r = requests.post(
+                    f"{TALKBOT_BASE}/v1/chat/completions",
+                    headers=_headers(),
+                    json=payload,
+                    timeout=60,
+                )
+                r.raise_for_status()
+            return r.json()
+
+        except Exception as e:
+            logging.exception("vision_analyze error")
+            return {"error": "An error occurred during image analysis.", "label": "خطا", "finding": "نامشخص"}
 
 
 # ---------- Profanity ---------- #
 
 def profanity(text: str) -> dict:
-    try:
-        body = {"text": text}
-        r = requests.post(
-            f"{TALKBOT_BASE}/analysis/profanity/REQ",
-            headers=_headers(),
-            json=body,
-            timeout=10,
-        )
-        r.raise_for_status()
-        data = r.json()
-        return data if isinstance(data, dict) else {"contains_profanity": False}
-    except Exception:
-        return {"contains_profanity": False}
+    with scheduler.slot():
+        try:
+            body = {"text": text}
+            with outbound("talkbot"):
+                r = requests.post(
+                    f"{TALKBOT_BASE}/analysis/profanity/REQ",
+                    headers=_headers(),
+                    json=body,
+                    timeout=10,
+                )
+                r.raise_for_status()
+            data = r.json()
+            return data if isinstance(data, dict) else {"contains_profanity": False}
+        except Exception:
+            return {"contains_profanity": False}
+
+
+async def aprofanity(text: str) -> dict:
+    """نسخه‌ی async تابع profanity برای viewهای ASGI."""
+    async with scheduler.aslot():
+        try:
+            with outbound("talkbot"):
+                r = await _async_client().post(
+                    f"{TALKBOT_BASE}/analysis/profanity/REQ",
+                    headers=_headers(),
+                    json={"text": text},
+                    timeout=10,
+                )
+                r.raise_for_status()
+            data = r.json()
+            return data if isinstance(data, dict) else {"contains_profanity": False}
+        except Exception:
+            return {"contains_profanity": False}
 
 
 # ---------- Chat (متن خالص) ---------- #
 
-def tb_chat(messages: list[dict], model: str = "o3-mini") -> str:
+def tb_chat(messages: list[dict], model: str | None = None) -> str:
+    """بدون model، مسیریاب مدل گفت‌وگو را انتخاب می‌کند."""
+    model = model or router.choose("chat", estimate_tokens(messages))
     body = {"model": model, "messages": messages}
-    try:
-        r = requests.post(
-            f"{TALKBOT_BASE}/chat",
-            headers=_headers(),
-            json=body,
-            timeout=30,
-        )
-        r.raise_for_status()
-        return r.text
-    except Exception:
-        return json.dumps({"text_summary": "خطا در ارتباط با مدل", "token_count": 0})
+    with scheduler.slot():
+        try:
+            with _observed(model):
+                r = requests.post(
+                    f"{TALKBOT_BASE}/chat",
+                    headers=_headers(),
+                    json=body,
+                    timeout=30,
+                )
+                r.raise_for_status()
+            return r.text
+        except Exception:
+            return json.dumps({"text_summary": "خطا در ارتباط با مدل", "token_count": 0})
+
+
+async def atb_chat(messages: list[dict], model: str | None = None) -> str:
+    """نسخه‌ی async تابع tb_chat؛ event loop را در طول فراخوانی مدل مسدود نمی‌کند."""
+    model = model or router.choose("chat", estimate_tokens(messages))
+    body = {"model": model, "messages": messages}
+    async with scheduler.aslot():
+        try:
+            with _observed(model):
+                r = await _async_client().post(
+                    f"{TALKBOT_BASE}/chat",
+                    headers=_headers(),
+                    json=body,
+                    timeout=30,
+                )
+                r.raise_for_status()
+            return r.text
+        except Exception:
+            return json.dumps({"text_summary": "خطا در ارتباط با مدل", "token_count": 0})
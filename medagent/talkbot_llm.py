@@ -1,18 +1,33 @@
 from langchain_core.language_models import BaseLLM
-from langchain_core.outputs import Generation
-from typing import List
-from medagent.talkbot_client import tb_chat  # فرض بر این است که تعریف شده
+from langchain_core.outputs import Generation, LLMResult
+from typing import Any, List, Optional
+
 
 class TalkBotLLM(BaseLLM):
-    model: str = "o3-mini"
+    # None یعنی انتخاب مدل با مسیریاب (medagent.model_router)
+    model: Optional[str] = None
 
     def _call(self, prompt: str, stop: List[str] = None) -> str:
+        # import داخل متد تا monkeypatch در تست‌ها موثر باشد
+        from medagent.talkbot_client import tb_chat
+
         # ساختار پیام سازگار با chat models
         messages = [{"role": "user", "content": prompt}]
         return tb_chat(messages, model=self.model)
 
-    def _generate(self, prompts: List[str], stop: List[str] = None) -> List[Generation]:
-        return [Generation(text=self._call(prompt, stop)) for prompt in prompts]
+    async def _acall(self, prompt: str, stop: List[str] = None) -> str:
+        from medagent.talkbot_client import atb_chat
+
+        messages = [{"role": "user", "content": prompt}]
+        return await atb_chat(messages, model=self.model)
+
+    def _generate(self, prompts: List[str], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> LLMResult:
+        return LLMResult(generations=[[Generation(text=self._call(prompt, stop))] for prompt in prompts])
+
+    async def _agenerate(self, prompts: List[str], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> LLMResult:
+        return LLMResult(generations=[[Generation(text=await self._acall(prompt, stop))] for prompt in prompts])
 
     @property
     def _llm_type(self) -> str:
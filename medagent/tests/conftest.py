@@ -2,6 +2,12 @@
 import json
 import random
 import pytest
+from django.conf import settings as django_settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections
+
+from core.db import database_config
 
 class DummyAgent:
     def __call__(self, *_, **__):
@@ -9,10 +15,27 @@ class DummyAgent:
     invoke = __call__
     run = __call__
 
+    async def arun(self, *_, **__):
+        return "mock assistant reply"
+
+async def _fake_aprofanity(text):
+    return {"contains_profanity": False}
+
+async def _fake_atb_chat(messages, *_, **__):
+    return json.dumps({
+        "text_summary": "mock summary",
+        "chief_complaint": "mock complaint",
+        "token_count": 42
+    })
+
 @pytest.fixture(autouse=True)
-def auto_mock_external(monkeypatch):
+def auto_mock_external(monkeypatch, settings):
     """Mock های عمومی برای تمام تست‌ها"""
 
+    settings.SMS_PROVIDER = "medagent.sms.FakeSMSProvider"
+    settings.SMS_RETRY_BACKOFF = 0
+    settings.BACKGROUND_TASKS_EAGER = True
+
     monkeypatch.setattr(
         "medagent.talkbot_client.profanity",
         lambda text: {"contains_profanity": False}
@@ -29,6 +52,38 @@ def auto_mock_external(monkeypatch):
             "token_count": 42
         })
     )
+    monkeypatch.setattr("medagent.talkbot_client.aprofanity", _fake_aprofanity)
+    monkeypatch.setattr("medagent.talkbot_client.atb_chat", _fake_atb_chat)
     monkeypatch.setattr("medagent.agent_setup.agent", DummyAgent())
     monkeypatch.setattr("medagent.sms.send_sms", lambda *_, **__: True)
+    monkeypatch.setattr("medagent.sms._providers", {})
     monkeypatch.setattr(random, "randint", lambda *_, **__: 123456)
+    cache.clear()
+
+@pytest.fixture
+def file_database(transactional_db, tmp_path):
+    """
+    Run on a file-backed SQLite database configured like production.
+
+    In-memory SQLite reports table locks instead of waiting for them, so
+    threaded tests would fail for reasons unrelated to the code under test.
+    """
+    if connection.vendor != "sqlite":
+        yield
+        return
+    # اتصال نخ‌های دیگر هم از همین dict ساخته می‌شود
+    db = connection.settings_dict
+    saved = {key: db[key] for key in ("NAME", "OPTIONS")}
+    config = database_config("sqlite:///stress.sqlite3", tmp_path, busy_timeout=django_settings.SQLITE_BUSY_TIMEOUT)
+    # بستن پایگاه داده‌ی درون‌حافظه‌ای آن را پاک می‌کند؛ فقط کنار گذاشته و بعد برگردانده می‌شود
+    in_memory = connection.connection if connection.is_in_memory_db() else None
+    connections.close_all()
+    connection.connection = None
+    db.update(NAME=config["NAME"], OPTIONS=config["OPTIONS"])
+    try:
+        call_command("migrate", run_syncdb=True, verbosity=0)
+        yield
+    finally:
+        connections.close_all()
+        db.update(saved)
+        connection.connection = in_memory
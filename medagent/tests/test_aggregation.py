@@ -0,0 +1,80 @@
+import datetime
+import json
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+from medagent.aggregation import fold_pending, fold_session_summary
+from medagent.models import ChatSession, PatientProfile, PatientSummary, SessionSummary
+
+User = get_user_model()
+
+
+@pytest.fixture
+def patient(db):
+    user = User.objects.create_user(username="folded", password="pwd")
+    return PatientProfile.objects.create(user=user, national_code="8080808080", phone_number="09120000080")
+
+
+def session_summary(patient, text, days_ago=0, **fields):
+    session = ChatSession.objects.create(owner=patient.user, patient=patient)
+    summary = SessionSummary.objects.create(session=session, text_summary=text, json_summary=fields, tokens_used=10)
+    SessionSummary.objects.filter(id=summary.id).update(
+        generated_at=timezone.now() - datetime.timedelta(days=days_ago),
+    )
+    return summary
+
+
+def test_new_session_summary_is_folded_in(patient):
+    session_summary(patient, "headache", chief_complaint="headache", medications=["ibuprofen"], smoker=True)
+    session_summary(patient, "follow-up", chief_complaint="headache", medications=["ibuprofen", "sumatriptan"])
+
+    data = PatientSummary.objects.get(patient=patient).json_data
+    assert data["session_count"] == 2
+    assert data["chief_complaints"]["headache"]["count"] == 2
+    assert data["medications"] == ["ibuprofen", "sumatriptan"]
+    assert data["smoker"] is True
+    assert data["notes"].count("\n") == 1 and data["notes"].endswith("follow-up")
+    assert not SessionSummary.objects.filter(folded_at__isnull=True).exists()
+
+
+def test_fold_is_idempotent_and_order_independent(patient, settings):
+    settings.BACKGROUND_TASKS_EAGER = False
+    new = session_summary(patient, "new", days_ago=1, smoker=False)
+    old = session_summary(patient, "old", days_ago=10, smoker=True)
+
+    assert fold_session_summary(new.id) and fold_session_summary(old.id)
+    assert not fold_session_summary(new.id)
+    assert fold_pending() == 0
+
+    data = PatientSummary.objects.get(patient=patient).json_data
+    assert data["session_count"] == 2
+    assert data["smoker"] is False
+
+
+def test_long_notes_are_condensed(patient, settings, monkeypatch):
+    settings.PATIENT_SUMMARY_CONDENSE_CHARS = 50
+    prompts = []
+
+    def fake_tb_chat(messages, *_, **__):
+        prompts.append(messages[-1]["content"])
+        return json.dumps({"text_summary": "condensed history", "token_count": 5})
+
+    monkeypatch.setattr("medagent.talkbot_client.tb_chat", fake_tb_chat)
+    session_summary(patient, "x" * 30)
+    session_summary(patient, "y" * 30)
+
+    assert len(prompts) == 1
+    assert PatientSummary.objects.get(patient=patient).json_data["notes"] == "condensed history"
+
+
+def test_failed_condense_keeps_notes(patient, settings, monkeypatch):
+    settings.PATIENT_SUMMARY_CONDENSE_CHARS = 10
+    monkeypatch.setattr(
+        "medagent.talkbot_client.tb_chat",
+        lambda *_, **__: json.dumps({"text_summary": "خطا در ارتباط با مدل", "token_count": 0}),
+    )
+    session_summary(patient, "a long enough note")
+
+    assert PatientSummary.objects.get(patient=patient).json_data["notes"].endswith("a long enough note")
@@ -0,0 +1,105 @@
+import datetime
+
+import pytest
+import zstandard
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from medagent.archive import HistoricalChatMessage, archive_sessions, rehydrate
+from medagent.models import ChatMessage, ChatSession, PatientProfile, SessionSummary
+from sub.models import Subscription, SubscriptionPlan
+
+User = get_user_model()
+
+
+@pytest.fixture
+def archive_dir(settings, tmp_path):
+    settings.ARCHIVE_DIR = str(tmp_path)
+    settings.ARCHIVE_AFTER_DAYS = 30
+    return tmp_path
+
+
+@pytest.fixture
+def owner(db):
+    user = User.objects.create_user(username="archived", password="pwd")
+    plan = SubscriptionPlan.objects.create(name="31-day", days=31, price=300)
+    Subscription.objects.create(user=user, plan=plan, end_date=timezone.now() + datetime.timedelta(days=31))
+    PatientProfile.objects.create(user=user, national_code="1212121212", phone_number="09120000012")
+    return user
+
+
+def ended_session(owner, days_ago, messages=3):
+    session = ChatSession.objects.create(owner=owner, patient=owner.patientprofile)
+    for i in range(messages):
+        ChatMessage.objects.create(session=session, role="owner" if i % 2 == 0 else "assistant", content=f"پیام {i}")
+    SessionSummary.objects.create(session=session, text_summary="خلاصه", json_summary={"chief_complaint": "تب"}, tokens_used=5)
+    ChatSession.objects.filter(id=session.id).update(ended_at=timezone.now() - datetime.timedelta(days=days_ago))
+    return session
+
+
+def test_archive_moves_old_sessions_to_segments(owner, archive_dir):
+    old = ended_session(owner, days_ago=40)
+    recent = ended_session(owner, days_ago=5)
+    created = list(ChatMessage.objects.filter(session=old).values_list("id", "created_at", "content"))
+
+    assert archive_sessions(batch_size=1) == 1
+
+    old.refresh_from_db()
+    assert old.archived_at and old.archive_segment == "segment-000001.jsonl.zst"
+    assert not ChatMessage.objects.filter(session=old).exists()
+    assert not HistoricalChatMessage.objects.filter(session_id=old.id).exists()
+    assert not SessionSummary.objects.filter(session=old).exists()
+    assert ChatMessage.objects.filter(session=recent).count() == 3
+    # کل فایل segment به‌صورت JSONL قابل بازکردن است
+    text = zstandard.ZstdDecompressor().stream_reader(open(archive_dir / old.archive_segment, "rb")).read()
+    assert text.decode().count("\n") == 1
+
+    assert rehydrate(old) and not rehydrate(old)
+    assert list(ChatMessage.objects.filter(session=old).values_list("id", "created_at", "content")) == created
+    assert HistoricalChatMessage.objects.filter(session_id=old.id).count() == 3
+    assert SessionSummary.objects.get(session=old).json_summary == {"chief_complaint": "تب"}
+    assert archive_sessions() == 0
+
+
+def test_reads_rehydrate_transparently(owner, archive_dir):
+    session = ended_session(owner, days_ago=40, messages=4)
+    archive_sessions()
+    client = APIClient()
+    client.force_authenticate(user=owner)
+
+    response = client.get(f"/api/session/{session.id}/messages/")
+    assert response.status_code == 200
+    assert [m["content"] for m in response.data["results"]] == [f"پیام {i}" for i in range(4)]
+    assert client.get(f"/api/session/{session.id}/summary/").data["text_summary"] == "خلاصه"
+    session.refresh_from_db()
+    assert session.archived_at is None and session.rehydrated_at is not None
+
+
+@pytest.mark.parametrize("url", ["/api/session/end/", "/api/async/session/end/"], ids=["sync", "async"])
+def test_end_session_rehydrates_before_summarizing(owner, archive_dir, client, url):
+    session = ended_session(owner, days_ago=40, messages=4)
+    SessionSummary.objects.filter(session=session).delete()
+    archive_sessions()
+    client.force_login(owner)
+
+    response = client.patch(url, {"session_id": session.id}, content_type="application/json")
+
+    assert response.status_code == 200
+    assert ChatMessage.objects.filter(session=session).count() == 4
+    session.refresh_from_db()
+    assert session.archived_at is None
+    # بدون بازگردانی پیامی برای خلاصه‌سازی نبود و خلاصه‌ای ساخته نمی‌شد
+    assert SessionSummary.objects.filter(session=session).count() == 1
+
+
+def test_segments_rotate_and_append(owner, archive_dir, settings):
+    settings.ARCHIVE_SEGMENT_BYTES = 1
+    sessions = [ended_session(owner, days_ago=40) for _ in range(3)]
+    archive_sessions(batch_size=1)
+
+    names = sorted(p.name for p in archive_dir.glob("segment-*"))
+    assert names == [f"segment-00000{i}.{ext}" for i in (1, 2, 3) for ext in ("idx", "jsonl.zst")]
+    for session in sessions:
+        session.refresh_from_db()
+        assert rehydrate(session)
@@ -0,0 +1,103 @@
+import datetime
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.test import Client
+from django.utils import timezone
+
+from medagent.models import PatientProfile, AccessHistory, ChatSession, ChatMessage, SessionSummary
+from sub.models import SubscriptionPlan, Subscription
+
+User = get_user_model()
+
+
+@pytest.fixture
+def subscriber(db):
+    user = User.objects.create_user(username="asyncuser", password="pwd")
+    plan = SubscriptionPlan.objects.create(name="31-day", days=31, price=300)
+    Subscription.objects.create(user=user, plan=plan, end_date=timezone.now() + datetime.timedelta(days=31))
+    return user
+
+
+@pytest.fixture
+def profile(subscriber):
+    return PatientProfile.objects.create(user=subscriber, national_code="7878787878", phone_number="09120000020")
+
+
+@pytest.mark.django_db
+def test_async_views_require_authentication(client):
+    response = client.post("/api/async/otp/request/", {"national_code": "7878787878"})
+    assert response.status_code == 403
+
+
+@pytest.mark.django_db
+def test_async_otp_flow(client, subscriber, profile):
+    client.force_login(subscriber)
+    response = client.post("/api/async/otp/request/", {"national_code": profile.national_code})
+    assert response.status_code == 200
+    response = client.post("/api/async/otp/verify/", {"national_code": profile.national_code, "code": "000000"})
+    assert response.status_code == 400
+    response = client.post("/api/async/otp/verify/", {"national_code": profile.national_code, "code": "123456"})
+    assert response.status_code == 200
+    assert AccessHistory.objects.filter(doctor=subscriber, patient=profile).exists()
+
+
+@pytest.mark.django_db
+def test_async_post_message_and_end_session(client, subscriber, profile):
+    client.force_login(subscriber)
+    session = ChatSession.objects.create(owner=subscriber, patient=profile)
+
+    response = client.post(f"/api/async/session/{session.id}/message/", {"content": "سلام"},
+                           content_type="application/json")
+    assert response.status_code == 200
+    assert response.json()["assistant_reply"] == "mock assistant reply"
+    assert ChatMessage.objects.filter(session=session).count() == 2
+
+    response = client.post(f"/api/async/session/{session.id}/message/", {}, content_type="application/json")
+    assert response.status_code == 400
+    assert "content" in response.json()
+
+    response = client.patch("/api/async/session/end/", {"session_id": session.id}, content_type="application/json")
+    assert response.status_code == 200
+    session.refresh_from_db()
+    assert session.ended_at is not None
+    assert SessionSummary.objects.get(session=session).text_summary == "mock summary"
+
+
+@pytest.mark.django_db
+def test_async_only_malformed_bodies_are_bad_requests(monkeypatch, client, subscriber, profile):
+    client.force_login(subscriber)
+    session = ChatSession.objects.create(owner=subscriber, patient=profile)
+    url = f"/api/async/session/{session.id}/message/"
+
+    response = client.post(url, "{not json", content_type="application/json")
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Malformed request."}
+
+    async def broken_arun(*_, **__):
+        raise ValueError("bad tool output")
+    monkeypatch.setattr("medagent.agent_setup.agent.arun", broken_arun)
+    # خطای داخلی handler به‌صورت 400 پنهان نمی‌شود
+    with pytest.raises(ValueError):
+        client.post(url, {"content": "سلام"}, content_type="application/json")
+
+
+@pytest.mark.django_db
+def test_async_csrf_applies_to_session_auth_only(subscriber, profile):
+    client = Client(enforce_csrf_checks=True)
+    tokens = client.post("/api/auth/token/", {"username": "asyncuser", "password": "pwd"}).json()
+    # کلاینت JWT کوکی CSRF ندارد
+    response = client.post("/api/async/otp/request/", {"national_code": profile.national_code},
+                           HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+    assert response.status_code == 200
+
+    client.force_login(subscriber)
+    response = client.post("/api/async/otp/request/", {"national_code": profile.national_code})
+    assert response.status_code == 403
+    assert response.json()["detail"].startswith("CSRF Failed")
+
+    # با کوکی و هدر CSRF هم‌خوان پذیرفته می‌شود
+    client.cookies["csrftoken"] = "x" * 32
+    response = client.post("/api/async/otp/request/", {"national_code": profile.national_code},
+                           HTTP_X_CSRFTOKEN="x" * 32)
+    assert response.status_code == 200
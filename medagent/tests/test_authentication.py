@@ -0,0 +1,140 @@
+import datetime
+import io
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.core.management import call_command
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from medagent.models import PatientProfile, AccessHistory, ChatSession, IssuedRefreshToken
+from sub.models import SubscriptionPlan, Subscription
+
+User = get_user_model()
+
+
+@pytest.fixture
+def doctor(db):
+    user = User.objects.create_user(username="jwtdoctor", password="pwd")
+    user.groups.add(Group.objects.get_or_create(name="doctor")[0])
+    plan = SubscriptionPlan.objects.create(name="31-day", days=31, price=300)
+    Subscription.objects.create(user=user, plan=plan, end_date=timezone.now() + datetime.timedelta(days=31))
+    return user
+
+
+def obtain(client, username="jwtdoctor", password="pwd"):
+    return client.post("/api/auth/token/", {"username": username, "password": password})
+
+
+def bearer(client, access):
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+
+
+@pytest.mark.django_db
+def test_obtain_rejects_bad_credentials(doctor):
+    assert obtain(APIClient(), password="wrong").status_code == 401
+
+
+@pytest.mark.django_db
+def test_hot_path_authorizes_from_claims(doctor, django_assert_num_queries):
+    client = APIClient()
+    tokens = obtain(client).data
+    patient = PatientProfile.objects.create(
+        user=User.objects.create_user(username="patient", password="pwd"),
+        national_code="3030303030", phone_number="09120000030",
+    )
+    AccessHistory.objects.create(doctor=doctor, patient=patient)
+    bearer(client, tokens["access"])
+
+    # فقط بیمار، سابقه‌ی دسترسی و درج جلسه؛ بدون نشست، کاربر، گروه یا اشتراک
+    with django_assert_num_queries(3):
+        response = client.post("/api/session/create/", {"patient_id": patient.id})
+    assert response.status_code == 201
+    assert ChatSession.objects.get(id=response.data["session_id"]).owner == doctor
+
+
+@pytest.mark.django_db
+def test_expired_subscription_claim_is_rejected(doctor):
+    Subscription.objects.filter(user=doctor).update(end_date=timezone.now() - datetime.timedelta(days=1))
+    client = APIClient()
+    bearer(client, obtain(client).data["access"])
+    response = client.post("/api/session/create/", {"patient_id": 1})
+    assert response.status_code == 403
+
+
+@pytest.mark.django_db
+def test_refresh_rotates_and_detects_reuse(doctor):
+    client = APIClient()
+    first = obtain(client).data
+
+    response = client.post("/api/auth/token/refresh/", {"refresh": first["refresh"]})
+    assert response.status_code == 200
+    second = response.data
+
+    # استفاده‌ی دوباره از توکن مصرف‌شده همه‌ی توکن‌های کاربر را باطل می‌کند
+    assert client.post("/api/auth/token/refresh/", {"refresh": first["refresh"]}).status_code == 401
+    assert client.post("/api/auth/token/refresh/", {"refresh": second["refresh"]}).status_code == 401
+    bearer(client, second["access"])
+    # SessionAuthentication اول است، پس DRF به‌جای 401 کد 403 برمی‌گرداند
+    assert client.post("/api/session/create/", {"patient_id": 1}).status_code == 403
+
+
+@pytest.mark.django_db
+def test_revoke_invalidates_access_and_refresh(doctor):
+    client = APIClient()
+    tokens = obtain(client).data
+    bearer(client, tokens["access"])
+
+    response = client.post("/api/auth/token/revoke/", {"refresh": tokens["refresh"]})
+    assert response.status_code == 200
+    assert client.post("/api/session/create/", {"patient_id": 1}).status_code == 403
+    client.credentials()
+    assert client.post("/api/auth/token/refresh/", {"refresh": tokens["refresh"]}).status_code == 401
+
+
+@pytest.mark.django_db
+def test_async_view_accepts_bearer_token(client, doctor):
+    tokens = obtain(APIClient()).data
+    session = ChatSession.objects.create(
+        owner=doctor,
+        patient=PatientProfile.objects.create(user=doctor, national_code="3131313131", phone_number="09120000031"),
+    )
+    response = client.post(f"/api/async/session/{session.id}/message/", {"content": "سلام"},
+                           content_type="application/json", HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+    assert response.status_code == 200
+
+
+@pytest.mark.django_db
+def test_refresh_reuse_is_detected_without_the_cache(doctor):
+    client = APIClient()
+    first = obtain(client).data
+    assert client.post("/api/auth/token/refresh/", {"refresh": first["refresh"]}).status_code == 200
+    # کش محلی پروسس دیگری است؛ مصرف توکن از پایگاه داده خوانده می‌شود
+    cache.clear()
+    response = client.post("/api/auth/token/refresh/", {"refresh": first["refresh"]})
+    assert response.status_code == 401
+    assert "already been used" in response.data["error"]
+    assert not IssuedRefreshToken.objects.filter(user=doctor, used_at__isnull=True).exists()
+
+
+@pytest.mark.django_db
+def test_unknown_refresh_token_does_not_revoke_the_user(doctor):
+    client = APIClient()
+    tokens = obtain(client).data
+    IssuedRefreshToken.objects.all().delete()
+    response = client.post("/api/auth/token/refresh/", {"refresh": tokens["refresh"]})
+    assert response.status_code == 401
+    assert "not recognized" in response.data["error"]
+    # بدون نشانه‌ی استفاده‌ی دوباره، توکن دسترسی معتبر می‌ماند
+    bearer(client, tokens["access"])
+    assert client.post("/api/session/create/", {"patient_id": 999999}).status_code == 404
+
+
+@pytest.mark.django_db
+def test_purge_refresh_tokens(doctor):
+    obtain(APIClient())
+    IssuedRefreshToken.objects.update(expires_at=timezone.now() - datetime.timedelta(seconds=1))
+    call_command("purge_refresh_tokens", stdout=io.StringIO())
+    assert not IssuedRefreshToken.objects.exists()
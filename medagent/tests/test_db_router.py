@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.test import RequestFactory
+from rest_framework.views import APIView
+
+from core.db import ReplicaRouter, ReplicaRoutingMiddleware, database_config
+
+
+class ReadOnlyView(APIView):
+    read_replica = True
+
+
+class WriteView(APIView):
+    pass
+
+
+def route_reads(method, view, writes=0, replicas=("replica_0",)):
+    """Run the middleware around a fake view that performs ``writes`` writes, then one read."""
+    router = ReplicaRouter()
+    seen = {}
+
+    def get_response(request):
+        middleware.process_view(request, view.as_view(), (), {})
+        seen["before"] = router.db_for_read(None)
+        for _ in range(writes):
+            router.db_for_write(None)
+        seen["after"] = router.db_for_read(None)
+        return None
+
+    middleware = ReplicaRoutingMiddleware(get_response)
+    middleware(getattr(RequestFactory(), method)("/"))
+    return seen
+
+
+@pytest.fixture(autouse=True)
+def replicas(settings):
+    settings.DATABASE_REPLICAS = ["replica_0"]
+
+
+def test_read_only_get_goes_to_replica():
+    assert route_reads("get", ReadOnlyView) == {"before": "replica_0", "after": "replica_0"}
+
+
+def test_write_pins_request_to_primary():
+    assert route_reads("get", ReadOnlyView, writes=1) == {"before": "replica_0", "after": "default"}
+
+
+def test_other_views_and_methods_use_primary():
+    assert route_reads("get", WriteView)["before"] == "default"
+    assert route_reads("post", ReadOnlyView)["before"] == "default"
+
+
+def test_async_chain_routes_reads_in_sync_view():
+    router = ReplicaRouter()
+    seen = {}
+
+    def view(request):
+        middleware.process_view(request, ReadOnlyView.as_view(), (), {})
+        seen["read"] = router.db_for_read(None)
+
+    async def get_response(request):
+        await sync_to_async(view)(request)
+
+    middleware = ReplicaRoutingMiddleware(get_response)
+    assert iscoroutinefunction(middleware)
+    asyncio.run(middleware(RequestFactory().get("/")))
+    assert seen == {"read": "replica_0"}
+    assert router.db_for_read(None) == "default"
+
+
+def test_reads_outside_requests_use_primary():
+    assert ReplicaRouter().db_for_read(None) == "default"
+
+
+def test_database_config_sqlite_pragmas(tmp_path):
+    config = database_config("sqlite:///db.sqlite3", tmp_path, conn_max_age=30, busy_timeout=5)
+    assert config["NAME"] == tmp_path / "db.sqlite3"
+    assert config["CONN_MAX_AGE"] == 30 and config["CONN_HEALTH_CHECKS"] is True
+    assert "journal_mode=WAL" in config["OPTIONS"]["init_command"]
+    assert "busy_timeout=5000" in config["OPTIONS"]["init_command"]
+
+
+def test_database_config_postgres(tmp_path):
+    config = database_config("postgres://u:p%40ss@db:5433/medagent", tmp_path)
+    assert config["ENGINE"] == "django.db.backends.postgresql"
+    assert (config["NAME"], config["USER"], config["PASSWORD"], config["HOST"], config["PORT"]) == (
+        "medagent", "u", "p@ss", "db", "5433"
+    )
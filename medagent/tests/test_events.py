@@ -0,0 +1,181 @@
+import asyncio
+import datetime
+import threading
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from medagent.events import EventBroker, broker, event_stream
+from medagent.models import PatientProfile, ChatSession, SessionSummary
+from sub.models import SubscriptionPlan, Subscription
+
+User = get_user_model()
+
+
+def test_broker_delivers_across_threads():
+    local = EventBroker()
+
+    async def scenario():
+        sub = local.subscribe(7)
+        threading.Thread(target=local.publish_local, args=(7, {"type": "ping"})).start()
+        event = await asyncio.wait_for(sub.queue.get(), timeout=2)
+        local.unsubscribe(sub)
+        return event
+
+    assert asyncio.run(scenario()) == {"type": "ping"}
+    assert local.subscriber_count() == 0
+
+
+class _FlakyPubSub:
+    def __init__(self, fail):
+        self.fail = fail
+
+    async def psubscribe(self, pattern):
+        if self.fail:
+            raise ConnectionError("redis down")
+
+    async def listen(self):
+        yield {"type": "psubscribe", "channel": b"medagent:events:*", "data": 1}
+        yield {"type": "pmessage", "channel": b"medagent:events:7", "data": b"not json"}
+        yield {"type": "pmessage", "channel": b"medagent:events:7", "data": b'{"type": "ping"}'}
+        await asyncio.Event().wait()
+
+
+class _FlakyRedis:
+    connections = 0
+
+    def __init__(self):
+        type(self).connections += 1
+        self.fail = self.connections == 1
+
+    def pubsub(self):
+        return _FlakyPubSub(self.fail)
+
+    async def aclose(self):
+        pass
+
+
+def test_redis_relay_reconnects_after_failure(monkeypatch, settings):
+    import redis.asyncio
+
+    settings.EVENTS_REDIS_URL = "redis://events"
+    monkeypatch.setattr(redis.asyncio, "from_url", lambda url: _FlakyRedis())
+    local = EventBroker()
+    local.reconnect_delay = 0
+
+    async def scenario():
+        sub = local.subscribe(7)
+        event = await asyncio.wait_for(sub.queue.get(), timeout=2)
+        relay = local._listeners[asyncio.get_running_loop()]
+        relay.cancel()
+        await asyncio.sleep(0)
+        # رله‌ی متوقف‌شده با مشترک بعدی دوباره راه می‌افتد
+        local.subscribe(7)
+        restarted = local._listeners[asyncio.get_running_loop()]
+        restarted.cancel()
+        return event, restarted is not relay
+
+    assert asyncio.run(scenario()) == ({"type": "ping"}, True)
+    assert _FlakyRedis.connections == 2
+
+
+def test_event_stream_ends_after_session_closed():
+    async def scenario():
+        frames = []
+        stream = event_stream(9)
+        frames.append(await stream.__anext__())  # retry:
+        waiter = asyncio.ensure_future(stream.__anext__())
+        await asyncio.sleep(0)
+        broker.publish_local(9, {"type": "assistant_message", "session_id": 9})
+        frames.append(await waiter)
+        broker.publish_local(9, {"type": "session_closed", "session_id": 9})
+        async for frame in stream:
+            frames.append(frame)
+        return frames
+
+    frames = asyncio.run(scenario())
+    assert frames[1].startswith("event: assistant_message\n")
+    assert frames[-1].startswith("event: session_closed\n")
+    assert broker.subscriber_count() == 0
+
+
+@pytest.mark.django_db
+def test_views_publish_session_events(monkeypatch, django_capture_on_commit_callbacks):
+    published = []
+    monkeypatch.setattr(broker, "publish", lambda session_id, event: published.append(event["type"]))
+    user = User.objects.create_user(username="eventuser", password="pwd")
+    plan = SubscriptionPlan.objects.create(name="31-day", days=31, price=300)
+    Subscription.objects.create(user=user, plan=plan, end_date=timezone.now() + datetime.timedelta(days=31))
+    profile = PatientProfile.objects.create(user=user, national_code="8989898989", phone_number="09120000021")
+    session = ChatSession.objects.create(owner=user, patient=profile)
+    api_client = APIClient()
+    api_client.force_authenticate(user=user)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        api_client.post(f"/api/session/{session.id}/message/", {"session": session.id, "content": "سلام"})
+        api_client.patch("/api/session/end/", {"session_id": session.id})
+
+    assert published == ["assistant_message", "summary_ready", "session_closed"]
+    assert SessionSummary.objects.filter(session=session).exists()
+
+
+def test_event_stream_replays_events_after_last_event_id():
+    local_events = [{"type": "assistant_message", "session_id": 11}, {"type": "summary_ready", "session_id": 11}]
+
+    async def scenario():
+        for event in local_events:
+            broker.publish(11, event)
+        first_id = broker.replay(11, 0)[0]["id"]
+        stream = event_stream(11, last_event_id=first_id)
+        frames = [await stream.__anext__(), await stream.__anext__()]
+        waiter = asyncio.ensure_future(stream.__anext__())
+        await asyncio.sleep(0)
+        broker.publish(11, {"type": "session_closed", "session_id": 11})
+        frames.append(await waiter)
+        await stream.aclose()
+        return first_id, frames
+
+    first_id, frames = asyncio.run(scenario())
+    assert frames[1].startswith("id: ")
+    assert "event: summary_ready\n" in frames[1]
+    assert int(frames[1].split("\n")[0][4:]) > first_id
+    assert "event: session_closed\n" in frames[2]
+    assert broker.subscriber_count() == 0
+
+
+def test_event_stream_subscribes_before_checking_session_state():
+    async def scenario():
+        async def is_closed():
+            # session_closed درست پیش از خواندن وضعیت جلسه منتشر می‌شود
+            broker.publish(12, {"type": "session_closed", "session_id": 12})
+            await asyncio.sleep(0)
+            return False
+
+        stream = event_stream(12, is_closed=is_closed)
+        return [frame async for frame in stream]
+
+    frames = asyncio.run(scenario())
+    assert "event: session_closed\n" in frames[-1]
+    assert broker.subscriber_count() == 0
+
+
+@pytest.mark.django_db
+def test_session_events_view_closes_ended_session(client):
+    user = User.objects.create_user(username="closedevents", password="pwd")
+    plan = SubscriptionPlan.objects.create(name="31-day", days=31, price=300)
+    Subscription.objects.create(user=user, plan=plan, end_date=timezone.now() + datetime.timedelta(days=31))
+    profile = PatientProfile.objects.create(user=user, national_code="8989898988", phone_number="09120000022")
+    session = ChatSession.objects.create(owner=user, patient=profile, ended_at=timezone.now())
+    client.force_login(user)
+
+    response = client.get(f"/api/session/{session.id}/events/", HTTP_LAST_EVENT_ID="oops")
+
+    async def collect():
+        return [chunk async for chunk in response.streaming_content]
+
+    assert response.status_code == 200
+    body = b"".join(async_to_sync(collect)()).decode()
+    assert "event: session_closed\n" in body
@@ -0,0 +1,101 @@
+import csv
+import datetime
+import gzip
+import io
+import json
+
+import pytest
+import zstandard
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import AsyncClient
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from medagent.archive import archive_sessions
+from medagent.export import export_chunks
+from medagent.models import ChatMessage, ChatSession, PatientProfile, SessionSummary
+from medagent.persistence import save_exchange
+
+User = get_user_model()
+
+
+@pytest.fixture
+def patient(db):
+    user = User.objects.create_user(username="exported", password="pwd")
+    profile = PatientProfile.objects.create(user=user, national_code="3434343434", phone_number="09120000034")
+    for s in range(3):
+        session = ChatSession.objects.create(owner=user, patient=profile, purpose=f"visit {s}")
+        for i in range(2):
+            save_exchange(session, f"سؤال {s}-{i}", f"پاسخ {s}-{i}")
+        SessionSummary.objects.create(session=session, text_summary=f"خلاصه {s}", json_summary={"n": s}, tokens_used=1)
+    other = User.objects.create_user(username="other", password="pwd")
+    other_profile = PatientProfile.objects.create(user=other, national_code="5656565656", phone_number="09120000056")
+    save_exchange(ChatSession.objects.create(owner=other, patient=other_profile), "x", "y")
+    return profile
+
+
+def ndjson(patient_id, **kwargs):
+    return [json.loads(line) for line in b"".join(export_chunks(patient_id, **kwargs)).decode().splitlines()]
+
+
+def test_ndjson_streams_sessions_summaries_and_messages_in_order(patient):
+    records = ndjson(patient.id)
+
+    assert [r["type"] for r in records] == ["session", "summary"] + ["message"] * 4 + (["session", "summary"] + ["message"] * 4) * 2
+    assert {r["patient_id"] for r in records} == {patient.id}
+    assert [r["content"] for r in records[2:6]] == ["سؤال 0-0", "پاسخ 0-0", "سؤال 0-1", "پاسخ 0-1"]
+
+
+def test_archived_sessions_are_exported_without_rehydrating(patient, settings, tmp_path):
+    settings.ARCHIVE_DIR = str(tmp_path)
+    before = ndjson(patient.id)
+    ChatSession.objects.update(ended_at=timezone.now() - datetime.timedelta(days=400))
+    first = ChatSession.objects.filter(patient=patient).order_by("id").first()
+    ChatSession.objects.exclude(id=first.id).update(ended_at=None)
+    archive_sessions(days=30)
+
+    assert ndjson(patient.id)[2:6] == before[2:6]
+    assert not ChatMessage.objects.filter(session=first).exists()
+
+
+def test_compressed_csv_and_endpoint(patient):
+    raw = b"".join(export_chunks(patient.id, fmt="csv", compression="gzip"))
+    rows = list(csv.DictReader(io.StringIO(gzip.decompress(raw).decode())))
+    assert len(rows) == 18 and rows[1]["content"] == "خلاصه 0"
+
+    admin = User.objects.create_user(username="compliance", password="pwd", is_staff=True)
+    client = APIClient()
+    client.force_authenticate(user=admin)
+    response = client.get(f"/api/patient/{patient.id}/export/?fmt=ndjson&compression=zstd")
+    assert response.status_code == 200 and response.streaming
+    body = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(b"".join(response.streaming_content))).read()
+    assert len(body.decode().splitlines()) == 18
+
+    client.force_authenticate(user=patient.user)
+    assert client.get(f"/api/patient/{patient.id}/export/").status_code == 403
+
+
+def test_endpoint_streams_asynchronously_under_asgi_with_bearer_token(patient):
+    User.objects.create_user(username="auditor", password="pwd", is_staff=True)
+    access = APIClient().post("/api/auth/token/", {"username": "auditor", "password": "pwd"}).data["access"]
+
+    async def fetch():
+        response = await AsyncClient().get(
+            f"/api/patient/{patient.id}/export/", headers={"authorization": f"Bearer {access}"},
+        )
+        return response, [block async for block in response.streaming_content]
+
+    # بدون بارگذاری کاربر از پایگاه داده، claim توکن دسترسی staff را می‌دهد
+    response, blocks = async_to_sync(fetch)()
+    assert response.status_code == 200 and response.is_async
+    assert len(b"".join(blocks).decode().splitlines()) == 18
+
+
+def test_command_writes_file(patient, tmp_path):
+    out = tmp_path / "export.ndjson"
+    err = io.StringIO()
+    call_command("export_transcripts", patient=patient.id, output=str(out), stderr=err)
+    assert len(out.read_text().splitlines()) == 18
+    assert "Exported 18 rows" in err.getvalue()
@@ -0,0 +1,101 @@
+import io
+
+import zstandard
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+
+from medagent.fields import ZSTD_MAGIC, load_dictionaries, reset_dictionaries
+from medagent.models import ChatMessage, ChatSession, PatientProfile, PatientSummary
+from medagent.serializers import ChatMessageSerializer, PatientSummarySerializer
+
+User = get_user_model()
+
+SYMPTOMS = ["سردرد", "تب", "سرفه", "درد معده", "بی‌خوابی", "حالت تهوع", "درد قفسه سینه", "سرگیجه"]
+
+
+@pytest.fixture
+def session(db):
+    user = User.objects.create_user(username="zstd", password="pwd")
+    profile = PatientProfile.objects.create(user=user, national_code="9090909090", phone_number="09120000090")
+    return ChatSession.objects.create(owner=user, patient=profile)
+
+
+@pytest.fixture
+def dictionary_dir(settings, tmp_path):
+    settings.ZSTD_DICTIONARY_DIR = str(tmp_path)
+    reset_dictionaries()
+    yield tmp_path
+    reset_dictionaries()
+
+
+def stored(table, column, pk):
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT {column} FROM {table} WHERE id = %s", [pk])
+        return bytes(cursor.fetchone()[0])
+
+
+def test_short_values_are_stored_raw_and_long_ones_compressed(session, dictionary_dir):
+    short = ChatMessage.objects.create(session=session, role="owner", content="سلام")
+    long = ChatMessage.objects.create(session=session, role="assistant", content="توصیه می‌شود آب کافی بنوشید. " * 20)
+
+    assert stored("medagent_chatmessage", "content", short.id) == "سلام".encode()
+    assert stored("medagent_chatmessage", "content", long.id).startswith(ZSTD_MAGIC)
+    assert ChatMessage.objects.get(id=long.id).content == long.content
+    assert ChatMessageSerializer(ChatMessage.objects.get(id=long.id)).data["content"] == long.content
+    assert long.history.first().content == long.content
+
+
+def test_json_round_trip_and_legacy_text_rows(session, dictionary_dir):
+    data = {"notes": "بیمار سابقه‌ی میگرن دارد. " * 20, "visits": [1, 2, 3]}
+    summary = PatientSummary.objects.create(patient=session.patient, json_data=data)
+
+    assert stored("medagent_patientsummary", "json_data", summary.id).startswith(ZSTD_MAGIC)
+    assert PatientSummary.objects.values_list("json_data", flat=True).get(id=summary.id) == data
+    assert PatientSummarySerializer(PatientSummary.objects.get(id=summary.id)).data["json_data"] == data
+
+    # ردیف‌هایی که پیش از فشرده‌سازی به‌صورت متن ذخیره شده‌اند
+    with connection.cursor() as cursor:
+        cursor.execute("UPDATE medagent_patientsummary SET json_data = %s WHERE id = %s", ['{"old": true}', summary.id])
+    assert PatientSummary.objects.get(id=summary.id).json_data == {"old": True}
+
+
+def test_trained_dictionary_compresses_short_messages(session, dictionary_dir):
+    for i in range(400):
+        ChatMessage.objects.create(
+            session=session, role="owner",
+            content=f"سلام دکتر، من از {i % 9} روز پیش {SYMPTOMS[i % 8]} دارم و {SYMPTOMS[i % 5]} هم دارم. چه کار کنم؟",
+        )
+    call_command("train_zstd_dictionary", size=4096, stdout=io.StringIO())
+    message = ChatMessage.objects.create(
+        session=session, role="owner", content="سلام دکتر، من از دو روز پیش تب دارم و سرفه هم دارم. چه کار کنم؟",
+    )
+
+    raw = stored("medagent_chatmessage", "content", message.id)
+    assert zstandard.get_frame_parameters(raw).dict_id != 0
+    assert len(raw) < len(message.content.encode()) / 2
+
+    call_command("train_zstd_dictionary", size=2048, stdout=io.StringIO())
+    assert ChatMessage.objects.get(id=message.id).content == message.content
+    assert len(list(dictionary_dir.glob("chat.*.zdict"))) == 2
+
+
+def test_dictionary_trained_by_another_process_is_picked_up(session, dictionary_dir):
+    samples = [f"{SYMPTOMS[i % 8]} از {i % 9} روز پیش و {SYMPTOMS[i % 5]}".encode() for i in range(400)]
+    message = ChatMessage.objects.create(session=session, role="owner", content="placeholder")
+    # دیکشنری‌های این پروسس وقتی پوشه هنوز خالی است بارگذاری می‌شوند
+    assert load_dictionaries() == ({}, {})
+
+    dictionary = zstandard.train_dictionary(1024, samples)
+    (dictionary_dir / "chat.other.zdict").write_bytes(dictionary.as_bytes())
+    text = "سردرد از دو روز پیش و تب"
+    frame = zstandard.ZstdCompressor(dict_data=dictionary).compress(text.encode())
+    with connection.cursor() as cursor:
+        cursor.execute("UPDATE medagent_chatmessage SET content = %s WHERE id = %s", [frame, message.id])
+    assert ChatMessage.objects.get(id=message.id).content == text
+
+    (dictionary_dir / "chat.other.zdict").unlink()
+    reset_dictionaries()
+    with pytest.raises(ValueError):
+        ChatMessage.objects.get(id=message.id)
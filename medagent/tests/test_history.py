@@ -0,0 +1,49 @@
+import pytest
+from django.contrib.auth import get_user_model
+
+from medagent.models import PatientProfile, PatientSummary
+
+User = get_user_model()
+
+
+@pytest.fixture
+def summary(db, settings):
+    settings.HISTORY_CHECKPOINT_EVERY = 4
+    user = User.objects.create_user(username="chronic", password="pwd")
+    profile = PatientProfile.objects.create(user=user, national_code="7070707070", phone_number="09120000070")
+    return PatientSummary.objects.create(patient=profile, json_data={"sessions": []})
+
+
+def grow(summary, versions):
+    expected = [dict(summary.json_data)]
+    for i in range(versions):
+        summary.json_data = {"sessions": summary.json_data["sessions"] + [f"visit {i}"], "last": i}
+        summary.save()
+        expected.append(summary.json_data)
+    return expected
+
+
+def test_history_stores_patches_between_checkpoints(summary):
+    expected = grow(summary, 9)
+    records = list(summary.history.order_by("history_id"))
+
+    assert [r.json_data_checkpoint is not None for r in records] == [True, False, False, False] * 2 + [True, False]
+    assert records[1].json_data_patch == [
+        {"op": "add", "path": "/last", "value": 0},
+        {"op": "add", "path": "/sessions/0", "value": "visit 0"},
+    ]
+    assert [r.instance.json_data for r in records] == expected
+    assert summary.history.as_of(records[6].history_date).json_data == expected[6]
+
+
+def test_revert_from_history_creates_a_new_version(summary):
+    expected = grow(summary, 5)
+    # همان کاری که دکمه‌ی revert در SimpleHistoryAdmin انجام می‌دهد
+    old = summary.history.order_by("history_id")[2]
+    old.instance.save()
+
+    summary.refresh_from_db()
+    latest = summary.history.order_by("-history_id").first()
+    assert summary.json_data == expected[2]
+    assert latest.json_data_base == summary.history.order_by("-history_id")[1].history_id
+    assert latest.delta_document() == expected[2]
@@ -0,0 +1,144 @@
+import datetime
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from rest_framework.response import Response
+from rest_framework.test import APIClient
+
+from medagent.apps import check_shared_cache
+from medagent.idempotency import idempotent
+from medagent.models import PatientProfile, ChatSession, ChatMessage, SessionSummary
+from sub.models import SubscriptionPlan, Subscription
+
+User = get_user_model()
+
+
+@pytest.fixture
+def owner_client(db):
+    user = User.objects.create_user(username="idemuser", password="pwd")
+    plan = SubscriptionPlan.objects.create(name="31-day", days=31, price=300)
+    Subscription.objects.create(user=user, plan=plan, end_date=timezone.now() + datetime.timedelta(days=31))
+    profile = PatientProfile.objects.create(user=user, national_code="6060606060", phone_number="09120000060")
+    client = APIClient()
+    client.force_authenticate(user=user)
+    return client, ChatSession.objects.create(owner=user, patient=profile)
+
+
+def test_retried_post_message_runs_agent_once(owner_client, monkeypatch):
+    client, session = owner_client
+    calls = []
+    monkeypatch.setattr("medagent.agent_setup.agent.run", lambda msg: calls.append(msg) or "reply")
+    url = f"/api/session/{session.id}/message/"
+
+    first = client.post(url, {"session": session.id, "content": "سلام"}, HTTP_IDEMPOTENCY_KEY="k1")
+    retry = client.post(url, {"session": session.id, "content": "سلام"}, HTTP_IDEMPOTENCY_KEY="k1")
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.data == first.data
+    assert retry["Idempotent-Replayed"] == "true"
+    assert calls == ["سلام"]
+    assert ChatMessage.objects.filter(session=session).count() == 2
+
+
+def test_failed_request_with_key_is_stored_once_on_retry(owner_client, monkeypatch):
+    client, session = owner_client
+    replies = iter([RuntimeError("agent down"), "reply"])
+
+    def flaky_agent(msg):
+        reply = next(replies)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    monkeypatch.setattr("medagent.agent_setup.agent.run", flaky_agent)
+    url = f"/api/session/{session.id}/message/"
+
+    with pytest.raises(RuntimeError):
+        client.post(url, {"session": session.id, "content": "سلام"}, HTTP_IDEMPOTENCY_KEY="k3")
+    assert not ChatMessage.objects.filter(session=session).exists()
+    assert client.post(url, {"session": session.id, "content": "سلام"}, HTTP_IDEMPOTENCY_KEY="k3").status_code == 200
+    roles = list(ChatMessage.objects.filter(session=session).order_by("id").values_list("role", flat=True))
+    assert roles == ["owner", "assistant"]
+
+
+def test_key_reused_for_other_payload_is_rejected(owner_client):
+    client, session = owner_client
+    url = f"/api/session/{session.id}/message/"
+    assert client.post(url, {"session": session.id, "content": "a"}, HTTP_IDEMPOTENCY_KEY="k2").status_code == 200
+    assert client.post(url, {"session": session.id, "content": "b"}, HTTP_IDEMPOTENCY_KEY="k2").status_code == 422
+
+
+def test_retried_end_session_summarizes_once(owner_client):
+    client, session = owner_client
+    ChatMessage.objects.create(session=session, role="owner", content="hi")
+    for _ in range(2):
+        response = client.patch("/api/session/end/", {"session_id": session.id}, HTTP_IDEMPOTENCY_KEY="end-1")
+        assert response.status_code == 200
+    assert SessionSummary.objects.filter(session=session).count() == 1
+
+
+class _SlowView:
+    def __init__(self):
+        self.calls = 0
+
+    @idempotent
+    def post(self, request):
+        self.calls += 1
+        time.sleep(0.2)
+        if request.data.get("fail"):
+            return Response({"error": "boom"}, status=503)
+        return Response({"n": self.calls}, status=201)
+
+
+def _request(**data):
+    return SimpleNamespace(
+        META={"HTTP_IDEMPOTENCY_KEY": "same"}, user=SimpleNamespace(id=1),
+        method="POST", path="/x/", data=data,
+    )
+
+
+def test_concurrent_duplicate_waits_for_in_flight_request():
+    view, results = _SlowView(), []
+    threads = [threading.Thread(target=lambda: results.append(view.post(_request()))) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert view.calls == 1
+    assert [r.data for r in results] == [{"n": 1}] * 3
+
+
+def test_server_errors_release_the_key():
+    view = _SlowView()
+    assert view.post(_request(fail=True)).status_code == 503
+    assert view.post(_request(fail=True)).status_code == 503
+    assert view.calls == 2
+
+
+def test_claim_is_refreshed_while_handler_runs(settings):
+    settings.IDEMPOTENCY_LOCK_TTL = 0.1
+    view, results = _SlowView(), []
+    first = threading.Thread(target=lambda: results.append(view.post(_request())))
+    first.start()
+    # ادعای کلید بدون تمدید پیش از پایان اجرای اول (۰٫۲ ثانیه) منقضی می‌شد
+    time.sleep(0.15)
+    results.append(view.post(_request()))
+    first.join(timeout=5)
+
+    assert view.calls == 1
+    assert [r.data for r in results] == [{"n": 1}] * 2
+
+
+def test_local_memory_cache_is_refused_outside_debug(settings):
+    settings.DEBUG = False
+    settings.CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    with pytest.raises(ImproperlyConfigured):
+        check_shared_cache()
+    settings.CACHES = {"default": {"BACKEND": "django_redis.cache.RedisCache", "LOCATION": "redis://cache"}}
+    check_shared_cache()
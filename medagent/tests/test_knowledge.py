@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+from medagent.knowledge import build_index, get_index, split_passages
+from medagent.tools import MedicalKnowledgeTool
+
+METFORMIN = """# متفورمین
+
+متفورمین داروی خط اول دیابت نوع ۲ است.
+
+## عوارض
+
+شایع‌ترین عوارض گوارشی است: تهوع، اسهال و دل‌درد. با غذا مصرف شود.
+"""
+
+ASTHMA = """# آسم
+
+در حمله‌ی حاد آسم، اسپری سالبوتامول استنشاقی تجویز می‌شود.
+"""
+
+
+@pytest.fixture
+def kb(settings, tmp_path):
+    settings.MEDICAL_KB_PATH = str(tmp_path / "kb")
+    settings.MEDICAL_KB_INDEX_DIR = str(tmp_path / "index")
+    (tmp_path / "kb").mkdir()
+    (tmp_path / "kb" / "metformin.md").write_text(METFORMIN, encoding="utf-8")
+    (tmp_path / "kb" / "asthma.txt").write_text(ASTHMA, encoding="utf-8")
+    return tmp_path / "kb"
+
+
+def test_split_passages_keeps_headings():
+    assert [heading for heading, _ in split_passages(METFORMIN, 1000)] == ["متفورمین", "متفورمین › عوارض"]
+
+
+def test_search_ranks_passages_with_persian_normalization(kb):
+    assert get_index() is None
+    stats = build_index()
+    assert (stats["files"], stats["tokenized"], stats["passages"]) == (2, 2, 3)
+
+    results = get_index().search("عوارض متفورمين", 2)
+    assert results[0]["source"] == "metformin.md" and results[0]["heading"] == "متفورمین › عوارض"
+    assert "تهوع" in results[0]["text"]
+    assert get_index().search("سالبوتامول", 5)[0]["source"] == "asthma.txt"
+    assert get_index().search("ناشناخته", 5) == []
+
+
+def test_rebuild_only_tokenizes_changed_files(kb):
+    build_index()
+    assert build_index()["rebuilt"] is False
+
+    first = get_index()
+    (kb / "asthma.txt").write_text(ASTHMA + "\nمونته‌لوکاست برای کنترل طولانی‌مدت است.\n", encoding="utf-8")
+    stats = build_index()
+    assert (stats["rebuilt"], stats["tokenized"]) == (True, 1)
+    assert get_index() is not first
+    assert get_index().search("مونته لوکاست", 1)[0]["source"] == "asthma.txt"
+
+    (kb / "metformin.md").unlink()
+    build_index()
+    assert get_index().search("متفورمین", 5) == []
+
+
+def test_tool_returns_json_passages(kb):
+    tool = MedicalKnowledgeTool()
+    assert "ساخته نشده" in tool._run("آسم")
+    build_index()
+    passages = json.loads(tool._run("حمله حاد آسم"))
+    assert passages[0]["source"] == "asthma.txt" and "score" not in passages[0]
@@ -0,0 +1,91 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from rest_framework.exceptions import Throttled
+
+from medagent.llm_scheduler import (
+    BATCH, INTERACTIVE, SUMMARY, LLMOverloaded, LLMScheduler, llm_work,
+)
+
+
+@pytest.fixture
+def scheduler(settings):
+    settings.LLM_MAX_CONCURRENCY = 1
+    settings.LLM_MAX_PENDING_PER_USER = 10
+    settings.LLM_QUEUE_BUDGET = {"interactive": 5, "summary": 5, "batch": 5}
+    return LLMScheduler()
+
+
+def _queue_calls(scheduler, work, order):
+    """Hold the only slot, queue ``work`` [(priority, user, label)], then release."""
+    threads = []
+    with scheduler.slot():
+        for priority, user, label in work:
+            def call(priority=priority, user=user, label=label):
+                with llm_work(priority, user), scheduler.slot():
+                    order.append(label)
+            thread = threading.Thread(target=call)
+            thread.start()
+            threads.append(thread)
+            # صبر تا درخواست واقعاً در صف قرار بگیرد تا ترتیب ورود قطعی باشد
+            while sum(c["queued"] for c in scheduler.metrics()["classes"].values()) < len(threads):
+                time.sleep(0.001)
+    for thread in threads:
+        thread.join(timeout=5)
+
+
+def test_higher_priority_is_served_first(scheduler):
+    order = []
+    _queue_calls(scheduler, [(BATCH, 1, "batch"), (SUMMARY, 2, "summary"), (INTERACTIVE, 3, "chat")], order)
+    assert order == ["chat", "summary", "batch"]
+
+
+def test_users_are_served_round_robin_within_a_class(scheduler):
+    order = []
+    work = [(SUMMARY, "bulk", f"bulk{i}") for i in range(3)] + [(SUMMARY, "other", "other")]
+    _queue_calls(scheduler, work, order)
+    assert order == ["bulk0", "other", "bulk1", "bulk2"]
+
+
+def test_sheds_when_expected_wait_exceeds_budget(scheduler, settings):
+    settings.LLM_QUEUE_BUDGET = {"interactive": 0.5, "summary": 0.5, "batch": 0.5}
+    with scheduler.slot():
+        with pytest.raises(LLMOverloaded) as exc:
+            with scheduler.slot():
+                pass
+    assert exc.value.status_code == 503
+    assert scheduler.metrics()["classes"]["batch"]["shed"] == 1
+
+
+def test_sheds_per_user_backlog_with_429(scheduler, settings):
+    settings.LLM_MAX_PENDING_PER_USER = 0
+    with scheduler.slot():
+        with llm_work(INTERACTIVE, 7), pytest.raises(Throttled):
+            with scheduler.slot():
+                pass
+
+
+def test_async_waiters_are_woken_and_timeouts_withdraw(scheduler, settings):
+    async def scenario():
+        async with scheduler.aslot():
+            waiter = asyncio.ensure_future(_enter(scheduler))
+            await asyncio.sleep(0.01)
+            assert scheduler.metrics()["classes"]["batch"]["queued"] == 1
+        await waiter
+
+        settings.LLM_QUEUE_BUDGET = {"interactive": 2, "summary": 2, "batch": 0.05}
+        scheduler._service_time = 0.01
+        async with scheduler.aslot():
+            with pytest.raises(LLMOverloaded):
+                await _enter(scheduler)
+
+    async def _enter(scheduler):
+        async with scheduler.aslot():
+            pass
+
+    asyncio.run(scenario())
+    metrics = scheduler.metrics()
+    assert metrics["active"] == 0
+    assert metrics["classes"]["batch"]["queued"] == 0
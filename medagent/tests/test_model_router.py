@@ -0,0 +1,60 @@
+import pytest
+
+from medagent.model_router import ModelRouter, estimate_tokens
+
+
+@pytest.fixture
+def router(settings):
+    settings.LLM_ROUTES = {"chat": ["fast", "big"], "summary": ["fast", "big"], "vision": ["eye"]}
+    settings.LLM_MODELS = {
+        "fast": {"max_prompt_tokens": 100, "latency_slo": 1.0},
+        "big": {"max_prompt_tokens": 10000, "latency_slo": 5.0},
+        "eye": {"max_prompt_tokens": 1000},
+    }
+    settings.LLM_ROUTER_WINDOW = 60
+    settings.LLM_ROUTER_MIN_SAMPLES = 3
+    settings.LLM_ROUTER_MAX_ERROR_RATE = 0.5
+    return ModelRouter()
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("x" * 30) == 14
+    assert estimate_tokens([{"role": "user", "content": "abc"}, {"role": "assistant", "content": "def"}]) == 10
+
+
+def test_large_prompts_skip_small_context_models(router):
+    assert router.choose("chat", 50) == "fast"
+    assert router.choose("chat", 500) == "big"
+    assert router.choose("chat", 50000) == "big"
+
+
+def test_fails_over_on_errors_and_slowness(router):
+    for _ in range(3):
+        router.observe("fast", 0.1, ok=False)
+    assert router.choose("chat", 10) == "big"
+
+    router = ModelRouter()
+    for _ in range(3):
+        router.observe("fast", 2.5, ok=True)
+    assert router.choose("summary", 10) == "big"
+
+
+def test_recovers_when_samples_leave_the_window(router, settings):
+    for _ in range(3):
+        router.observe("fast", 0.1, ok=False)
+    settings.LLM_ROUTER_WINDOW = 0
+    assert router.choose("chat", 10) == "fast"
+
+
+def test_metrics_report_decisions_and_outcomes(router):
+    router.observe("fast", 0.2, ok=True)
+    router.choose("chat", 10)
+    for _ in range(3):
+        router.observe("eye", 0.1, ok=False)
+    router.choose("vision", 10)
+
+    metrics = router.metrics()
+    assert metrics["models"]["fast"]["latency_mean"] == pytest.approx(0.2)
+    assert metrics["models"]["eye"]["healthy"] is False
+    assert {"task": "chat", "model": "fast", "reason": "primary", "count": 1} in metrics["decisions"]
+    assert {"task": "vision", "model": "eye", "reason": "degraded", "count": 1} in metrics["decisions"]
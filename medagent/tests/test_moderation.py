@@ -0,0 +1,187 @@
+import asyncio
+import threading
+
+import pytest
+
+from medagent.moderation import amoderated_reply, moderated_reply
+from medagent.persistence import SANITIZED_PLACEHOLDER
+from medagent.tools import GatedTool
+
+
+@pytest.fixture(params=[True, False], ids=["pipelined", "serial"])
+def pipelined(request, settings):
+    settings.PIPELINED_MODERATION = request.param
+    return request.param
+
+
+def test_clean_message_uses_first_reply(pipelined, monkeypatch):
+    monkeypatch.setattr("medagent.tools.ProfanityCheckTool._run", lambda self, text: "False")
+    calls = []
+
+    def run(text):
+        calls.append(text)
+        return f"reply to {text}"
+
+    assert moderated_reply("سلام", run) == ("سلام", "reply to سلام")
+    assert calls == ["سلام"]
+
+
+def test_flagged_message_replies_to_placeholder(pipelined, monkeypatch):
+    monkeypatch.setattr("medagent.tools.ProfanityCheckTool._run", lambda self, text: "True")
+
+    content, reply = moderated_reply("bad", lambda text: f"reply to {text}")
+
+    assert content == SANITIZED_PLACEHOLDER
+    assert reply == f"reply to {SANITIZED_PLACEHOLDER}"
+
+
+def test_pipelined_runs_agent_during_check(settings, monkeypatch):
+    settings.PIPELINED_MODERATION = True
+    agent_started = threading.Event()
+
+    def check(self, text):
+        # بررسی تا شروع عامل منتظر می‌ماند؛ در حالت سریالی این بن‌بست است
+        assert agent_started.wait(timeout=5)
+        return "False"
+
+    def run(text):
+        agent_started.set()
+        return "ok"
+
+    monkeypatch.setattr("medagent.tools.ProfanityCheckTool._run", check)
+    assert moderated_reply("hi", run) == ("hi", "ok")
+
+
+def test_async_flagged_cancels_speculative_run(settings, monkeypatch):
+    settings.PIPELINED_MODERATION = True
+    cancelled = []
+
+    async def check(self, text):
+        await asyncio.sleep(0)
+        return "True"
+
+    async def arun(text):
+        if text != SANITIZED_PLACEHOLDER:
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(text)
+                raise
+        return f"reply to {text}"
+
+    monkeypatch.setattr("medagent.tools.ProfanityCheckTool._arun", check)
+
+    async def scenario():
+        result = await amoderated_reply("bad", arun)
+        await asyncio.sleep(0)
+        return result
+
+    content, reply = asyncio.run(scenario())
+
+    assert content == SANITIZED_PLACEHOLDER
+    assert reply == f"reply to {SANITIZED_PLACEHOLDER}"
+    assert cancelled == ["bad"]
+
+
+class _RecordingTool(GatedTool):
+    name: str = "record"
+    description: str = "records its input"
+    calls: list = []
+
+    def _run(self, text: str) -> str:
+        self.calls.append(text)
+        return "ok"
+
+    async def _arun(self, text: str) -> str:
+        return self._run(text)
+
+
+@pytest.mark.parametrize("verdict", ["True", "False"])
+def test_speculative_tool_calls_wait_for_verdict(settings, monkeypatch, verdict):
+    settings.PIPELINED_MODERATION = True
+    tool = _RecordingTool(calls=[])
+    speculative_started = threading.Event()
+    speculative_done = threading.Event()
+
+    def check(self, text):
+        assert speculative_started.wait(timeout=5)
+        # ابزار پیش از اعلام نتیجه اجرا نمی‌شود
+        assert not tool.calls
+        return verdict
+
+    def run(text):
+        if text == SANITIZED_PLACEHOLDER:
+            return "placeholder reply"
+        speculative_started.set()
+        try:
+            tool.run(text)
+            return "speculative reply"
+        finally:
+            speculative_done.set()
+
+    monkeypatch.setattr("medagent.tools.ProfanityCheckTool._run", check)
+    content, reply = moderated_reply("maybe bad", run)
+
+    if verdict == "True":
+        assert (content, reply) == (SANITIZED_PLACEHOLDER, "placeholder reply")
+        assert tool.calls == []
+        # اجرای حدسی پیش از بازگشت تمام شده و جای pool را آزاد کرده است
+        assert speculative_done.is_set()
+    else:
+        assert (content, reply) == ("maybe bad", "speculative reply")
+        assert tool.calls == ["maybe bad"]
+
+
+def test_async_speculative_tool_calls_wait_for_verdict(settings, monkeypatch):
+    settings.PIPELINED_MODERATION = True
+    tool = _RecordingTool(calls=[])
+
+    async def check(self, text):
+        await asyncio.sleep(0.01)
+        assert not tool.calls
+        return "False"
+
+    async def arun(text):
+        await tool.arun(text)
+        return "speculative reply"
+
+    monkeypatch.setattr("medagent.tools.ProfanityCheckTool._arun", check)
+    assert asyncio.run(amoderated_reply("hi", arun)) == ("hi", "speculative reply")
+    assert tool.calls == ["hi"]
+
+
+def test_saturated_pool_falls_back_to_serial(settings, monkeypatch):
+    settings.PIPELINED_MODERATION = True
+    settings.PIPELINED_MODERATION_WORKERS = 1
+    # pool یک‌نخی تازه؛ pool اصلی پس از تست بازگردانده می‌شود
+    for name in ("_executor", "_executor_slots", "_executor_pid"):
+        monkeypatch.setattr(f"medagent.moderation.{name}", None)
+    monkeypatch.setattr("medagent.tools.ProfanityCheckTool._run", lambda self, text: "False")
+    busy, release = threading.Event(), threading.Event()
+    order = []
+
+    def blocking_run(text):
+        busy.set()
+        assert release.wait(timeout=5)
+        return "first"
+
+    first = threading.Thread(target=moderated_reply, args=("one", blocking_run))
+    first.start()
+    assert busy.wait(timeout=5)
+
+    def check(self, text):
+        order.append("check")
+        return "False"
+
+    def run(text):
+        # در مسیر ترتیبی عامل فقط پس از بررسی و در همین نخ اجرا می‌شود
+        order.append(("run", threading.current_thread() is threading.main_thread()))
+        return "second"
+
+    monkeypatch.setattr("medagent.tools.ProfanityCheckTool._run", check)
+    try:
+        assert moderated_reply("two", run) == ("two", "second")
+    finally:
+        release.set()
+        first.join(timeout=5)
+    assert order == ["check", ("run", True)]
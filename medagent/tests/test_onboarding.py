@@ -0,0 +1,100 @@
+import io
+import json
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from rest_framework.test import APIClient
+
+from medagent.models import PatientProfile
+from medagent.onboarding import normalize_phone, onboard, read_rows, valid_national_code
+
+User = get_user_model()
+
+CSV = (
+    "national_code,phone_number,first_name\n"
+    "0012345679,09121234567,علی\n"
+    "۱۲۳۴۵۶۷۸۹۱,+98 912 765 4321,مریم\n"
+    "0012345679,09121234567,تکراری\n"
+    "1234567890,09121111111,\n"
+    "9876543210,12345,\n"
+    "5556667772,00989350000000,\n"
+)
+
+
+def test_validation_helpers():
+    assert valid_national_code("0012345679")
+    assert not valid_national_code("0012345678")
+    assert not valid_national_code("1111111111")
+    assert normalize_phone("۰۹۱۲ ۱۲۳ ۴۵۶۷") == "09121234567"
+    assert normalize_phone("9121234567") == "09121234567"
+    assert normalize_phone("02112345678") is None
+
+
+def test_onboard_creates_valid_rows_and_reports_the_rest(db):
+    report = onboard(read_rows(io.StringIO(CSV), "csv"), batch_size=2)
+
+    assert (report.rows, report.created, report.duplicates, report.invalid) == (6, 3, 1, 2)
+    assert [e["line"] for e in report.errors] == [5, 6]
+    profile = PatientProfile.objects.select_related("user").get(national_code="1234567891")
+    assert profile.phone_number == "09127654321"
+    assert profile.user.username == "1234567891" and profile.user.first_name == "مریم"
+    assert not profile.user.has_usable_password()
+
+    again = onboard(read_rows(io.StringIO(CSV), "csv"))
+    assert (again.created, again.existing) == (0, 3)
+    assert PatientProfile.objects.count() == 3
+
+
+def test_username_conflicts_are_invalid_rows(db):
+    User.objects.create_user(username="taken", password="pwd")
+    lines = [
+        {"national_code": "0012345679", "phone_number": "09121234567", "username": "taken"},
+        {"national_code": "1234567891", "phone_number": "09121234567"},
+    ]
+    stream = io.BytesIO("\n".join(json.dumps(line) for line in lines).encode() + b"\n{broken\n")
+    report = onboard(read_rows(stream, "jsonl"))
+
+    assert report.created == 1
+    assert sorted(report.errors, key=lambda e: e["line"]) == [
+        {"line": 1, "error": "username already taken"},
+        {"line": 3, "error": "invalid national_code"},
+    ]
+
+
+def test_command_resumes_from_checkpoint(db, tmp_path):
+    path = tmp_path / "clinic.csv"
+    path.write_text(CSV)
+    (tmp_path / "clinic.csv.checkpoint").write_text("1")
+    out = io.StringIO()
+    call_command("onboard_patients", str(path), "--resume", "--batch-size", "2", stdout=out, stderr=io.StringIO())
+
+    # ردیف ۱ رد شد، پس تکرار آن در ردیف ۴ دیگر تکراری نیست
+    assert "Read 5 rows from row 1: 3 created, 0 already onboarded, 0 duplicates" in out.getvalue()
+    assert PatientProfile.objects.get(national_code="0012345679").user.first_name == "تکراری"
+    assert (tmp_path / "clinic.csv.checkpoint").read_text() == "6"
+
+
+def test_endpoint_is_staff_only(db):
+    client = APIClient()
+    client.force_authenticate(user=User.objects.create_user(username="clinic", password="pwd"))
+    upload = SimpleUploadedFile("clinic.csv", CSV.encode())
+    assert client.post("/api/patient/onboard/", {"file": upload}).status_code == 403
+
+    client.force_authenticate(user=User.objects.create_user(username="ops", password="pwd", is_staff=True))
+    response = client.post("/api/patient/onboard/", {"file": SimpleUploadedFile("clinic.csv", CSV.encode())})
+    assert response.status_code == 201
+    assert response.json()["created"] == 3
+
+
+def test_endpoint_accepts_staff_bearer_tokens(db):
+    User.objects.create_user(username="clinic", password="pwd")
+    User.objects.create_user(username="ops", password="pwd", is_staff=True)
+    client = APIClient()
+
+    for username, status in (("clinic", 403), ("ops", 201)):
+        access = client.post("/api/auth/token/", {"username": username, "password": "pwd"}).data["access"]
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+        upload = SimpleUploadedFile("clinic.csv", CSV.encode())
+        assert client.post("/api/patient/onboard/", {"file": upload}).status_code == status
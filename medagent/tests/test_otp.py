@@ -0,0 +1,86 @@
+import datetime
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from freezegun import freeze_time
+from rest_framework.exceptions import Throttled
+
+from medagent.models import PatientProfile, OTPVerification
+from medagent.otp import CacheOTPBackend, DatabaseOTPBackend
+
+User = get_user_model()
+
+
+@pytest.fixture
+def patient(db):
+    user = User.objects.create_user(username="otppatient", password="pwd")
+    return PatientProfile.objects.create(user=user, national_code="6767676767", phone_number="09120000018")
+
+
+@pytest.mark.django_db
+def test_cache_backend_single_use_and_expiry(patient):
+    backend = CacheOTPBackend()
+    backend.issue(patient, "111111")
+    assert not backend.verify(patient, "222222")
+    assert backend.verify(patient, "111111")
+    # کد پس از استفاده باطل می‌شود
+    assert not backend.verify(patient, "111111")
+
+    backend.issue(patient, "333333")
+    with freeze_time(timezone.now() + datetime.timedelta(minutes=11)):
+        assert not backend.verify(patient, "333333")
+
+
+@pytest.mark.django_db
+def test_cache_backend_limits_attempts(patient, settings):
+    settings.OTP_MAX_ATTEMPTS = 2
+    backend = CacheOTPBackend()
+    backend.issue(patient, "111111")
+    assert not backend.verify(patient, "000000")
+    assert not backend.verify(patient, "000001")
+    assert not backend.verify(patient, "111111")
+
+
+@pytest.mark.django_db
+def test_send_rate_limits(patient, settings):
+    settings.OTP_PATIENT_RATE = (2, 600)
+    backend = CacheOTPBackend()
+    backend.issue(patient, "111111", doctor_id=1)
+    backend.issue(patient, "111111", doctor_id=1)
+    with pytest.raises(Throttled):
+        backend.issue(patient, "111111", doctor_id=1)
+
+
+@pytest.mark.django_db
+def test_database_backend_and_purge(patient):
+    backend = DatabaseOTPBackend()
+    backend.issue(patient, "111111")
+    backend.issue(patient, "222222")
+    assert not backend.verify(patient, "111111")
+    assert backend.verify(patient, "222222")
+    OTPVerification.objects.update(expires_at=timezone.now() - datetime.timedelta(seconds=1))
+    assert OTPVerification.purge_expired(batch_size=1) == 2
+    assert not OTPVerification.objects.exists()
+
+
+@pytest.mark.django_db
+def test_database_backend_single_use(patient):
+    backend = DatabaseOTPBackend()
+    backend.issue(patient, "111111")
+    assert backend.verify(patient, "111111")
+    # ردیف مصرف‌شده دوباره پذیرفته نمی‌شود
+    assert not backend.verify(patient, "111111")
+    assert OTPVerification.objects.get().used_at is not None
+
+
+@pytest.mark.django_db
+def test_attempts_are_counted_per_doctor(patient, settings):
+    settings.OTP_MAX_ATTEMPTS = 2
+    backend = CacheOTPBackend()
+    backend.issue(patient, "111111", doctor_id=1)
+    assert not backend.verify(patient, "000000", doctor_id=1)
+    assert not backend.verify(patient, "000001", doctor_id=1)
+    assert not backend.verify(patient, "111111", doctor_id=1)
+    # حدس‌های نادرست یک پزشک بیمار را برای پزشک دیگر قفل نمی‌کند
+    assert backend.verify(patient, "111111", doctor_id=2)
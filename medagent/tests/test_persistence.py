@@ -0,0 +1,38 @@
+import pytest
+from django.contrib.auth import get_user_model
+
+from medagent.models import PatientProfile, ChatSession, ChatMessage
+from medagent.persistence import save_exchange
+
+User = get_user_model()
+
+
+@pytest.fixture
+def session(db):
+    user = User.objects.create_user(username="persist", password="pwd")
+    profile = PatientProfile.objects.create(user=user, national_code="1313131313", phone_number="09120000014")
+    return ChatSession.objects.create(owner=user, patient=profile)
+
+
+@pytest.mark.django_db
+def test_save_exchange_writes_messages_and_history(session):
+    owner, assistant = save_exchange(session, "سلام", "پاسخ")
+    assert owner.pk and assistant.pk
+    assert list(ChatMessage.objects.filter(session=session).values_list("role", flat=True).order_by("id")) == ["owner", "assistant"]
+    assert ChatMessage.history.filter(session_id=session.id).count() == 2
+
+
+@pytest.mark.django_db
+def test_save_exchange_statement_count(session, django_assert_num_queries):
+    # SAVEPOINT + INSERT پیام‌ها + INSERT تاریخچه + INSERT اسناد جست‌وجو + RELEASE
+    with django_assert_num_queries(5):
+        save_exchange(session, "سلام", "پاسخ")
+
+
+@pytest.mark.django_db
+def test_save_exchange_skips_profanity_signal(session, monkeypatch):
+    calls = []
+    monkeypatch.setattr("medagent.tools.ProfanityCheckTool._run", lambda self, text: calls.append(text) or "True")
+    save_exchange(session, "متن بررسی‌شده", "پاسخ")
+    assert calls == []
+    assert ChatMessage.objects.get(session=session, role="owner").content == "متن بررسی‌شده"
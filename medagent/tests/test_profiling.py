@@ -0,0 +1,115 @@
+import asyncio
+import datetime
+import pstats
+import time
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from medagent.profiling import ProfilingMiddleware, metrics, outbound
+from sub.models import Subscription, SubscriptionPlan
+
+User = get_user_model()
+ROUTE = (("route", "api/search/"), ("method", "GET"))
+
+
+@pytest.fixture(autouse=True)
+def fresh_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+@pytest.fixture
+def client(db):
+    user = User.objects.create_user(username="profiled", password="pwd", is_staff=True)
+    plan = SubscriptionPlan.objects.create(name="31-day", days=31, price=0)
+    Subscription.objects.create(user=user, plan=plan, end_date=timezone.now() + datetime.timedelta(days=31))
+    client = APIClient()
+    client.force_authenticate(user=user)
+    return client
+
+
+def test_requests_are_recorded_per_route(client):
+    for _ in range(3):
+        assert client.get("/api/search/", {"q": "سرفه"}).status_code == 200
+    histograms, requests = metrics.snapshot()
+
+    assert requests[(*ROUTE, ("status", "200"))] == 3
+    assert histograms[("request_seconds", ROUTE)][3] == 3
+    _, _, queries, count = histograms[("db_queries", ROUTE)]
+    assert count == 3 and queries >= 3
+    assert histograms[("render_seconds", ROUTE)][3] == 3
+
+
+def test_outbound_time_sync_and_async():
+    def view(request):
+        with outbound("talkbot"):
+            time.sleep(0.01)
+        return HttpResponse()
+
+    async def aview(request):
+        with outbound("kavenegar"):
+            await asyncio.sleep(0.01)
+        return HttpResponse()
+
+    ProfilingMiddleware(view)(RequestFactory().get("/x"))
+    asyncio.run(ProfilingMiddleware(aview)(RequestFactory().get("/x")))
+    histograms, _ = metrics.snapshot()
+
+    unmatched = (("route", "<unmatched>"), ("method", "GET"))
+    for service in ("talkbot", "kavenegar"):
+        _, _, seconds, count = histograms[("outbound_seconds", (*unmatched, ("service", service)))]
+        assert count == 1 and seconds >= 0.01
+    with outbound("talkbot"):
+        pass  # بیرون از درخواست چیزی ثبت نمی‌شود
+
+
+def test_metrics_endpoint_access_and_format(client, settings):
+    client.get("/api/search/", {"q": "سرفه"})
+    body = client.get("/metrics").content.decode()
+    assert 'medagent_request_seconds_bucket{route="api/search/",method="GET",le="+Inf"} 1' in body
+    assert 'medagent_llm_queued{class="interactive"}' in body
+
+    settings.METRICS_TOKEN = "scrape"
+    anonymous = APIClient()
+    assert anonymous.get("/metrics").status_code in (401, 403)
+    assert anonymous.get("/metrics", HTTP_X_METRICS_TOKEN="wrong").status_code in (401, 403)
+    assert anonymous.get("/metrics", HTTP_X_METRICS_TOKEN="scrape").status_code == 200
+
+
+def test_profile_header_dumps_pstats(client, settings, tmp_path):
+    settings.PROFILING_TOKEN = "deep"
+    settings.PROFILING_DIR = str(tmp_path)
+    client.get("/api/search/", {"q": "سرفه"}, HTTP_X_PROFILE="nope")
+    assert not list(tmp_path.iterdir())
+
+    client.get("/api/search/", {"q": "سرفه"}, HTTP_X_PROFILE="deep")
+    dumps = list(tmp_path.glob("*.prof"))
+    assert len(dumps) == 1 and "GET" in dumps[0].name
+    assert pstats.Stats(str(dumps[0])).total_calls > 0
+
+
+def test_non_ascii_token_headers_are_rejected_not_errors(client, settings, tmp_path):
+    settings.PROFILING_TOKEN = "deep"
+    settings.PROFILING_DIR = str(tmp_path)
+    settings.METRICS_TOKEN = "scrape"
+    # compare_digest روی str غیر ASCII خطای TypeError می‌داد
+    assert client.get("/api/search/", {"q": "سرفه"}, HTTP_X_PROFILE="é").status_code == 200
+    assert not list(tmp_path.iterdir())
+    assert APIClient().get("/metrics", HTTP_X_METRICS_TOKEN="é").status_code in (401, 403)
+
+
+def test_metrics_accepts_staff_bearer_tokens(db):
+    User.objects.create_user(username="viewer", password="pwd")
+    User.objects.create_user(username="operator", password="pwd", is_staff=True)
+    client = APIClient()
+
+    for username, status in (("viewer", 403), ("operator", 200)):
+        access = client.post("/api/auth/token/", {"username": username, "password": "pwd"}).data["access"]
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+        assert client.get("/metrics").status_code == status
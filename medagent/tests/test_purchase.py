@@ -0,0 +1,102 @@
+import datetime
+import threading
+from decimal import Decimal
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.db import close_old_connections
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from sub.models import BoxMoney, Subscription, SubscriptionPlan
+from sub.purchase import InsufficientBalance, SubscriptionChanged, purchase_subscription
+from sub.views import PurchaseSubscriptionAPIView
+
+User = get_user_model()
+
+
+@pytest.fixture
+def plan(db):
+    return SubscriptionPlan.objects.create(name="31-day", days=31, price=300)
+
+
+def wallet(username, balance):
+    user = User.objects.create_user(username=username, password="pwd")
+    BoxMoney.objects.create(user=user, balance=balance)
+    return user
+
+
+@pytest.mark.django_db
+def test_purchase_creates_then_extends_subscription(plan):
+    user = wallet("buyer", 1000)
+
+    first = purchase_subscription(user.id, plan)
+    second = purchase_subscription(user.id, plan)
+
+    assert second.end_date - first.end_date == datetime.timedelta(days=31)
+    assert BoxMoney.objects.get(user=user).balance == Decimal("400")
+
+
+@pytest.mark.django_db
+def test_expired_subscription_restarts_from_now(plan):
+    user = wallet("lapsed", 300)
+    Subscription.objects.create(user=user, plan=plan, end_date=timezone.now() - datetime.timedelta(days=5))
+
+    subscription = purchase_subscription(user.id, plan)
+
+    assert subscription.is_active
+    assert subscription.end_date > timezone.now() + datetime.timedelta(days=30)
+
+
+@pytest.mark.django_db
+def test_stale_expected_end_date_rolls_back_the_debit(plan):
+    user = wallet("renewer", 300)
+    subscription = Subscription.objects.create(user=user, plan=plan, end_date=timezone.now() + datetime.timedelta(hours=3))
+
+    with pytest.raises(SubscriptionChanged):
+        purchase_subscription(user.id, plan, expected_end_date=subscription.end_date - datetime.timedelta(days=31))
+
+    assert BoxMoney.objects.get(user=user).balance == Decimal("300")
+    assert Subscription.objects.get(user=user).end_date == subscription.end_date
+
+
+@pytest.mark.django_db
+def test_insufficient_balance_writes_nothing(plan):
+    user = wallet("poor", 299)
+    with pytest.raises(InsufficientBalance):
+        purchase_subscription(user.id, plan)
+    assert BoxMoney.objects.get(user=user).balance == Decimal("299")
+    assert not Subscription.objects.filter(user=user).exists()
+
+    request = APIRequestFactory().post("/buy/", {"plan_id": plan.id})
+    force_authenticate(request, user=user)
+    assert PurchaseSubscriptionAPIView.as_view()(request).status_code == 402
+
+
+def test_concurrent_purchases_never_double_spend(file_database):
+    plan = SubscriptionPlan.objects.create(name="31-day", days=31, price=300)
+    # موجودی برای دقیقاً ۵ خرید کافی است و ۲۰ خرید هم‌زمان ارسال می‌شود
+    user = wallet("campaign", 1500)
+    outcomes, barrier = [], threading.Barrier(20)
+
+    def buy():
+        barrier.wait()
+        try:
+            purchase_subscription(user.id, plan)
+            outcomes.append("ok")
+        except InsufficientBalance:
+            outcomes.append("declined")
+        finally:
+            close_old_connections()
+
+    threads = [threading.Thread(target=buy) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=30)
+
+    assert outcomes.count("ok") == 5
+    assert outcomes.count("declined") == 15
+    assert BoxMoney.objects.get(user=user).balance == 0
+    subscription = Subscription.objects.get(user=user)
+    assert subscription.end_date - subscription.start_date >= datetime.timedelta(days=5 * 31) - datetime.timedelta(seconds=5)
@@ -0,0 +1,225 @@
+"""
+Query budgets and query plans for the API.
+
+Every route in ``medagent.roots`` and ``sub.roots`` has a maximum number of
+SQL statements per request, measured over seeded data with several plans,
+patients, access records and a 40-message session, so an N+1 shows up as a
+budget overrun rather than one extra query. Budgets hold on every backend
+CI uses. On SQLite the hot lookups are also run through ``EXPLAIN QUERY
+PLAN`` and must stay index searches without a temporary sort; the plan
+format is SQLite's own, so those checks are skipped elsewhere.
+"""
+
+import datetime
+import io
+import re
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from medagent import roots as medagent_roots
+from medagent.models import (
+    AccessHistory, ChatMessage, ChatSession, PatientProfile, PatientSummary, SessionSummary,
+)
+from medagent.otp import get_otp_backend
+from sub import roots as sub_roots
+from sub.models import BoxMoney, Subscription, SubscriptionPlan
+
+User = get_user_model()
+
+NATIONAL_CODES = ["0499370899", "0013542419", "0067749828"]
+
+
+class Seed:
+    pass
+
+
+@pytest.fixture
+def seed(db, settings):
+    settings.ROOT_URLCONF = "core.urls"
+    settings.OTP_BACKEND = "medagent.otp.DatabaseOTPBackend"
+    s = Seed()
+    s.plans = plans = [SubscriptionPlan.objects.create(name=f"{days}-day", days=days, price=days * 10) for days in (31, 93, 186, 365, 730)]
+    s.doctor = User.objects.create_user(username="budget-doctor", password="pwd")
+    s.doctor.groups.add(Group.objects.get_or_create(name="doctor")[0])
+    Subscription.objects.create(user=s.doctor, plan=plans[0], end_date=timezone.now() + datetime.timedelta(days=31))
+    BoxMoney.objects.create(user=s.doctor, balance=100000)
+    s.staff = User.objects.create_user(username="budget-staff", password="pwd", is_staff=True)
+    Subscription.objects.create(user=s.staff, plan=plans[1], end_date=timezone.now() + datetime.timedelta(days=93))
+
+    s.patients = []
+    for i, code in enumerate(NATIONAL_CODES):
+        user = User.objects.create_user(username=f"budget-patient-{i}", password="pwd")
+        s.patients.append(PatientProfile.objects.create(user=user, national_code=code, phone_number=f"0912000010{i}"))
+        for _ in range(3):
+            AccessHistory.objects.create(doctor=s.doctor, patient=s.patients[-1])
+    s.patient = s.patients[0]
+    PatientSummary.objects.create(patient=s.patient, json_data={"allergies": ["penicillin"]})
+
+    s.session = ChatSession.objects.create(owner=s.doctor, patient=s.patient, purpose="follow-up")
+    for i in range(20):
+        ChatMessage.objects.create(session=s.session, role="owner", content=f"سرفه‌ی خشک روز {i}")
+        ChatMessage.objects.create(session=s.session, role="assistant", content=f"پاسخ {i}")
+    SessionSummary.objects.create(session=s.session, text_summary="سرفه", json_summary={"chief_complaint": "سرفه"}, tokens_used=42)
+    # جلسه‌ی بدون خلاصه برای بستن
+    s.open_session = ChatSession.objects.create(owner=s.doctor, patient=s.patients[1])
+    ChatMessage.objects.create(session=s.open_session, role="owner", content="سردرد")
+
+    s.client = APIClient()
+    s.tokens = s.client.post("/api/auth/token/", {"username": "budget-doctor", "password": "pwd"}).data
+    s.client.credentials(HTTP_AUTHORIZATION=f"Bearer {s.tokens['access']}")
+    s.staff_client = APIClient()
+    s.staff_client.force_login(s.staff)
+    return s
+
+
+def _issue_otp(s):
+    get_otp_backend().issue(s.patient, "123456", doctor_id=s.doctor.id)
+
+
+def _onboarding_csv():
+    rows = "\n".join(f"{code},0912000020{i}" for i, code in enumerate(["0019786913", "0063358360", "0076210480"]))
+    upload = io.BytesIO(f"national_code,phone_number\n{rows}\n".encode())
+    upload.name = "patients.csv"
+    return upload
+
+
+def _streamed(response):
+    b"".join(response.streaming_content)
+    return response
+
+
+# مسیر → (سقف کوئری، آماده‌سازی بیرون از شمارش، درخواست)
+BUDGETS = {
+    # هر refresh صادرشده یک ردیف IssuedRefreshToken است
+    "api/auth/token/": (4, None, lambda s: APIClient().post(
+        "/api/auth/token/", {"username": "budget-doctor", "password": "pwd"})),
+    "api/auth/token/refresh/": (5, None, lambda s: APIClient().post(
+        "/api/auth/token/refresh/", {"refresh": s.tokens["refresh"]})),
+    "api/auth/token/revoke/": (1, None, lambda s: s.client.post(
+        "/api/auth/token/revoke/", {"refresh": s.tokens["refresh"]})),
+    # ارسال پیامک در تست‌ها همزمان است: برداشتن ردیف و ثبت نتیجه
+    "api/otp/request/": (5, None, lambda s: s.client.post(
+        "/api/otp/request/", {"national_code": s.patient.national_code})),
+    "api/otp/verify/": (4, _issue_otp, lambda s: s.client.post(
+        "/api/otp/verify/", {"national_code": s.patient.national_code, "code": "123456"})),
+    "api/session/create/": (3, None, lambda s: s.client.post(
+        "/api/session/create/", {"patient_id": s.patient.id})),
+    "api/session/<int:session_id>/message/": (6, None, lambda s: s.client.post(
+        f"/api/session/{s.session.id}/message/", {"session": s.session.id, "content": "سرفه دارم"})),
+    # ادغام خلاصه در PatientSummary در تست‌ها همزمان اجرا می‌شود (BACKGROUND_TASKS_EAGER)
+    "api/session/end/": (19, None, lambda s: s.client.patch(
+        "/api/session/end/", {"session_id": s.open_session.id})),
+    "api/patient/<int:patient_id>/summary/": (3, None, lambda s: s.client.get(
+        f"/api/patient/{s.patient.id}/summary/")),
+    "api/session/<int:session_id>/summary/": (3, None, lambda s: s.client.get(
+        f"/api/session/{s.session.id}/summary/")),
+    "api/session/<int:session_id>/messages/": (2, None, lambda s: s.client.get(
+        f"/api/session/{s.session.id}/messages/", {"limit": 20})),
+    "api/search/": (3, None, lambda s: s.client.get("/api/search/", {"q": "سرفه"})),
+    "api/patient/<int:patient_id>/export/": (5, None, lambda s: _streamed(s.staff_client.get(
+        f"/api/patient/{s.patient.id}/export/"))),
+    "api/patient/onboard/": (8, None, lambda s: s.staff_client.post(
+        "/api/patient/onboard/", {"file": _onboarding_csv()}, format="multipart")),
+    "metrics": (2, None, lambda s: s.staff_client.get("/metrics")),
+    "api/async/otp/request/": (5, None, lambda s: s.client.post(
+        "/api/async/otp/request/", {"national_code": s.patient.national_code}, format="json")),
+    "api/async/otp/verify/": (4, _issue_otp, lambda s: s.client.post(
+        "/api/async/otp/verify/", {"national_code": s.patient.national_code, "code": "123456"}, format="json")),
+    "api/async/session/<int:session_id>/message/": (6, None, lambda s: s.client.post(
+        f"/api/async/session/{s.session.id}/message/", {"content": "سرفه دارم"}, format="json")),
+    "api/async/session/end/": (19, None, lambda s: s.client.patch(
+        "/api/async/session/end/", {"session_id": s.open_session.id}, format="json")),
+    "plans/": (2, None, lambda s: s.client.get("/subplans/")),
+    "my-subscription/": (2, None, lambda s: s.client.get("/submy-subscription/")),
+    "buy/": (7, None, lambda s: s.client.post("/subbuy/", {"plan_id": s.plans[-1].id})),
+}
+
+# جریان SSE پایان ندارد؛ هزینه‌ی هر رویداد در test_events سنجیده می‌شود
+UNBUDGETED = {"api/session/<int:session_id>/events/"}
+
+# فهرست همه‌ی پلن‌ها ذاتاً کل جدول کوچک را می‌خواند
+FULL_SCANS = {("plans/", "sub_subscriptionplan")}
+
+
+def _call(seed, route):
+    _, prepare, request = BUDGETS[route]
+    if prepare is not None:
+        prepare(seed)
+    with CaptureQueriesContext(connection) as queries:
+        response = request(seed)
+    assert response.status_code < 300, getattr(response, "data", response)
+    return [q["sql"] for q in queries]
+
+
+# قالب خروجی EXPLAIN QUERY PLAN مخصوص SQLite است
+sqlite_plans = pytest.mark.skipif(connection.vendor != "sqlite", reason="query plans are checked on SQLite only")
+
+
+def _plan(sql):
+    with connection.cursor() as cursor:
+        cursor.execute("EXPLAIN QUERY PLAN " + sql)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def test_every_route_has_a_budget():
+    routes = {str(pattern.pattern) for pattern in medagent_roots.urlpatterns + sub_roots.urlpatterns}
+    assert routes - UNBUDGETED == set(BUDGETS)
+
+
+@pytest.mark.parametrize("route", sorted(BUDGETS))
+def test_query_budget(seed, route):
+    queries = _call(seed, route)
+    assert len(queries) <= BUDGETS[route][0], "\n".join(queries)
+    if connection.vendor != "sqlite":
+        return
+    for sql in queries:
+        if not sql.startswith("SELECT"):
+            continue
+        for step in _plan(sql):
+            # جدول مجازی FTS5 با MATCH از ایندکس خودش می‌خواند
+            if step.startswith("SCAN") and "VIRTUAL TABLE" not in step:
+                assert (route, step.split()[1]) in FULL_SCANS, f"{step}\n{sql}"
+
+
+# (شناسه، مسیر، جدول، ایندکسی که کوئری‌های مسیر روی آن جدول باید با آن جست‌وجو کنند)
+HOT_QUERIES = [
+    ("messages", "api/session/<int:session_id>/messages/", "medagent_chatmessage", "chatmsg_session_created_idx"),
+    ("export-messages", "api/patient/<int:patient_id>/export/", "medagent_chatmessage", "chatmsg_session_created_idx"),
+    ("otp-latest", "api/otp/verify/", "medagent_otpverification", "otp_patient_created_idx"),
+    ("access-summary", "api/patient/<int:patient_id>/summary/", "medagent_accesshistory", "access_doctor_patient_idx"),
+    ("access-create", "api/session/create/", "medagent_accesshistory", "access_doctor_patient_idx"),
+    ("access-search", "api/search/", "medagent_accesshistory", "access_doctor_patient_idx"),
+]
+
+
+def _assert_index_search(sql, table, index):
+    plan = _plan(sql)
+    steps = [step for step in plan if re.match(rf"(SEARCH|SCAN) {table} ", step)]
+    assert steps and all(step.startswith("SEARCH") and f" {index} " in step for step in steps), plan
+    assert not any("TEMP B-TREE" in step for step in plan), plan
+
+
+@sqlite_plans
+@pytest.mark.parametrize("route, table, index", [q[1:] for q in HOT_QUERIES], ids=[q[0] for q in HOT_QUERIES])
+def test_hot_query_plans(seed, route, table, index):
+    selects = [sql for sql in _call(seed, route) if sql.startswith("SELECT") and f'FROM "{table}"' in sql]
+    assert selects, f"{route} ran no query on {table}"
+    for sql in selects:
+        _assert_index_search(sql, table, index)
+
+
+@sqlite_plans
+def test_keyset_page_after_cursor_stays_on_index(seed):
+    cursor = seed.client.get(f"/api/session/{seed.session.id}/messages/", {"limit": 10}).data["next_cursor"]
+    with CaptureQueriesContext(connection) as queries:
+        response = seed.client.get(f"/api/session/{seed.session.id}/messages/", {"limit": 10, "cursor": cursor})
+    assert response.status_code == 200 and len(response.data["results"]) == 10
+    sql = next(q["sql"] for q in queries if 'FROM "medagent_chatmessage"' in q["sql"])
+    assert "created_at>?" in " ".join(_plan(sql))
+    _assert_index_search(sql, "medagent_chatmessage", "chatmsg_session_created_idx")
@@ -0,0 +1,91 @@
+import datetime
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from medagent.archive import archive_sessions
+from medagent.models import AccessHistory, ChatMessage, ChatSession, PatientProfile, SearchDocument, SessionSummary
+from medagent.persistence import save_exchange
+from medagent.search import normalize, search, terms
+from sub.models import Subscription, SubscriptionPlan
+
+User = get_user_model()
+
+
+def subscribed(username, national_code):
+    user = User.objects.create_user(username=username, password="pwd")
+    plan = SubscriptionPlan.objects.create(name=f"plan-{username}", days=31, price=0)
+    Subscription.objects.create(user=user, plan=plan, end_date=timezone.now() + datetime.timedelta(days=31))
+    PatientProfile.objects.create(user=user, national_code=national_code, phone_number="09120000000")
+    return user
+
+
+@pytest.fixture
+def owners(db):
+    first, second = subscribed("first", "7878787878"), subscribed("second", "8989898989")
+    session = ChatSession.objects.create(owner=first, patient=first.patientprofile)
+    save_exchange(session, "از دیروز دردِ قفسه‌ي سينه دارم", "درد قفسه سینه را جدی بگیرید.")
+    save_exchange(session, "سرفه هم دارم", "چند روز است؟")
+    SessionSummary.objects.create(session=session, text_summary="شکایت اصلی: درد قفسه سینه", json_summary={}, tokens_used=1)
+    other = ChatSession.objects.create(owner=second, patient=second.patientprofile)
+    save_exchange(other, "درد قفسه سینه بعد از ورزش", "استراحت کنید")
+    return first, second, session
+
+
+def test_normalize_folds_arabic_forms_diacritics_and_zwnj():
+    assert normalize("دَرْدِ قفسه‌ي سينه ك") == "درد قفسه ی سینه ک"
+    assert normalize("آب ۱۲ ٣") == "اب 12 3"
+    assert terms("می‌خواهم") == terms("می خواهم") == ["می", "خواهم"]
+
+
+def test_search_is_ranked_and_limited_to_readable_sessions(owners):
+    first, second, session = owners
+    results = search(first.id, "درد قفسه سينه", 10)
+
+    assert {r["session_id"] for r in results} == {session.id}
+    assert {r["kind"] for r in results} == {"message", "summary"}
+    assert all("قفسه" in r["snippet"] for r in results)
+    assert search(first.id, 'سرفه" OR scope : (o1', 10) == []
+    assert len(search(first.id, "سرفه", 10)) == 1
+
+    # پزشک پس از دسترسی OTP جلسه‌های بیمار را هم پیدا می‌کند
+    doctor = User.objects.create_user(username="doctor", password="pwd")
+    assert search(doctor.id, "قفسه", 10) == []
+    AccessHistory.objects.create(doctor=doctor, patient=second.patientprofile)
+    assert [r["patient_id"] for r in search(doctor.id, "قفسه", 10)] == [second.patientprofile.id]
+
+
+def test_index_follows_edits_deletes_and_archival(owners, settings, tmp_path):
+    first, _, session = owners
+    message = ChatMessage.objects.create(session=session, role="owner", content="تب شدید")
+    assert len(search(first.id, "تب", 10)) == 1
+    message.content = "لرز"
+    message.save()
+    assert search(first.id, "تب", 10) == [] and len(search(first.id, "لرز", 10)) == 1
+    message.delete()
+    assert search(first.id, "لرز", 10) == []
+
+    settings.ARCHIVE_DIR = str(tmp_path)
+    ChatSession.objects.filter(id=session.id).update(ended_at=timezone.now() - datetime.timedelta(days=400))
+    archive_sessions(days=30)
+    assert len(search(first.id, "سرفه", 10)) == 1
+    session.delete()
+    assert not SearchDocument.objects.filter(session_id=session.id).exists()
+
+
+def test_database_backend_and_endpoint(owners, settings):
+    first, _, session = owners
+    settings.SEARCH_BACKEND = "medagent.search.DatabaseSearchBackend"
+    assert len(search(first.id, "قفسه سينه", 10)) == 3
+
+    settings.SEARCH_BACKEND = "medagent.search.FTS5SearchBackend"
+    client = APIClient()
+    client.force_authenticate(user=first)
+    assert client.get("/api/search/").status_code == 400
+    page = client.get("/api/search/", {"q": "قفسه", "limit": 2}).json()
+    assert len(page["results"]) == 2 and page["next_offset"] == 2
+    rest = client.get("/api/search/", {"q": "قفسه", "limit": 2, "offset": 2}).json()
+    assert len(rest["results"]) == 1 and rest["next_offset"] is None
@@ -0,0 +1,94 @@
+import datetime
+import io
+
+import pytest
+from django.core.management import call_command
+from django.utils import timezone
+
+from medagent import sms
+from medagent.models import SMSDelivery
+
+
+@pytest.mark.django_db
+def test_dispatch_sms_delivers_and_tracks_status():
+    delivery = sms.dispatch_sms("09120000019", "کد: 123456")
+    delivery.refresh_from_db()
+    assert delivery.status == SMSDelivery.SENT
+    assert delivery.attempts == 1
+    assert sms.get_provider().outbox == [{"phone": "09120000019", "text": "کد: 123456", "template": "otp_doctor"}]
+
+
+@pytest.mark.django_db
+def test_dispatch_sms_retries_transport_errors(settings):
+    settings.SMS_MAX_ATTEMPTS = 3
+    sms.get_provider().fail_times = 2
+    delivery = sms.dispatch_sms("09120000019", "x")
+    delivery.refresh_from_db()
+    assert delivery.status == SMSDelivery.SENT
+    assert delivery.attempts == 3
+
+    sms.get_provider().fail_times = 3
+    delivery = sms.dispatch_sms("09120000019", "x")
+    delivery.refresh_from_db()
+    assert delivery.status == SMSDelivery.FAILED
+    assert delivery.last_error
+
+
+def test_provider_is_reused_per_process():
+    assert sms.get_provider() is sms.get_provider()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_background_queue_runs_after_commit(settings):
+    settings.BACKGROUND_TASKS_EAGER = False
+    delivery = sms.dispatch_sms("09120000019", "x")
+    sms.sms_queue.join()
+    delivery.refresh_from_db()
+    assert delivery.status == SMSDelivery.SENT
+
+
+@pytest.mark.django_db
+def test_unexpected_error_fails_the_row(monkeypatch):
+    def broken(*args, **kwargs):
+        raise RuntimeError("provider misconfigured")
+
+    monkeypatch.setattr(sms.get_provider(), "send", broken)
+    delivery = sms.dispatch_sms("09120000019", "x")
+    delivery.refresh_from_db()
+    assert delivery.status == SMSDelivery.FAILED
+    assert delivery.last_error == "RuntimeError: provider misconfigured"
+    assert delivery.text == ""
+
+
+@pytest.mark.django_db
+def test_requeue_stale_deliveries():
+    now = timezone.now()
+    stale = SMSDelivery.objects.create(receptor="09120000019", text="کد: 111111")
+    old = SMSDelivery.objects.create(receptor="09120000019", text="کد: 222222")
+    fresh = SMSDelivery.objects.create(receptor="09120000019", text="کد: 333333")
+    SMSDelivery.objects.filter(id=stale.id).update(created_at=now - datetime.timedelta(minutes=5))
+    SMSDelivery.objects.filter(id=old.id).update(created_at=now - datetime.timedelta(hours=1))
+
+    call_command("requeue_sms", stdout=io.StringIO())
+
+    stale.refresh_from_db(); old.refresh_from_db(); fresh.refresh_from_db()
+    assert (stale.status, stale.text) == (SMSDelivery.SENT, "")
+    assert (old.status, old.last_error) == (SMSDelivery.FAILED, "expired before delivery")
+    # ردیفی که هنوز ممکن است در صف یک worker باشد دوباره فرستاده نمی‌شود
+    assert fresh.status == SMSDelivery.QUEUED
+    assert [m["text"] for m in sms.get_provider().outbox] == ["کد: 111111"]
+
+
+@pytest.mark.django_db
+def test_deliver_claims_the_row_before_sending():
+    delivery = sms.dispatch_sms("09120000019", "کد: 111111")
+    # اجرای هم‌زمان requeue_sms همان ردیف را دوباره به صف می‌دهد
+    sms.deliver(delivery.id, "09120000019", "کد: 111111")
+    assert len(sms.get_provider().outbox) == 1
+
+    stuck = SMSDelivery.objects.create(receptor="09120000019", text="کد: 222222", status=SMSDelivery.SENDING)
+    SMSDelivery.objects.filter(id=stuck.id).update(created_at=timezone.now() - datetime.timedelta(hours=1))
+    call_command("requeue_sms", stdout=io.StringIO())
+    stuck.refresh_from_db()
+    assert (stuck.status, stuck.text) == (SMSDelivery.FAILED, "")
+    assert len(sms.get_provider().outbox) == 1
@@ -0,0 +1,130 @@
+import datetime
+import threading
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.test.utils import CaptureQueriesContext
+from django.db import close_old_connections, connection
+from django.utils import timezone
+
+from medagent import sms
+from medagent.models import PatientProfile, SMSDelivery
+from sub.models import BoxMoney, Subscription, SubscriptionPlan
+from sub import renewal
+from sub.renewal import EXPIRING_TEMPLATE, RENEWED_TEMPLATE, run_renewal_job
+
+User = get_user_model()
+
+
+@pytest.fixture
+def plan(db):
+    return SubscriptionPlan.objects.create(name="31-day", days=31, price=300)
+
+
+def subscriber(plan, name, ends_in, auto_renew=False, balance=0, phone=True):
+    user = User.objects.create_user(username=name, password="pwd")
+    if phone:
+        PatientProfile.objects.create(user=user, national_code=name[-10:].rjust(10, "0"), phone_number="0912" + name[-7:].rjust(7, "0"))
+    BoxMoney.objects.create(user=user, balance=balance)
+    return Subscription.objects.create(
+        user=user, plan=plan, end_date=timezone.now() + ends_in, auto_renew=auto_renew,
+    )
+
+
+def test_queryset_filters(plan):
+    soon = subscriber(plan, "u1", datetime.timedelta(days=2))
+    later = subscriber(plan, "u2", datetime.timedelta(days=20))
+    gone = subscriber(plan, "u3", -datetime.timedelta(days=1))
+
+    assert set(Subscription.objects.active()) == {soon, later}
+    assert list(Subscription.objects.expired()) == [gone]
+    assert list(Subscription.objects.expiring_within(datetime.timedelta(days=7))) == [soon]
+
+
+def test_job_renews_and_notifies_once(plan, settings):
+    settings.SUBSCRIPTION_JOB_BATCH_SIZE = 2
+    renews = subscriber(plan, "r1", datetime.timedelta(hours=3), auto_renew=True, balance=300)
+    broke = subscriber(plan, "r2", datetime.timedelta(hours=3), auto_renew=True, balance=10)
+    manual = [subscriber(plan, f"m{i}", datetime.timedelta(days=2)) for i in range(3)]
+    nophone = subscriber(plan, "nophone", datetime.timedelta(days=1), phone=False)
+    subscriber(plan, "far", datetime.timedelta(days=20))
+
+    result = run_renewal_job()
+
+    assert result == {"renewed": 1, "declined": 1, "notified": 4}
+    renews.refresh_from_db()
+    assert renews.end_date > timezone.now() + datetime.timedelta(days=31)
+    assert renews.expiry_notified_at is None
+    outbox = sms.get_provider().outbox
+    assert [m["template"] for m in outbox].count(RENEWED_TEMPLATE) == 1
+    assert [m["template"] for m in outbox].count(EXPIRING_TEMPLATE) == 4
+    assert SMSDelivery.objects.filter(status=SMSDelivery.SENT).count() == 5
+    assert all(Subscription.objects.get(pk=s.pk).expiry_notified_at for s in manual + [broke])
+    # بدون شماره‌ای برای ارسال، اعلان‌شده حساب نمی‌شود
+    nophone.refresh_from_db()
+    assert nophone.expiry_notified_at is None
+
+    assert run_renewal_job() == {"renewed": 0, "declined": 1, "notified": 0}
+
+
+def test_notices_cost_constant_queries_per_chunk(plan, settings):
+    settings.SUBSCRIPTION_JOB_BATCH_SIZE = 50
+    settings.BACKGROUND_TASKS_EAGER = False
+    for i in range(40):
+        subscriber(plan, f"q{i}", datetime.timedelta(days=1))
+    with CaptureQueriesContext(connection) as queries:
+        run_renewal_job()
+    # plans + one chunk of renewals; one chunk, claim UPDATE, claimed ids, bulk INSERT and the empty next chunk for notices
+    assert len(queries) <= 8
+
+
+def test_rows_claimed_by_an_overlapping_run_are_skipped(plan, monkeypatch):
+    subscriber(plan, "o1", datetime.timedelta(days=2))
+    subscriber(plan, "o2", datetime.timedelta(days=2))
+    real_iter_chunks = renewal.iter_chunks
+
+    def racing(queryset, size):
+        for chunk in real_iter_chunks(queryset, size):
+            # اجرای هم‌زمان دیگری بین خواندن و علامت‌زدن یکی از ردیف‌ها را برمی‌دارد
+            Subscription.objects.filter(user__username="o1").update(
+                expiry_notified_at=timezone.now() - datetime.timedelta(seconds=1)
+            )
+            yield chunk
+
+    monkeypatch.setattr(renewal, "iter_chunks", racing)
+    assert run_renewal_job()["notified"] == 1
+    assert [m["phone"] for m in sms.get_provider().outbox] == ["0912" + "o2".rjust(7, "0")]
+
+
+def test_overlapping_renewal_runs_charge_once(file_database, monkeypatch):
+    plan = SubscriptionPlan.objects.create(name="31-day", days=31, price=300)
+    rows = [subscriber(plan, f"c{i}", datetime.timedelta(hours=3), auto_renew=True, balance=600) for i in range(5)]
+    barrier = threading.Barrier(2)
+    real_iter_chunks = renewal.iter_chunks
+    results = []
+
+    def synced(queryset, size):
+        for chunk in real_iter_chunks(queryset, size):
+            # هر دو اجرا پیش از هر برداشتی همان ردیف‌ها را خوانده‌اند
+            barrier.wait(timeout=10)
+            yield chunk
+
+    def run():
+        try:
+            results.append(renewal.renew_due())
+        finally:
+            close_old_connections()
+
+    monkeypatch.setattr(renewal, "iter_chunks", synced)
+    threads = [threading.Thread(target=run) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=30)
+
+    assert sum(result["renewed"] for result in results) == 5
+    for row in rows:
+        ended = row.end_date
+        row.refresh_from_db()
+        assert row.end_date - ended == datetime.timedelta(days=31)
+        assert BoxMoney.objects.get(user_id=row.user_id).balance == 300
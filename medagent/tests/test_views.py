@@ -42,7 +42,8 @@ def test_authentication_required(api_client):
     assert response.status_code in {401, 403}
 
 @pytest.mark.django_db
-def test_otp_flow_for_active_subscription(monkeypatch, api_client, subscription_plan):
+def test_otp_flow_for_active_subscription(monkeypatch, settings, api_client, subscription_plan):
+    settings.OTP_BACKEND = "medagent.otp.DatabaseOTPBackend"
     # Setup user with active subscription and patient profile
     user = create_user_with_subscription("otpuser", subscription_plan)
     patient_profile = PatientProfile.objects.create(user=user, national_code="5555555555", phone_number="09120000007")
@@ -130,6 +131,25 @@ def test_post_message_with_profanity(monkeypatch, api_client, subscription_plan)
     msg = ChatMessage.objects.filter(session_id=session_id, role="owner").first()
     assert msg.content == "[پیام حاوی کلمات نامناسب بود]"
 
+@pytest.mark.django_db
+def test_post_message_keeps_owner_message_when_agent_fails(monkeypatch, api_client, subscription_plan):
+    user = create_user_with_subscription("agentfail", subscription_plan)
+    profile = PatientProfile.objects.create(user=user, national_code="1414141414", phone_number="09120000015")
+    api_client.force_authenticate(user=user)
+    session_id = api_client.post("/api/session/create/", {"patient_id": profile.id}).data["session_id"]
+    monkeypatch.setattr("medagent.tools.ProfanityCheckTool._run", lambda self, text: "True" if "bad" in text else "False")
+
+    def broken_agent(msg):
+        raise RuntimeError("agent down")
+    monkeypatch.setattr("medagent.agent_setup.agent.run", broken_agent)
+
+    for content in ("Hello", "bad words"):
+        with pytest.raises(RuntimeError):
+            api_client.post(f"/api/session/{session_id}/message/", {"content": content})
+    # پیام پزشک مثل قبل ذخیره و در صورت نیاز پاک‌سازی می‌شود؛ پاسخی ذخیره نمی‌شود
+    contents = list(ChatMessage.objects.filter(session_id=session_id).order_by("id").values_list("role", "content"))
+    assert contents == [("owner", "Hello"), ("owner", "[پیام حاوی کلمات نامناسب بود]")]
+
 @pytest.mark.django_db
 def test_end_session_and_summary(monkeypatch, api_client, subscription_plan):
     # Setup user and session
@@ -169,3 +189,87 @@ def test_get_summaries_and_patient_summary_endpoint(api_client, subscription_pla
     response = api_client.get(f"/api/session/{session.id}/summary/")
     assert response.status_code == 200
     assert response.data["text_summary"] == "t"
+
+@pytest.mark.django_db
+def test_session_messages_keyset_pagination(api_client, subscription_plan):
+    user = create_user_with_subscription("pager", subscription_plan)
+    profile = PatientProfile.objects.create(user=user, national_code="3434343434", phone_number="09120000015")
+    session = ChatSession.objects.create(owner=user, patient=profile)
+    for i in range(5):
+        ChatMessage.objects.create(session=session, role="assistant", content=f"m{i}")
+    api_client.force_authenticate(user=user)
+
+    response = api_client.get(f"/api/session/{session.id}/messages/", {"limit": 3})
+    assert response.status_code == 200
+    assert [m["content"] for m in response.data["results"]] == ["m0", "m1", "m2"]
+    assert response.data["has_more"] is True
+
+    cursor = response.data["next_cursor"]
+    response = api_client.get(f"/api/session/{session.id}/messages/", {"limit": 3, "cursor": cursor})
+    assert [m["content"] for m in response.data["results"]] == ["m3", "m4"]
+    assert response.data["has_more"] is False
+
+    # پرس‌وجوی دوره‌ای با آخرین cursor فقط پیام‌های جدید را برمی‌گرداند
+    cursor = response.data["next_cursor"]
+    response = api_client.get(f"/api/session/{session.id}/messages/", {"cursor": cursor})
+    assert response.data["results"] == []
+    assert response.data["next_cursor"] == cursor
+    ChatMessage.objects.create(session=session, role="assistant", content="m5")
+    response = api_client.get(f"/api/session/{session.id}/messages/", {"cursor": cursor})
+    assert [m["content"] for m in response.data["results"]] == ["m5"]
+
+@pytest.mark.django_db
+def test_session_messages_requires_owner_or_access(api_client, subscription_plan):
+    owner = create_user_with_subscription("msgowner", subscription_plan)
+    stranger = create_user_with_subscription("stranger", subscription_plan)
+    profile = PatientProfile.objects.create(user=owner, national_code="4545454545", phone_number="09120000016")
+    session = ChatSession.objects.create(owner=owner, patient=profile)
+    api_client.force_authenticate(user=stranger)
+    response = api_client.get(f"/api/session/{session.id}/messages/")
+    assert response.status_code == 403
+    AccessHistory.objects.create(doctor=stranger, patient=profile)
+    response = api_client.get(f"/api/session/{session.id}/messages/")
+    assert response.status_code == 200
+    response = api_client.get(f"/api/session/{session.id}/messages/", {"cursor": "!!"})
+    assert response.status_code == 400
+
+@pytest.mark.django_db
+def test_summary_conditional_get_and_invalidation(api_client, subscription_plan):
+    user = create_user_with_subscription("poller", subscription_plan)
+    profile = PatientProfile.objects.create(user=user, national_code="5656565656", phone_number="09120000017")
+    summary = PatientSummary.objects.create(patient=profile, json_data={"v": 1})
+    api_client.force_authenticate(user=user)
+    url = f"/api/patient/{profile.id}/summary/"
+
+    response = api_client.get(url)
+    assert response.status_code == 200
+    etag = response["ETag"]
+    assert response["Last-Modified"]
+
+    response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+    assert response.content == b""
+
+    # ذخیره‌ی خلاصه، ETag و محتوای کش را باطل می‌کند
+    summary.json_data = {"v": 2}
+    summary.save()
+    response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response.data["json_data"] == {"v": 2}
+    assert response["ETag"] != etag
+
+    session = ChatSession.objects.create(owner=user, patient=profile)
+    SessionSummary.objects.create(session=session, text_summary="t", json_summary={}, tokens_used=1)
+    response = api_client.get(f"/api/session/{session.id}/summary/")
+    assert response.status_code == 200
+    etag = response["ETag"]
+    response = api_client.get(f"/api/session/{session.id}/summary/", HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+
+    # ویرایش خلاصه‌ی جلسه (مثلاً در admin) هم ETag را عوض می‌کند
+    edited = SessionSummary.objects.get(session=session)
+    edited.text_summary = "edited"
+    edited.save()
+    response = api_client.get(f"/api/session/{session.id}/summary/", HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response.data["text_summary"] == "edited"
@@ -2,21 +2,83 @@
 LangChain tool definitions for the MedAgent agent.
 
 These tools provide access to patient summaries, session summarization,
-vision analysis, and profanity checking. All tools are compatible with
-LangChain v0.1.47+ and follow best practices for future-proofing.
+vision analysis, profanity checking and the local medical knowledge base. All tools are compatible with
+LangChain v0.1.47+ and follow best practices for future-proofing. Every tool
+also implements ``_arun`` so the agent can be driven from async views.
+
+Tools derive from ``GatedTool``: inside a speculative agent run started by
+medagent.moderation, each call waits for the moderation verdict and is
+refused if the input was flagged, so no tool side effect runs on flagged text.
 """
 
 from __future__ import annotations
 
+import asyncio
+import contextvars
 import json
+import threading
 from typing import Any
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from langchain.tools import BaseTool
+from medagent.model_router import estimate_tokens, router
 from medagent.models import PatientSummary, AccessHistory, ChatMessage, SessionSummary
 
 
+# ---------------------- مهار ابزارها در اجرای حدسی ----------------------
+class ModerationRejected(Exception):
+    """Raised to a speculative agent run whose input was flagged."""
+
+
+class ModerationGate:
+    """Verdict of a pending moderation check, awaited by gated tool calls."""
+
+    def __init__(self, asynchronous: bool = False):
+        self._decided = asyncio.Event() if asynchronous else threading.Event()
+        self.flagged = None
+
+    def decide(self, flagged: bool) -> None:
+        self.flagged = flagged
+        self._decided.set()
+
+    def wait(self) -> None:
+        self._decided.wait()
+        self._raise_if_flagged()
+
+    async def await_verdict(self) -> None:
+        await self._decided.wait()
+        self._raise_if_flagged()
+
+    def _raise_if_flagged(self) -> None:
+        if self.flagged:
+            raise ModerationRejected("agent input was flagged by moderation")
+
+
+# فقط در context اجرای حدسی مقدار دارد
+moderation_gate: contextvars.ContextVar[ModerationGate | None] = contextvars.ContextVar(
+    "moderation_gate", default=None
+)
+
+
+class GatedTool(BaseTool):
+    """Agent tool whose calls wait for a pending moderation verdict."""
+
+    def run(self, *args, **kwargs):
+        gate = moderation_gate.get()
+        if gate is not None:
+            gate.wait()
+        return super().run(*args, **kwargs)
+
+    async def arun(self, *args, **kwargs):
+        gate = moderation_gate.get()
+        if gate is not None:
+            await gate.await_verdict()
+        return await super().arun(*args, **kwargs)
+
+
 # ---------------------- خلاصه وضعیت بیمار ----------------------
-class GetPatientSummaryTool(BaseTool):
+class GetPatientSummaryTool(GatedTool):
     name: str = "get_patient_summary"
     description: str = (
         "دریافت خلاصه بیمار با استفاده از user_id و patient_id (ورودی: dict). "
@@ -49,12 +111,12 @@ class GetPatientSummaryTool(BaseTool):
             # مطابق نیاز: رشته پیام خطا برگردانده می‌شود
             return "خلاصه‌ای برای بیمار یافت نشد"
 
-    def _arun(self, *args: Any, **kwargs: Any):
-        raise NotImplementedError("async not supported")
+    async def _arun(self, tool_input: dict) -> str:
+        return await sync_to_async(self._run)(tool_input)
 
 
 # ---------------------- خلاصه‌سازی جلسه ----------------------
-class SummarizeSessionTool(BaseTool):
+class SummarizeSessionTool(GatedTool):
     name: str = "summarize_session"
     description: str = (
         "خلاصه‌سازی مکالمات یک جلسه با استفاده از session_id (ورودی: str). "
@@ -62,18 +124,48 @@ class SummarizeSessionTool(BaseTool):
     )
 
     def _run(self, session_id: str) -> str:
+        return self.summarize(session_id)
+
+    async def _arun(self, session_id: str) -> str:
+        return await self.asummarize(session_id)
+
+    def summarize(self, session_id, session=None) -> str:
+        """
+        Summarize and store a session. Views that already hold the ChatSession
+        pass it as ``session`` so indexing the new summary does not load it again.
+        """
         # import داخل متد تا monkeypatch در تست‌ها موثر باشد
         from medagent.talkbot_client import tb_chat
 
         # دریافت پیام‌ها
-        messages_qs = ChatMessage.objects.filter(session_id=session_id).order_by("created_at")
-        if not messages_qs.exists():
+        messages = self._messages(session_id)
+        if not messages:
             return "هیچ پیامی برای خلاصه‌سازی یافت نشد"
 
-        messages = [{"role": m.role, "content": m.content} for m in messages_qs]
-
         # تماس با مدل و parse نتیجه
-        result = tb_chat(messages, model="o3-mini")
+        result = tb_chat(messages, model=router.choose("summary", estimate_tokens(messages)))
+        return self._store(session_id, result, session)
+
+    async def asummarize(self, session_id, session=None) -> str:
+        from medagent.talkbot_client import atb_chat
+
+        messages = await sync_to_async(self._messages)(session_id)
+        if not messages:
+            return "هیچ پیامی برای خلاصه‌سازی یافت نشد"
+
+        result = await atb_chat(messages, model=router.choose("summary", estimate_tokens(messages)))
+        return await sync_to_async(self._store)(session_id, result, session)
+
+    @staticmethod
+    def _messages(session_id: str) -> list[dict]:
+        return [
+            {"role": role, "content": content}
+            for role, content in ChatMessage.objects.filter(session_id=session_id)
+            .order_by("created_at").values_list("role", "content")
+        ]
+
+    @staticmethod
+    def _store(session_id: str, result: str, session=None) -> str:
         try:
             summary_data = json.loads(result)
         except Exception:
@@ -81,20 +173,21 @@ class SummarizeSessionTool(BaseTool):
             return "خطا در خلاصه‌سازی"
 
         # ذخیرهٔ خلاصه
-        SessionSummary.objects.create(
+        summary = SessionSummary(
             session_id=session_id,
             text_summary=summary_data.get("text_summary", ""),
             json_summary=summary_data,
             tokens_used=summary_data.get("token_count", 0),
         )
+        if session is not None:
+            # signal نمایه‌سازی جلسه را از همین شیء می‌خواند
+            summary.session = session
+        summary.save()
         return "خلاصه‌سازی انجام شد"
 
-    def _arun(self, *args: Any, **kwargs: Any):
-        raise NotImplementedError("async not supported")
-
 
 # ---------------------- تحلیل تصویر ----------------------
-class ImageAnalysisTool(BaseTool):
+class ImageAnalysisTool(GatedTool):
     name: str = "analyze_image"
     description: str = (
         "آپلود تصویر پزشکی (مسیر فایل) به مدل GPT-4 Vision / Gemini Vision و "
@@ -118,12 +211,13 @@ class ImageAnalysisTool(BaseTool):
     def is_single_input(self) -> bool:  # pragma: no cover - override for agent
         return True
 
-    def _arun(self, *args: Any, **kwargs: Any):
-        raise NotImplementedError("async not supported")
+    async def _arun(self, image_path: str, prompt: str | None = None) -> str:
+        # خواندن فایل و درخواست HTTP در thread جداگانه اجرا می‌شوند
+        return await sync_to_async(self._run, thread_sensitive=False)(image_path, prompt)
 
 
 # ---------------------- پالایش محتوا ----------------------
-class ProfanityCheckTool(BaseTool):
+class ProfanityCheckTool(GatedTool):
     name: str = "check_profanity"
     description: str = (
         "بررسی وجود کلمات نامناسب در متن (ورودی: str). "
@@ -134,8 +228,15 @@ class ProfanityCheckTool(BaseTool):
         # import داخل متد تا monkeypatch در تست‌ها موثر باشد
         from medagent.talkbot_client import profanity
 
-        result = profanity(text)
+        return self._interpret(profanity(text))
+
+    async def _arun(self, text: str) -> str:
+        from medagent.talkbot_client import aprofanity
+
+        return self._interpret(await aprofanity(text))
 
+    @staticmethod
+    def _interpret(result: Any) -> str:
         # پشتیبانی از هر دو خروجی ممکن: bool یا dict
         if isinstance(result, bool):
             return str(result)
@@ -145,5 +246,28 @@ class ProfanityCheckTool(BaseTool):
         # خروجی ناشناخته
         return "False"
 
-    def _arun(self, *args: Any, **kwargs: Any):
-        raise NotImplementedError("async not supported")
+
+# ---------------------- پایگاه دانش پزشکی ----------------------
+class MedicalKnowledgeTool(GatedTool):
+    name: str = "search_medical_knowledge"
+    description: str = (
+        "جست‌وجو در پایگاه دانش پزشکی محلی (ورودی: پرسش به صورت str). "
+        "چند بخش مرتبط را به صورت JSON با source، heading و text برمی‌گرداند."
+    )
+
+    def _run(self, query: str) -> str:
+        from medagent.knowledge import get_index
+
+        index = get_index()
+        if index is None:
+            return "پایگاه دانش پزشکی هنوز ساخته نشده است"
+        # امتیاز BM25 برای مدل بی‌فایده است و فقط توکن مصرف می‌کند
+        passages = [
+            {"source": hit["source"], "heading": hit["heading"], "text": hit["text"]}
+            for hit in index.search(query, settings.MEDICAL_KB_TOP_K)
+        ]
+        return json.dumps(passages, ensure_ascii=False)
+
+    async def _arun(self, query: str) -> str:
+        # اولین دسترسی به صفحه‌های mmap ممکن است از دیسک بخواند
+        return await sync_to_async(self._run, thread_sensitive=False)(query)
@@ -2,32 +2,66 @@
 REST API views for the MedAgent application.
 
 These views implement OTP request/verification, chat session management, posting
-messages, ending sessions, and retrieving summaries. The views enforce
+messages, ending sessions, and retrieving summaries and transcripts. The views enforce
 authentication and subscription permissions where appropriate and rely on
 auxiliary modules for sending SMS and interacting with the agent.
 """
 
 import random
+from django.contrib.auth import authenticate
+from django.core.handlers.asgi import ASGIRequest
 from django.utils import timezone
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
-from medagent.permissions import HasActiveSubscription
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.tokens import RefreshToken
+from medagent.archive import rehydrate
+from medagent.authentication import (
+    STATELESS_AUTHENTICATION_CLASSES,
+    issue_tokens,
+    revoke_token,
+    rotate_refresh,
+    user_is_doctor,
+)
+from medagent.permissions import CanReadMetrics, HasActiveSubscription
 from medagent.serializers import (
     OTPRequestSerializer, OTPVerifySerializer,
-    CreateSessionSerializer, ChatMessageSerializer,
+    CreateSessionSerializer, ChatMessageSerializer, MessageContentSerializer,
     EndSessionSerializer, PatientSummarySerializer,
-    SessionSummarySerializer
+    SessionSummarySerializer, TokenObtainSerializer,
+    TokenRefreshSerializer, TokenRevokeSerializer
 )
 from medagent.models import (
-    PatientProfile, OTPVerification, AccessHistory,
+    PatientProfile, AccessHistory,
     ChatSession, ChatMessage, SessionSummary, PatientSummary
 )
-from medagent.sms import send_sms
-from medagent.tools import SummarizeSessionTool, ProfanityCheckTool
+from medagent.events import publish_session_event
+from medagent.export import COMPRESSIONS, FORMATS, aexport_chunks, export_chunks, export_filename
+from medagent.idempotency import has_idempotency_key, idempotent
+from medagent.llm_scheduler import INTERACTIVE, SUMMARY, llm_work
+from medagent.onboarding import FORMATS as ONBOARDING_FORMATS, onboard, read_rows
+from medagent.otp import get_otp_backend
+from medagent.pagination import keyset_page, parse_page_size
+from medagent.moderation import moderated_reply
+from medagent.persistence import save_exchange, save_owner_message
+from medagent.profiling import render_metrics
+from medagent.search import search
+from medagent.sms import dispatch_sms
+from medagent.summary_cache import summary_response
+from medagent.tools import SummarizeSessionTool
+
+
+def can_read_session(user, session) -> bool:
+    """مالک جلسه یا پزشکی با دسترسی OTP به بیمار می‌تواند جلسه را بخواند."""
+    if session.owner_id == user.id:
+        return True
+    return AccessHistory.objects.filter(doctor_id=user.id, patient_id=session.patient_id).exists()
 
 class RequestOTP(APIView):
+    authentication_classes = STATELESS_AUTHENTICATION_CLASSES
     permission_classes = [IsAuthenticated, HasActiveSubscription]
 
     def post(self, request):
@@ -37,11 +71,12 @@ class RequestOTP(APIView):
 
         patient = get_object_or_404(PatientProfile, national_code=nc)
         raw = f"{random.randint(0, 999999):06d}"
-        OTPVerification.create(patient, raw)
-        send_sms(patient.phone_number, f"کد دسترسی شما: {raw}")
+        get_otp_backend().issue(patient, raw, doctor_id=request.user.id)
+        dispatch_sms(patient.phone_number, f"کد دسترسی شما: {raw}")
         return Response({"msg": "OTP sent"}, status=200)
 
 class VerifyOTP(APIView):
+    authentication_classes = STATELESS_AUTHENTICATION_CLASSES
     permission_classes = [IsAuthenticated, HasActiveSubscription]
 
     def post(self, request):
@@ -50,14 +85,14 @@ class VerifyOTP(APIView):
         nc, code = ser.validated_data.values()
 
         patient = get_object_or_404(PatientProfile, national_code=nc)
-        otp = OTPVerification.objects.filter(patient=patient).latest("created_at")
-        if not otp.valid(code) and AccessHistory.objects.filter(doctor=request.user, patient=patient).exists():
+        if not get_otp_backend().verify(patient, code, doctor_id=request.user.id):
             return Response({"error": "OTP نامعتبر یا منقضی"}, status=400)
 
-        AccessHistory.objects.create(doctor=request.user, patient=patient)
+        AccessHistory.objects.create(doctor_id=request.user.id, patient=patient)
         return Response({"msg": "Access granted", "patient_id": patient.id}, status=200)
 
 class CreateSession(APIView):
+    authentication_classes = STATELESS_AUTHENTICATION_CLASSES
     permission_classes = [IsAuthenticated, HasActiveSubscription]
 
     def post(self, request):
@@ -65,75 +100,249 @@ class CreateSession(APIView):
         ser.is_valid(raise_exception=True)
         patient = get_object_or_404(PatientProfile, id=ser.validated_data["patient_id"])
 
-        # تشخیص پزشک با بررسی عضویت در گروه doctor
-        is_doctor = request.user.groups.filter(name__iexact="doctor").exists()
-        if is_doctor and patient.user != request.user:
-            if not AccessHistory.objects.filter(doctor=request.user, patient=patient).exists():
+        # تشخیص پزشک با بررسی عضویت در گروه doctor (یا claim توکن JWT)
+        is_doctor = user_is_doctor(request.user)
+        if is_doctor and patient.user_id != request.user.id:
+            if not AccessHistory.objects.filter(doctor_id=request.user.id, patient=patient).exists():
                 return Response({"error": "no OTP access"}, status=403)
 
         session = ChatSession.objects.create(
-            owner=request.user,
+            owner_id=request.user.id,
             patient=patient,
             purpose=ser.validated_data.get("purpose", "")
         )
         return Response({"session_id": session.id}, status=201)
 
 class PostMessage(APIView):
+    authentication_classes = STATELESS_AUTHENTICATION_CLASSES
     permission_classes = [IsAuthenticated, HasActiveSubscription]
 
+    @idempotent
     def post(self, request, session_id):
         session = get_object_or_404(ChatSession, id=session_id, ended_at__isnull=True)
-        if session.owner != request.user:
+        if session.owner_id != request.user.id:
             return Response({"error": "not owner"}, status=403)
 
-        ser = ChatMessageSerializer(data=request.data)
+        # فیلد session بدنه دوباره از پایگاه‌داده خوانده نمی‌شود؛ جلسه از URL است
+        ser = MessageContentSerializer(data=request.data)
         ser.is_valid(raise_exception=True)
         content = ser.validated_data["content"]
 
-        # Check for profanity
-        if ProfanityCheckTool()._run(content) == "True":
-            content = "[پیام حاوی کلمات نامناسب بود]"
-
-        ChatMessage.objects.create(session=session, role="owner", content=content)
         from medagent.agent_setup import agent
 
-        
-        reply = agent.run(content)
-        ChatMessage.objects.create(session=session, role="assistant", content=reply)
+        # بررسی ناسزا؛ در حالت خط‌لوله هم‌زمان با اجرای حدسی عامل
+        try:
+            with llm_work(INTERACTIVE, request.user.id):
+                content, reply = moderated_reply(content, agent.run)
+        except Exception:
+            # پیام پزشک حتی با خطای عامل ذخیره می‌شود، مگر آنکه تکرار با همان
+            # Idempotency-Key کل تبادل را دوباره ذخیره کند
+            if not has_idempotency_key(request):
+                save_owner_message(session, content)
+            raise
+        # هر دو پیام و رکوردهای تاریخچه در یک تراکنش ذخیره می‌شوند
+        _, assistant = save_exchange(session, content, reply)
+        publish_session_event(session.id, "assistant_message", message=ChatMessageSerializer(assistant).data)
         return Response({"assistant_reply": reply})
 
 class EndSession(APIView):
+    authentication_classes = STATELESS_AUTHENTICATION_CLASSES
     permission_classes = [IsAuthenticated, HasActiveSubscription]
 
+    @idempotent
     def patch(self, request):
         ser = EndSessionSerializer(data=request.data)
         ser.is_valid(raise_exception=True)
-        sess = get_object_or_404(ChatSession, id=ser.validated_data["session_id"], owner=request.user)
+        sess = get_object_or_404(ChatSession, id=ser.validated_data["session_id"], owner_id=request.user.id)
+        rehydrate(sess)
 
         sess.ended_at = timezone.now()
         sess.save(update_fields=["ended_at"])
 
-        SummarizeSessionTool()._run(str(sess.id))
+        with llm_work(SUMMARY, request.user.id):
+            SummarizeSessionTool().summarize(sess.id, sess)
+        publish_session_event(sess.id, "session_closed")
         return Response({"msg": "session closed & summarized"})
 
 class GetPatientSummary(APIView):
+    authentication_classes = STATELESS_AUTHENTICATION_CLASSES
     permission_classes = [IsAuthenticated, HasActiveSubscription]
+    read_replica = True
 
     def get(self, request, patient_id):
-        summary = get_object_or_404(PatientSummary, patient_id=patient_id)
-        patient_user = summary.patient.user
+        # فقط فراداده خوانده می‌شود؛ json_data تنها در صورت نیاز بارگذاری می‌شود
+        meta = PatientSummary.objects.filter(patient_id=patient_id).values(
+            "id", "patient__user_id", "updated_at"
+        ).first()
+        if meta is None:
+            raise Http404
         # فقط خود بیمار یا پزشکی که OTP دارد می‌تواند خلاصه را ببیند
-        if request.user != patient_user and not AccessHistory.objects.filter(doctor=request.user, patient=summary.patient).exists():
+        if request.user.id != meta["patient__user_id"] and not AccessHistory.objects.filter(doctor_id=request.user.id, patient_id=patient_id).exists():
             return Response({"error": "access denied"}, status=403)
-        return Response(PatientSummarySerializer(summary).data)
+        return summary_response(
+            request, "patient", patient_id, meta["updated_at"],
+            lambda: PatientSummarySerializer(PatientSummary.objects.get(id=meta["id"])).data,
+        )
 
 class GetSessionSummary(APIView):
+    authentication_classes = STATELESS_AUTHENTICATION_CLASSES
     permission_classes = [IsAuthenticated, HasActiveSubscription]
+    read_replica = True
 
     def get(self, request, session_id):
-        summ = get_object_or_404(SessionSummary, session_id=session_id)
-        session = summ.session
+        session = get_object_or_404(ChatSession, id=session_id)
         # مالک جلسه یا پزشکی با دسترسی OTP می‌تواند خلاصه را ببیند
-        if request.user != session.owner and not AccessHistory.objects.filter(doctor=request.user, patient=session.patient).exists():
+        if not can_read_session(request.user, session):
+            return Response({"error": "access denied"}, status=403)
+        rehydrate(session)
+        meta = SessionSummary.objects.filter(session_id=session_id).values("id", "updated_at").first()
+        if meta is None:
+            raise Http404
+        return summary_response(
+            request, "session", session_id, meta["updated_at"],
+            lambda: SessionSummarySerializer(SessionSummary.objects.get(id=meta["id"])).data,
+        )
+
+class SessionMessages(APIView):
+    authentication_classes = STATELESS_AUTHENTICATION_CLASSES
+    permission_classes = [IsAuthenticated, HasActiveSubscription]
+    read_replica = True
+
+    def get(self, request, session_id):
+        session = get_object_or_404(ChatSession, id=session_id)
+        if not can_read_session(request.user, session):
             return Response({"error": "access denied"}, status=403)
-        return Response(SessionSummarySerializer(summ).data)
+        # جلسه‌ی بایگانی‌شده پیش از خواندن پیام‌ها از فایل segment بازگردانده می‌شود
+        rehydrate(session)
+
+        limit = parse_page_size(request.query_params.get("limit"))
+        items, next_cursor, has_more = keyset_page(
+            ChatMessage.objects.filter(session_id=session.id),
+            request.query_params.get("cursor"),
+            limit,
+        )
+        return Response({
+            "results": ChatMessageSerializer(items, many=True).data,
+            "next_cursor": next_cursor,
+            "has_more": has_more,
+        })
+
+class SearchTranscripts(APIView):
+    """Ranked full-text search over the messages and summaries the user may read."""
+    authentication_classes = STATELESS_AUTHENTICATION_CLASSES
+    permission_classes = [IsAuthenticated, HasActiveSubscription]
+    read_replica = True
+
+    def get(self, request):
+        query = request.query_params.get("q", "").strip()
+        if not query:
+            return Response({"error": "q is required"}, status=400)
+        limit = parse_page_size(request.query_params.get("limit"))
+        try:
+            offset = max(0, int(request.query_params.get("offset", 0)))
+        except ValueError:
+            return Response({"error": "invalid offset"}, status=400)
+        # یک ردیف اضافه برای تشخیص وجود صفحه‌ی بعد
+        results = search(request.user.id, query, limit + 1, offset)
+        return Response({
+            "results": results[:limit],
+            "next_offset": offset + limit if len(results) > limit else None,
+        })
+
+class ExportTranscripts(APIView):
+    """Stream a patient's sessions, summaries and messages for compliance (staff only)."""
+    authentication_classes = STATELESS_AUTHENTICATION_CLASSES
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, patient_id):
+        get_object_or_404(PatientProfile, id=patient_id)
+        # پارامتر format را DRF برای انتخاب renderer رزرو کرده است
+        fmt = request.query_params.get("fmt", "ndjson")
+        compression = request.query_params.get("compression") or None
+        if fmt not in FORMATS or (compression and compression not in COMPRESSIONS):
+            return Response({"error": "unsupported fmt or compression"}, status=400)
+        # زیر ASGI تکرارکننده‌ی sync پیش از ارسال کامل در حافظه جمع می‌شود
+        chunks = aexport_chunks if isinstance(request._request, ASGIRequest) else export_chunks
+        response = StreamingHttpResponse(
+            chunks(patient_id, fmt, compression),
+            content_type="application/octet-stream" if compression else f"{FORMATS[fmt]}; charset=utf-8",
+        )
+        response["Content-Disposition"] = f'attachment; filename="{export_filename(patient_id, fmt, compression)}"'
+        return response
+
+
+class OnboardPatients(APIView):
+    """Bulk-create patient profiles from an uploaded CSV or JSONL file (staff only)."""
+    authentication_classes = STATELESS_AUTHENTICATION_CLASSES
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        upload = request.FILES.get("file")
+        fmt = request.query_params.get("fmt") or (upload.name.rsplit(".", 1)[-1].lower() if upload else "")
+        if upload is None or fmt not in ONBOARDING_FORMATS:
+            return Response({"error": "upload a csv or jsonl file"}, status=400)
+        try:
+            start = max(0, int(request.query_params.get("start", 0)))
+        except ValueError:
+            return Response({"error": "invalid start"}, status=400)
+        # فایل آپلودشده به‌صورت جریانی خوانده می‌شود و هر دسته تراکنش جداگانه دارد
+        report = onboard(read_rows(upload.file, fmt), start=start)
+        return Response(report.as_dict(), status=201 if report.created else 200)
+
+
+class Metrics(APIView):
+    """Request histograms, LLM scheduler and model router state in the Prometheus text format."""
+    authentication_classes = STATELESS_AUTHENTICATION_CLASSES
+    permission_classes = [CanReadMetrics]
+
+    def get(self, request):
+        return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def _token_pair(refresh):
+    return {"refresh": str(refresh), "access": str(refresh.access_token)}
+
+class ObtainToken(APIView):
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        ser = TokenObtainSerializer(data=request.data)
+        ser.is_valid(raise_exception=True)
+        user = authenticate(request, **ser.validated_data)
+        if user is None or not user.is_active:
+            return Response({"error": "invalid credentials"}, status=401)
+        return Response(_token_pair(issue_tokens(user)))
+
+class RefreshTokenPair(APIView):
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        ser = TokenRefreshSerializer(data=request.data)
+        ser.is_valid(raise_exception=True)
+        try:
+            refresh = rotate_refresh(ser.validated_data["refresh"])
+        except InvalidToken as e:
+            return Response({"error": str(e.detail)}, status=401)
+        return Response(_token_pair(refresh))
+
+class RevokeToken(APIView):
+    authentication_classes = STATELESS_AUTHENTICATION_CLASSES
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        ser = TokenRevokeSerializer(data=request.data)
+        ser.is_valid(raise_exception=True)
+        if "refresh" in ser.validated_data:
+            try:
+                refresh = RefreshToken(ser.validated_data["refresh"])
+            except TokenError as e:
+                raise InvalidToken(e.args[0])
+            if refresh["user_id"] != str(request.user.id):
+                return Response({"error": "not owner"}, status=403)
+            revoke_token(refresh)
+        # توکن دسترسی همین درخواست هم باطل می‌شود
+        if request.auth is not None and hasattr(request.auth, "payload"):
+            revoke_token(request.auth)
+        return Response({"msg": "token revoked"})
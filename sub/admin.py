@@ -1,5 +1,7 @@
+from datetime import timedelta
+
 from django.contrib import admin
-from .models import SubscriptionPlan, Subscription
+from .models import SubscriptionPlan, Subscription, BoxMoney
 
 
 
@@ -8,7 +10,35 @@ from .models import SubscriptionPlan, Subscription
 class SubscriptionPlanAdmin(admin.ModelAdmin):
     list_display = ('name', 'days', 'price')
 
+class SubscriptionStatusFilter(admin.SimpleListFilter):
+    title = 'status'
+    parameter_name = 'status'
+
+    def lookups(self, request, model_admin):
+        return [('active', 'active'), ('expiring', 'expiring within 7 days'), ('expired', 'expired')]
+
+    def queryset(self, request, queryset):
+        # فیلتر در SQL روی ایندکس end_date، نه با is_active برای تک‌تک ردیف‌ها
+        if self.value() == 'active':
+            return queryset.active()
+        if self.value() == 'expiring':
+            return queryset.expiring_within(timedelta(days=7))
+        if self.value() == 'expired':
+            return queryset.expired()
+        return queryset
+
+
 @admin.register(Subscription)
 class SubscriptionAdmin(admin.ModelAdmin):
-    list_display = ('user', 'plan', 'start_date', 'end_date', 'is_active')
+    list_display = ('user', 'plan', 'start_date', 'end_date', 'is_active', 'auto_renew')
+    list_filter = (SubscriptionStatusFilter, 'auto_renew')
+    list_select_related = ('user', 'plan')
     readonly_fields = ('is_active',)
+
+    @admin.display(boolean=True, ordering='end_date')
+    def is_active(self, obj):
+        return obj.is_active
+
+@admin.register(BoxMoney)
+class BoxMoneyAdmin(admin.ModelAdmin):
+    list_display = ('user', 'balance')
@@ -0,0 +1,19 @@
+"""Renew auto-renewing subscriptions and send expiry notices (see sub.renewal)."""
+
+from django.core.management.base import BaseCommand
+
+from sub.renewal import run_renewal_job
+
+
+class Command(BaseCommand):
+    help = "Renew due auto-renew subscriptions and queue expiry SMS notices in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None)
+
+    def handle(self, *args, **options):
+        result = run_renewal_job(batch_size=options["batch_size"])
+        self.stdout.write(
+            f"Renewed {result['renewed']} subscriptions ({result['declined']} declined), "
+            f"sent {result['notified']} expiry notices."
+        )
@@ -3,10 +3,14 @@ Minimal subscription models used for testing the medagent application.
 
 A SubscriptionPlan represents purchasable plans with a duration and price.
 A Subscription associates a user with a plan and uses start/end dates to
-determine whether it is active.
+determine whether it is active; ``Subscription.objects.active()`` and
+``expiring_within()`` answer the same question in SQL over the end_date
+index. BoxMoney is the user's wallet that pays for
+plans.
 """
 
 from django.db import models
+from django.db.models import F
 from django.utils import timezone
 from django.contrib.auth import get_user_model
 
@@ -28,16 +32,42 @@ class SubscriptionPlan(models.Model):
     def __str__(self):
         return f"{self.name} ({self.days}d, {self.price})"
 
+class SubscriptionQuerySet(models.QuerySet):
+    def active(self, now=None):
+        return self.filter(end_date__gte=now or timezone.now())
+
+    def expired(self, now=None):
+        return self.filter(end_date__lt=now or timezone.now())
+
+    def expiring_within(self, delta, now=None):
+        """Active subscriptions whose end_date falls in the next ``delta``."""
+        now = now or timezone.now()
+        return self.filter(end_date__gte=now, end_date__lt=now + delta)
+
+
 class Subscription(models.Model):
     """
     Associates a user with a subscription plan and keeps track of start and end dates.
 
     A subscription is considered active if the current time is before the end_date.
+    ``auto_renew`` lets sub.renewal charge the wallet before the end date, and
+    ``expiry_notified_at`` records the expiry notice for the current period
+    (a purchase clears it).
     """
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='subscription')
     plan = models.ForeignKey(SubscriptionPlan, on_delete=models.PROTECT)
     start_date = models.DateTimeField(auto_now_add=True)
     end_date = models.DateTimeField()
+    auto_renew = models.BooleanField(default=False)
+    expiry_notified_at = models.DateTimeField(null=True, blank=True)
+
+    objects = SubscriptionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # active() / expiring_within() و کار شبانه‌ی تمدید روی end_date فیلتر می‌کنند
+            models.Index(fields=["end_date"], name="sub_end_date_idx"),
+        ]
 
     def __str__(self):
         return f"Subscription({self.user.username}, plan={self.plan}, active={self.is_active})"
@@ -45,3 +75,31 @@ class Subscription(models.Model):
     @property
     def is_active(self) -> bool:
         return timezone.now() <= self.end_date
+
+class BoxMoney(models.Model):
+    """
+    A user's wallet. Balances are in the same units as plan prices.
+
+    Debits are conditional single-statement updates
+    (``UPDATE ... SET balance = balance - x WHERE balance >= x``), so two
+    concurrent purchases can never spend the same money and no row lock is
+    held across round trips.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='box_money')
+    balance = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"BoxMoney({self.user.username}, balance={self.balance})"
+
+    @classmethod
+    def debit(cls, user_id, amount) -> bool:
+        """Atomically take ``amount`` from the wallet; False if the balance is too low."""
+        return cls.objects.filter(user_id=user_id, balance__gte=amount).update(balance=F('balance') - amount) == 1
+
+    def has_sufficient_balance(self, amount) -> bool:
+        return self.balance >= amount
+
+    def deduct_amount(self, amount) -> None:
+        if not BoxMoney.debit(self.user_id, amount):
+            raise ValueError("Insufficient balance")
+        self.refresh_from_db(fields=['balance'])
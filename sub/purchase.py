@@ -0,0 +1,73 @@
+"""
+Purchase engine for subscription plans.
+
+``purchase_subscription`` debits the wallet and extends or creates the
+subscription in one short transaction:
+
+1. a conditional debit, ``UPDATE box_money SET balance = balance - price
+   WHERE user_id = ? AND balance >= price``; if no row matches, the
+   purchase fails with InsufficientBalance and nothing is written;
+2. a single UPDATE that extends an active subscription from its current
+   end date, or restarts an expired one from now;
+3. an INSERT only if the user never had a subscription.
+
+Auto-renewal passes the ``end_date`` it read as ``expected_end_date``; the
+extension then also matches on it, and if another run has already moved
+the end date, ``SubscriptionChanged`` rolls the debit back.
+
+No row is read before it is written, so there is no read-modify-write race
+and no SELECT ... FOR UPDATE. Locks are held only for the few statements of
+the transaction.
+"""
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from .models import BoxMoney, Subscription
+
+
+class InsufficientBalance(Exception):
+    pass
+
+
+class SubscriptionChanged(Exception):
+    """The subscription no longer ends at the expected date; nothing was charged."""
+
+
+def _extend(user_id, plan, now, expected_end_date=None):
+    days = timezone.timedelta(days=plan.days)
+    active = When(end_date__gte=now, then=F('end_date') + days)
+    subscriptions = Subscription.objects.filter(user_id=user_id)
+    if expected_end_date is not None:
+        subscriptions = subscriptions.filter(end_date=expected_end_date)
+    return subscriptions.update(
+        plan=plan,
+        # اشتراک فعال از انتهای فعلی تمدید می‌شود و اشتراک منقضی از اکنون
+        start_date=Case(When(end_date__gte=now, then=F('start_date')), default=Value(now)),
+        end_date=Case(active, default=Value(now + days)),
+        expiry_notified_at=None,
+    )
+
+
+def purchase_subscription(user_id, plan, expected_end_date=None) -> Subscription:
+    """Charge ``plan.price`` to the user's wallet and extend their subscription."""
+    now = timezone.now()
+    with transaction.atomic():
+        if not BoxMoney.debit(user_id, plan.price):
+            raise InsufficientBalance
+        if expected_end_date is not None:
+            if not _extend(user_id, plan, now, expected_end_date):
+                # اجرای دیگری زودتر تمدید کرد؛ خروج از atomic برداشت را برمی‌گرداند
+                raise SubscriptionChanged
+        elif not _extend(user_id, plan, now):
+            try:
+                with transaction.atomic():
+                    Subscription.objects.create(
+                        user_id=user_id, plan=plan, start_date=now,
+                        end_date=now + timezone.timedelta(days=plan.days),
+                    )
+            except IntegrityError:
+                # خرید هم‌زمان دیگری همین حالا اشتراک را ساخت؛ تمدید روی آن اعمال می‌شود
+                _extend(user_id, plan, now)
+    return Subscription.objects.select_related('plan').get(user_id=user_id)
@@ -0,0 +1,123 @@
+"""
+Batch expiry notices and auto-renewal for subscriptions.
+
+``run_renewal_job`` is meant to run periodically (the ``renew_subscriptions``
+management command). It selects rows through the end_date index and walks
+them in chunks of ``settings.SUBSCRIPTION_JOB_BATCH_SIZE`` instead of loading
+every subscription:
+
+1. active subscriptions with ``auto_renew`` that end within
+   ``settings.SUBSCRIPTION_RENEW_AHEAD_HOURS`` are renewed through
+   ``purchase_subscription`` (the same conditional wallet debit the buy
+   endpoint uses), and their owners get a "renewed" SMS. The extension is
+   conditional on the end date this run read, so when runs overlap only
+   one of them charges and extends each row;
+2. subscriptions that end within ``settings.SUBSCRIPTION_NOTICE_DAYS`` and
+   have not been notified for this period get an "expiring" SMS, including
+   auto-renewals that failed for lack of balance. Each chunk is first
+   claimed with one conditional UPDATE of ``expiry_notified_at``, and only
+   the rows this run claimed are messaged, so overlapping runs never send a
+   notice twice. A purchase clears the field again.
+
+Phone numbers come from the owner's ``PatientProfile``; doctors have no
+phone number anywhere in the schema, so their subscriptions are left
+unnotified (and uncounted) until one is recorded.
+
+Each chunk's messages are queued with one ``dispatch_sms_bulk`` call.
+Chunks are read with keyset pagination on the primary key, so rows the job
+itself updates are neither skipped nor visited twice.
+"""
+
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from medagent.sms import dispatch_sms_bulk
+
+from .models import Subscription, SubscriptionPlan
+from .purchase import InsufficientBalance, SubscriptionChanged, purchase_subscription
+
+logger = logging.getLogger(__name__)
+
+RENEWED_TEMPLATE = "subscription_renewed"
+EXPIRING_TEMPLATE = "subscription_expiring"
+
+_FIELDS = ("id", "user_id", "plan_id", "end_date", "user__patientprofile__phone_number")
+
+
+def iter_chunks(queryset, size):
+    """Yield lists of ``values_list(*_FIELDS)`` rows, ``size`` at a time, ordered by pk."""
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(pk__gt=last_id).order_by("pk").values_list(*_FIELDS)[:size])
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1][0]
+
+
+def renew_due(now=None, batch_size=None) -> dict:
+    """Renew auto-renewing subscriptions that are about to end."""
+    now = now or timezone.now()
+    batch_size = batch_size or settings.SUBSCRIPTION_JOB_BATCH_SIZE
+    ahead = timedelta(hours=settings.SUBSCRIPTION_RENEW_AHEAD_HOURS)
+    due = Subscription.objects.expiring_within(ahead, now=now).filter(auto_renew=True)
+    plans = {plan.id: plan for plan in SubscriptionPlan.objects.all()}
+    renewed = declined = 0
+    for chunk in iter_chunks(due, batch_size):
+        notices = []
+        for _, user_id, plan_id, end_date, phone in chunk:
+            try:
+                subscription = purchase_subscription(user_id, plans[plan_id], expected_end_date=end_date)
+            except InsufficientBalance:
+                # اعلان انقضا در مرحله‌ی بعد برای این کاربر ارسال می‌شود
+                declined += 1
+                continue
+            except SubscriptionChanged:
+                # اجرای هم‌زمان یا خرید دستی پس از خواندن این ردیف تمدید کرد
+                continue
+            renewed += 1
+            if phone:
+                end = timezone.localtime(subscription.end_date).date().isoformat()
+                notices.append((phone, f"اشتراک شما تمدید شد و تا {end} فعال است."))
+        if notices:
+            dispatch_sms_bulk(notices, RENEWED_TEMPLATE)
+    return {"renewed": renewed, "declined": declined}
+
+
+def notify_expiring(now=None, batch_size=None) -> int:
+    """Send one expiry notice per subscription period; returns how many rows were marked."""
+    now = now or timezone.now()
+    batch_size = batch_size or settings.SUBSCRIPTION_JOB_BATCH_SIZE
+    window = timedelta(days=settings.SUBSCRIPTION_NOTICE_DAYS)
+    # ردیف بدون شماره‌ی تلفن اعلانی نمی‌گیرد و علامت هم نمی‌خورد
+    pending = Subscription.objects.expiring_within(window, now=now).filter(
+        expiry_notified_at__isnull=True, user__patientprofile__phone_number__gt="",
+    )
+    notified = 0
+    for chunk in iter_chunks(pending, batch_size):
+        claimed = Subscription.objects.filter(id__in=[row[0] for row in chunk], expiry_notified_at__isnull=True)
+        if not claimed.update(expiry_notified_at=now):
+            continue
+        # فقط ردیف‌هایی که همین اجرا علامت زده (اجرای هم‌زمان زمان دیگری ثبت می‌کند)
+        ours = set(Subscription.objects.filter(
+            id__in=[row[0] for row in chunk], expiry_notified_at=now,
+        ).values_list("id", flat=True))
+        notices = [
+            (phone, f"اشتراک شما در تاریخ {timezone.localtime(end_date).date().isoformat()} به پایان می‌رسد.")
+            for subscription_id, _, _, end_date, phone in chunk
+            if subscription_id in ours
+        ]
+        dispatch_sms_bulk(notices, EXPIRING_TEMPLATE)
+        notified += len(notices)
+    return notified
+
+
+def run_renewal_job(now=None, batch_size=None) -> dict:
+    now = now or timezone.now()
+    result = renew_due(now=now, batch_size=batch_size)
+    result["notified"] = notify_expiring(now=now, batch_size=batch_size)
+    logger.info("Subscription job: %s", result)
+    return result
@@ -4,13 +4,14 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
-from .models import SubscriptionPlan, Subscription, BoxMoney
+from .models import SubscriptionPlan, Subscription
+from .purchase import InsufficientBalance, purchase_subscription
 from .serializers import SubscriptionPlanSerializer, SubscriptionSerializer
-from django.utils import timezone
 
 # لیست پلن‌ها
 class SubscriptionPlanListAPIView(APIView):
     permission_classes = [IsAuthenticated]
+    read_replica = True
 
     def get(self, request):
         plans = SubscriptionPlan.objects.all()
@@ -23,7 +24,8 @@ class UserSubscriptionAPIView(APIView):
 
     def get(self, request):
         try:
-            subscription = Subscription.objects.get(user=request.user)
+            # plan در همان کوئری خوانده می‌شود؛ serializer آن را تو در تو برمی‌گرداند
+            subscription = Subscription.objects.select_related('plan').get(user=request.user)
             serializer = SubscriptionSerializer(subscription)
             return Response(serializer.data)
         except Subscription.DoesNotExist:
@@ -43,32 +45,10 @@ class PurchaseSubscriptionAPIView(APIView):
         except SubscriptionPlan.DoesNotExist:
             return Response({'detail': 'پلن مورد نظر یافت نشد.'}, status=status.HTTP_404_NOT_FOUND)
 
-        box_money = request.user.box_money
-        if not box_money.has_sufficient_balance(plan.price):
-            return Response({'detail': 'موجودی کیف پول کافی نیست.'}, status=status.HTTP_402_PAYMENT_REQUIRED)
-        
-        # کسر موجودی
-        box_money.deduct_amount(int(plan.price))
-
-        # ایجاد یا تمدید اشتراک
-        now = timezone.now()
         try:
-            subscription = Subscription.objects.get(user=request.user)
-            # تمدید: اگر اشتراک فعال است، تاریخ پایان جدید از انتهای فعلی محاسبه می‌شود
-            if subscription.is_active:
-                subscription.end_date += timezone.timedelta(days=plan.days)
-            else:
-                subscription.plan = plan
-                subscription.start_date = now
-                subscription.end_date = now + timezone.timedelta(days=plan.days)
-            subscription.plan = plan  # اگر کاربر پلن جدید می‌خرد
-            subscription.save()
-        except Subscription.DoesNotExist:
-            subscription = Subscription.objects.create(
-                user=request.user,
-                plan=plan,
-                start_date=now,
-                end_date=now + timezone.timedelta(days=plan.days)
-            )
+            # کسر موجودی و ایجاد/تمدید اشتراک در یک تراکنش کوتاه
+            subscription = purchase_subscription(request.user.id, plan)
+        except InsufficientBalance:
+            return Response({'detail': 'موجودی کیف پول کافی نیست.'}, status=status.HTTP_402_PAYMENT_REQUIRED)
         serializer = SubscriptionSerializer(subscription)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
\ No newline at end of file
+        return Response(serializer.data, status=status.HTTP_201_CREATED)